@@ -1,22 +1,47 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 from pymongo import MongoClient
 import os
+import functools
+import hashlib
+import io
 import json
+import uuid
 from dotenv import load_dotenv
 
 # --- Import moduli locali (per dashboard burocrazia) ---
-from src.utils import create_synthetic_logs, load_csv, load_pdf
+from src.utils import create_synthetic_logs, load_csv, load_pdf_with_report
+from src.charts import activity_chart, activity_png, workload_chart, workload_png
+from src.export import export_widget
+from src.index import cell_partials, index_clinicians, select_partials, select_rows
+from src.shared import shared_log_index
+from src.perf import records, stage, start_run, to_jsonl, to_prometheus
+from src.timeseries import bucket_aggregates, rolling_trend, workload_trend
+from src.partitioned import log_paths
+from src.pipeline import run_kpis
+from src import kpi_duckdb
+from src.snapshots import (
+    current_version,
+    file_signature,
+    load_snapshot,
+    snapshot_kpis,
+    snapshot_matches,
+    snapshot_prediction,
+)
 from src.kpi import (
     share_time_by_activity,
     clinicians_workload,
+    clinician_overlaps,
     outlier_visits,
     kpi_overview,
+    approx_partial,
+    merge_approx,
+    kpi_overview_approx,
+    outlier_visits_approx,
 )
 from src.prediction import (
     load_and_preprocess_data,
-    train_and_save_model,
+    train_evaluate_and_save_best_model,
     load_model_and_predict,
 )
 
@@ -84,9 +109,223 @@ if MONGO_URI:
         pazienti_collection = None
         ricoveri_simulati_collection = None
 
+# --- Caricamento log burocrazia con indice reparto/clinico ---
+# Il log viene ordinato e indicizzato una sola volta per sorgente: i rerun
+# successivi riusano la cache e i filtri diventano fette del log ordinato.
+# cache_resource invece di cache_data: tutte le sessioni ricevono lo stesso log
+# memory-mapped (src/shared.py) invece di una copia deserializzata a ogni rerun;
+# con Copy-on-Write i filtri di una sessione non toccano i dati condivisi.
+def impronta_log(*parti) -> str:
+    # impronta breve della sorgente: calcolata una volta nel loader in cache,
+    # così le chiavi di sketch e trend non ripassano i byte caricati a ogni rerun
+    h = hashlib.blake2b(digest_size=16)
+    for parte in parti:
+        h.update(parte if isinstance(parte, bytes) else repr(parte).encode())
+    return h.hexdigest()
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def logs_sintetici_indicizzati(n_visits: int, n_clinicians: int, seed: int):
+    df, indice = shared_log_index(create_synthetic_logs(n_visits=n_visits, n_clinicians=n_clinicians, seed=seed))
+    return df, indice, impronta_log("sintetici", n_visits, n_clinicians, seed)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def logs_csv_indicizzati(raw: bytes):
+    return (*shared_log_index(load_csv(io.BytesIO(raw))), impronta_log("csv", raw))
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def logs_pdf_indicizzati(raw: bytes):
+    # le righe scartate in conversione vengono restituite a parte, per mostrarle
+    df, scarti = load_pdf_with_report(io.BytesIO(raw))
+    return (*shared_log_index(df), impronta_log("pdf", raw), scarti)
+
+LOG_LOADERS = {"sintetici": logs_sintetici_indicizzati, "csv": logs_csv_indicizzati, "pdf": logs_pdf_indicizzati}
+
+def carica_log(sorgente: tuple):
+    # sorgente = (tipo, argomenti del loader); restituisce (log, indice, impronta[, scarti])
+    tipo, *args = sorgente
+    return LOG_LOADERS[tipo](*args)
+
+# KPI approssimati: sketch per cella reparto/clinico costruiti una volta per
+# sorgente (chiave: impronta del log) e condivisi; a ogni rerun si uniscono solo
+# quelli selezionati
+@st.cache_resource(max_entries=8, show_spinner=False)
+def sketch_celle(impronta: str, _df: pd.DataFrame, _indice: dict):
+    return cell_partials(_df, _indice, functools.partial(approx_partial, k=ANTEPRIMA_RIGHE))
+
+def sketch_selezione(impronta: str, log: pd.DataFrame, indice: dict, selezione: tuple | None):
+    """Sketch unito delle celle filtrate, o None se i KPI sono esatti (toggle spento o log senza indice)."""
+    if not kpi_approssimati or selezione is None:
+        return None
+    parziali = select_partials(sketch_celle(impronta, log, indice), *selezione)
+    return merge_approx(*parziali) if parziali else None
+
+# Snapshot precalcolati (python -m src.pipeline --snapshot-dir): la versione
+# attiva si rilegge da CURRENT a ogni rerun, quindi una nuova versione pubblicata
+# arriva anche alle sessioni già aperte. Ogni versione è caricata una sola volta
+# per processo e condivisa in sola lettura tra le sessioni.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def snapshot_versione(versione: str):
+    return load_snapshot(SNAPSHOT_DIR, versione)
+
+def snapshot_attivo():
+    versione = current_version(SNAPSHOT_DIR)
+    return snapshot_versione(versione) if versione else None
+
+@st.cache_data(show_spinner=False)
+def kpi_partizionati(firma: list, workers: int, motore: str):
+    # firma = (percorso, dimensione, mtime) dei file: la cache scade se cambiano
+    percorsi = [percorso for percorso, _, _ in firma]
+    # stesso calcolo della pipeline batch: pandas a partizioni o DuckDB (workers = thread)
+    return run_kpis(percorsi, motore, workers)
+
+def filtra_log(df: pd.DataFrame, indice: dict) -> tuple[pd.DataFrame, tuple | None]:
+    """
+    Mostra i filtri reparto/clinico nella sidebar e restituisce il log filtrato
+    e la selezione (reparti, clinici; None = tutti), None se il log non ha indice.
+    Con l'indice i filtri non scansionano il log; se tutto è selezionato il log
+    torna invariato.
+    """
+    st.sidebar.subheader("Filtri Reparto")
+    aree_principali = ["Tutte le aree"] + list(REPARTI.keys())
+    area_selezionata = st.sidebar.selectbox("Area Principale", aree_principali)
+
+    if area_selezionata == "Tutte le aree":
+        lista_reparti = ["Tutti i reparti"] + sorted([reparto for sublist in REPARTI.values() for reparto in sublist])
+    else:
+        lista_reparti = ["Tutti i reparti"] + sorted(REPARTI[area_selezionata])
+
+    reparto_selezionato = st.sidebar.selectbox("Reparto Specifico", lista_reparti)
+
+    if reparto_selezionato != "Tutti i reparti":
+        reparti_filtro = [reparto_selezionato]
+    elif area_selezionata != "Tutte le aree":
+        reparti_filtro = REPARTI[area_selezionata]
+    else:
+        reparti_filtro = None
+
+    st.sidebar.subheader("Filtri Clinico")
+    if indice:
+        clinicians = index_clinicians(indice, reparti_filtro)
+        selected_clin = st.sidebar.multiselect("Filtra per clinico", options=clinicians, default=clinicians)
+        # tutti i clinici selezionati: nessun filtro da applicare
+        clin_filtro = None if len(selected_clin) == len(clinicians) else selected_clin
+        return select_rows(df, indice, reparti_filtro, clin_filtro), (reparti_filtro, clin_filtro)
+
+    # log senza colonne indicizzabili: filtro classico
+    if reparti_filtro is not None and "department" in df.columns:
+        df = df[df["department"].isin(reparti_filtro)]
+    if 'clinician_id' in df.columns:
+        clinicians = sorted(df["clinician_id"].unique())
+        selected_clin = st.sidebar.multiselect("Filtra per clinico", options=clinicians, default=clinicians)
+        if len(selected_clin) != len(clinicians):
+            df = df[df["clinician_id"].isin(selected_clin)]
+    return df, None
+
+def schede_kpi(df: pd.DataFrame, sketch: dict | None):
+    """
+    Schede KPI del log filtrato. Con lo sketch (KPI approssimati) tutte le schede
+    sono stimate dagli sketch delle celle, con il loro errore, e il log non
+    viene riletto.
+    """
+    c1, c2, c3, c4 = st.columns(4)
+    if sketch is None:
+        kpi = kpi_overview(df)
+        c1.metric("⏱️ Min/visita (medio)", f"{kpi['avg_minutes_per_visit']:.2f}")
+        c2.metric("🌙 After-hours min/visita", f"{kpi['avg_after_hours_minutes_per_visit']:.2f}")
+        c3.metric("🤖 % visite con nota AI", f"{kpi['ai_note_share_percent']:.2f}%")
+        c4.metric("✍️ Min correzione AI (medio)", f"{kpi['ai_correction_avg_minutes']:.2f}")
+        return
+    kpi = kpi_overview_approx(partial=sketch)
+    stima = lambda nome, unita="": f"{kpi[nome]['value']:.2f}{unita} ± {kpi[nome]['error']:.2f}"
+    c1.metric("⏱️ Min/visita (medio)", stima("avg_minutes_per_visit"))
+    c2.metric("🌙 After-hours min/visita", stima("avg_after_hours_minutes_per_visit"))
+    c3.metric("🤖 % visite con nota AI", stima("ai_note_share_percent", "%"))
+    # somme esatte: nessun errore di stima
+    c4.metric("✍️ Min correzione AI (medio)", f"{kpi['ai_correction_avg_minutes']['value']:.2f}")
+
+def sezione_outlier(df: pd.DataFrame, sketch: dict | None):
+    """Visite outlier: soglia esatta sul log filtrato, o stimata dallo sketch con anteprima delle più lunghe."""
+    st.subheader("Visite outlier (durata totale elevata)")
+    if sketch is None:
+        st.dataframe(outlier_visits(df))
+        return
+    # l'anteprima (le ANTEPRIMA_RIGHE visite più lunghe) è già nello sketch delle celle
+    out = outlier_visits_approx(partial=sketch)
+    if not out.empty:
+        st.caption(f"Soglia stimata {out.attrs['cut']:.1f} min (errore di rango dei quartili ±{out.attrs['rank_error']:.2%})")
+    if out.attrs.get("count", 0) > len(out):
+        st.caption(f"Anteprima delle {len(out)} visite più lunghe su circa {out.attrs['count']} outlier stimati.")
+    st.dataframe(out)
+
+def chiave_vista(impronta: str, selezione: tuple | None) -> str | None:
+    """
+    Chiave breve del log filtrato (impronta della sorgente + selezione dell'indice)
+    per la cache dei trend; None se il log non ha indice e i filtri non sono
+    ricostruibili. La selezione contiene solo reparti, clinici e date: il costo
+    non dipende dalla dimensione del file caricato.
+    """
+    if selezione is None:
+        return None
+    return impronta_log(impronta, selezione)
+
+def sezione_trend(df: pd.DataFrame, chiave: str | None = None):
+    """
+    Trend a finestra mobile di minuti, quota after-hours e quota note AI
+    per clinico o reparto. Con la chiave della vista il trend viene dalla cache
+    incrementale di workload_trend: ai rerun si ricalcola solo l'ultimo bucket.
+    """
+    st.subheader("Trend temporali")
+    c1, c2, c3, c4 = st.columns(4)
+    bucket = c1.selectbox("Bucket", ["day", "hour", "week"], format_func={"hour": "Ora", "day": "Giorno", "week": "Settimana"}.get)
+    gruppo = c2.selectbox("Per", ["clinician_id", "department"], format_func={"clinician_id": "Clinico", "department": "Reparto"}.get)
+    finestra = c3.number_input("Finestra (bucket)", 1, 90, 7)
+    metrica = c4.selectbox("Metrica", ["minutes", "after_hours_share", "ai_note_share"],
+                           format_func={"minutes": "Minuti", "after_hours_share": "% after-hours", "ai_note_share": "% visite con nota AI"}.get)
+    if chiave is None:
+        trend = rolling_trend(bucket_aggregates(df, bucket, gruppo), bucket, gruppo, int(finestra))
+    else:
+        trend = workload_trend(df, chiave, bucket, gruppo, int(finestra))
+    if trend.empty:
+        st.info("Nessun dato temporale disponibile.")
+        return
+    st.line_chart(trend.pivot_table(index="bucket", columns=gruppo, values=metrica, observed=True))
+
+def sessione_perf() -> str:
+    # id della sessione per le misure: i rerun di sessioni diverse non si mescolano
+    return st.session_state.setdefault("perf_session", uuid.uuid4().hex)
+
+def pannello_performance():
+    """
+    Pannello nascosto (attivo con ?perf=1 o DASHBOARD_PERF=1) con i tempi per
+    stage degli ultimi rerun completati ed export delle metriche.
+    """
+    if os.getenv("DASHBOARD_PERF") != "1" and st.query_params.get("perf") != "1":
+        return
+    with st.sidebar.expander("⚙️ Performance"):
+        ultimi = st.slider("Ultimi rerun", 1, 50, 5)
+        misure = pd.DataFrame(records(ultimi, session=sessione_perf()))
+        if misure.empty:
+            st.caption("Nessuna misura registrata.")
+            return
+        st.dataframe(misure[["run", "stage", "duration_ms", "rows_in", "rows_out", "mem_delta_mb"]], hide_index=True)
+        st.dataframe(misure.groupby("stage")["duration_ms"].agg(["count", "mean", "max"]).sort_values("mean", ascending=False))
+        st.download_button("Metriche Prometheus", to_prometheus(), file_name="metrics.prom", mime="text/plain")
+        st.download_button("Metriche JSON lines", to_jsonl(ultimi, session=sessione_perf()), file_name="metrics.jsonl", mime="application/jsonl")
+
+# Il pannello mostra i rerun precedenti, poi si apre la misura di quello corrente
+pannello_performance()
+start_run(sessione_perf())
+
 # --- Sidebar: scelta dataset ---
 st.sidebar.header("Sorgente Dati")
-dataset_type = st.sidebar.radio("Origine", ["Ricoveri Clinici", "Burocrazia EHR", "Carica CSV Burocrazia"])
+dataset_type = st.sidebar.radio("Origine", ["Ricoveri Clinici", "Burocrazia EHR", "Carica CSV Burocrazia", "Cartella Log Burocrazia"])
+# Grafici Vega-Lite nativi: più leggeri delle figure matplotlib nel server
+grafici_nativi = st.sidebar.toggle("Grafici nativi (Vega)", value=False)
+# KPI da sketch (t-digest, HyperLogLog) con limite d'errore, per log molto grandi
+kpi_approssimati = st.sidebar.toggle("KPI approssimati (sketch)", value=False)
+ANTEPRIMA_RIGHE = 1000
 
 
 # =====================================================================
@@ -125,7 +364,7 @@ if dataset_type == "Ricoveri Clinici":
         st.stop()
     
     # Normalizza dati
-    records = []
+    righe_ricoveri = []
     for p in docs:
         nome = p.get("nome", "N/A")
         for r in p.get("ricoveri", []):
@@ -137,7 +376,7 @@ if dataset_type == "Ricoveri Clinici":
             except (TypeError, ValueError):
                 data_ricovero, data_dimissione, giorni = None, None, None
 
-            records.append({
+            righe_ricoveri.append({
                 "nome": nome,
                 "diagnosi": r.get("diagnosi"),
                 "reparto": r.get("reparto", "N/A"),
@@ -146,7 +385,7 @@ if dataset_type == "Ricoveri Clinici":
                 "giorni_ricovero": giorni,
             })
 
-    df = pd.DataFrame(records)
+    df = pd.DataFrame(righe_ricoveri)
 
     # --- KPI ---
     media_giorni = df["giorni_ricovero"].mean()
@@ -169,12 +408,7 @@ if dataset_type == "Ricoveri Clinici":
     st.bar_chart(df["giorni_ricovero"].dropna())
 
     # --- Download ---
-    st.download_button(
-        "⬇️ Scarica ricoveri (CSV)",
-        data=df.to_csv(index=False).encode("utf-8"),
-        file_name="ricoveri.csv",
-        mime="text/csv",
-    )
+    export_widget(df, "ricoveri", "ricoveri", key="export_ricoveri")
 
     # --- Sezione Previsione ---
     st.sidebar.title("🔮 Previsione Giorni di Ricovero")
@@ -182,7 +416,7 @@ if dataset_type == "Ricoveri Clinici":
     if not os.path.exists(model_path):
         with st.spinner("Addestramento del modello in corso..."):
             train_df = load_and_preprocess_data("simulated_ricoveri.json")  # prende i dati da un file JSON
-            train_and_save_model(train_df, model_path=model_path)
+            train_evaluate_and_save_best_model(train_df, model_path=model_path)
             st.sidebar.success("Modello addestrato e salvato!")
     
     diagnosi_list = sorted(df["diagnosi"].dropna().unique())
@@ -191,7 +425,12 @@ if dataset_type == "Ricoveri Clinici":
     diagnosi_input = st.sidebar.selectbox("Diagnosi", diagnosi_list)
     reparto_input = st.sidebar.selectbox("Reparto", reparto_list)
 
-    if st.sidebar.button("Previeni Durata Ricovero"):
+    # durata media prevista dal batch notturno, se lo snapshot attivo la contiene
+    snapshot = snapshot_attivo()
+    previsione_batch = snapshot_prediction(snapshot, reparto_input, diagnosi_input) if snapshot else None
+    if previsione_batch is not None:
+        st.sidebar.metric("Giorni di ricovero previsti (batch)", f"{previsione_batch:.1f} giorni")
+    elif st.sidebar.button("Previeni Durata Ricovero"):
         input_data = pd.DataFrame({
             'diagnosi': [diagnosi_input],
             'reparto': [reparto_input]
@@ -213,16 +452,19 @@ elif dataset_type == "Burocrazia EHR":
     mode = st.sidebar.radio("Tipo dati", ["Sintetici (demo)", "Carica CSV", "Carica PDF"])
 
     df = None
+    indice = {}
     if mode == "Sintetici (demo)":
         n_visits = st.sidebar.slider("Numero visite", 50, 2000, 400, step=50)
         n_clin = st.sidebar.slider("Numero medici", 3, 40, 12, step=1)
         seed = st.sidebar.number_input("Seed", 0, 10_000, 42)
-        df = create_synthetic_logs(n_visits=n_visits, n_clinicians=n_clin, seed=seed)
+        sorgente = ("sintetici", n_visits, n_clin, seed)
+        df, indice, impronta = carica_log(sorgente)
 
     elif mode == "Carica CSV":
         f = st.sidebar.file_uploader("Carica CSV", type=["csv"])
         if f is not None:
-            df = load_csv(f)
+            sorgente = ("csv", f.getvalue())
+            df, indice, impronta = carica_log(sorgente)
         else:
             st.info("Carica un CSV con colonne: visit_id, clinician_id, department, activity, start_time, end_time, minutes, is_after_hours, is_ai_note, ai_edit_minutes")
             st.stop()
@@ -231,12 +473,19 @@ elif dataset_type == "Burocrazia EHR":
         f = st.sidebar.file_uploader("Carica PDF", type=["pdf"])
         if f is not None:
             with st.spinner("Estrazione tabelle dal PDF in corso..."):
-                df = load_pdf(f)
-                if df.empty:
+                sorgente = ("pdf", f.getvalue())
+                df, indice, impronta, scarti = carica_log(sorgente)
+                if df.empty and scarti.empty:
                     st.warning("Nessuna tabella trovata nel PDF o formato non supportato.")
                     st.stop()
                 else:
                     st.success(f"Trovate e caricate {len(df)} righe dal PDF.")
+            if not scarti.empty:
+                righe = scarti["row"].nunique()
+                with st.expander(f"⚠️ {righe} righe escluse per valori non interpretabili"):
+                    st.dataframe(scarti, hide_index=True)
+            if df.empty:
+                st.stop()
         else:
             st.info("Carica un file PDF contenente tabelle con i dati clinici.")
             st.stop()
@@ -245,113 +494,145 @@ elif dataset_type == "Burocrazia EHR":
         st.stop()
 
     # --- Filtri comuni ---
-    st.sidebar.subheader("Filtri Reparto")
-    aree_principali = ["Tutte le aree"] + list(REPARTI.keys())
-    area_selezionata = st.sidebar.selectbox("Area Principale", aree_principali)
-
-    if area_selezionata == "Tutte le aree":
-        lista_reparti = ["Tutti i reparti"] + sorted([reparto for sublist in REPARTI.values() for reparto in sublist])
-    else:
-        lista_reparti = ["Tutti i reparti"] + sorted(REPARTI[area_selezionata])
-    
-    reparto_selezionato = st.sidebar.selectbox("Reparto Specifico", lista_reparti)
-
-    if reparto_selezionato != "Tutti i reparti":
-        df = df[df["department"] == reparto_selezionato]
-    elif area_selezionata != "Tutte le aree":
-        df = df[df["department"].isin(REPARTI[area_selezionata])]
-
-    st.sidebar.subheader("Filtri Clinico")
-    if 'clinician_id' in df.columns:
-        clinicians = sorted(df["clinician_id"].unique())
-        selected_clin = st.sidebar.multiselect("Filtra per clinico", options=clinicians, default=clinicians)
-        df = df[df["clinician_id"].isin(selected_clin)]
+    log = df
+    with stage("app.filtra_log", rows_in=len(log)) as misura:
+        df, selezione = filtra_log(log, indice)
+        misura["rows_out"] = len(df)
 
     # --- KPI cards ---
-    kpi = kpi_overview(df)
-    c1, c2, c3, c4 = st.columns(4)
-    c1.metric("⏱️ Min/visita (medio)", f"{kpi['avg_minutes_per_visit']:.2f}")
-    c2.metric("🌙 After-hours min/visita", f"{kpi['avg_after_hours_minutes_per_visit']:.2f}")
-    c3.metric("🤖 % visite con nota AI", f"{kpi['ai_note_share_percent']:.2f}%")
-    c4.metric("✍️ Min correzione AI (medio)", f"{kpi['ai_correction_avg_minutes']:.2f}")
+    sketch = sketch_selezione(impronta, log, indice, selezione)
+    schede_kpi(df, sketch)
 
     st.divider()
 
     # --- Distribuzione per attività ---
     st.subheader("Distribuzione tempo per attività")
     act = share_time_by_activity(df)
-    fig1, ax1 = plt.subplots()
-    ax1.bar(act.index, act["minutes"])
-    ax1.set_xlabel("Attività")
-    ax1.set_ylabel("Minuti totali")
-    ax1.set_title("Tempo totale per attività")
-    st.pyplot(fig1, use_container_width=True)
+    with stage("plot.activity", rows_in=len(act)):
+        if grafici_nativi:
+            activity_chart(act)
+        else:
+            st.image(activity_png(act), width="stretch")
 
     # --- Carico per clinico ---
     st.subheader("Carico per clinico (minuti totali)")
     cl = clinicians_workload(df)
-    fig2, ax2 = plt.subplots()
-    ax2.bar(cl["clinician_id"], cl["total_minutes"])
-    ax2.set_xlabel("Clinico")
-    ax2.set_ylabel("Minuti totali")
-    ax2.set_title("Workload totale (ordinato)")
-    plt.xticks(rotation=45)
-    st.pyplot(fig2, use_container_width=True)
+    with stage("plot.workload", rows_in=len(cl)):
+        if grafici_nativi:
+            workload_chart(cl)
+        else:
+            st.image(workload_png(cl), width="stretch")
 
-    # --- Outlier ---
-    st.subheader("Visite outlier (durata totale elevata)")
-    out = outlier_visits(df)
-    st.dataframe(out)
+    # --- Attività sovrapposte ---
+    st.subheader("Attività sovrapposte per clinico e giorno")
+    sovrapposte = clinician_overlaps(df)
+    st.dataframe(sovrapposte[sovrapposte["overlap_minutes"] > 0], hide_index=True)
+
+    sezione_trend(df, chiave_vista(impronta, selezione))
+
+    sezione_outlier(df, sketch)
 
     # --- Download ---
-    st.download_button(
-        "⬇️ Scarica dataset (CSV)",
-        data=df.to_csv(index=False).encode("utf-8"),
-        file_name="clinical_logs.csv",
-        mime="text/csv",
-    )
-    st.download_button(
-        "⬇️ Scarica aggregati per attività (CSV)",
-        data=act.to_csv().encode("utf-8"),
-        file_name="activity_aggregates.csv",
-        mime="text/csv",
-    )
+    # export generati solo su richiesta: il rerun non serializza il dataset
+    export_widget(df, "dataset", "clinical_logs", key="export_logs")
+    export_widget(act, "aggregati per attività", "activity_aggregates", key="export_act", index=True)
 elif dataset_type == "Carica CSV Burocrazia":
     st.title("🩺 Clinical Bureaucracy KPI Dashboard (CSV Upload)")
     st.caption("Monitoraggio EHR: documentazione, review, ordini, inbox, after-hours e impatto note AI.")
 
     f = st.sidebar.file_uploader("Carica CSV", type=["csv"])
     if f is not None:
-        df = load_csv(f)
+        sorgente = ("csv", f.getvalue())
+        df, indice, impronta = carica_log(sorgente)
     else:
         st.info("Carica un CSV con colonne: visit_id, clinician_id, department, activity, start_time, end_time, minutes, is_after_hours, is_ai_note, ai_edit_minutes")
         st.stop()
 
     # --- Filtri comuni ---
-    st.sidebar.subheader("Filtri Reparto")
-    aree_principali = ["Tutte le aree"] + list(REPARTI.keys())
-    area_selezionata = st.sidebar.selectbox("Area Principale", aree_principali)
+    log = df
+    with stage("app.filtra_log", rows_in=len(log)) as misura:
+        df, selezione = filtra_log(log, indice)
+        misura["rows_out"] = len(df)
 
-    if area_selezionata == "Tutte le aree":
-        lista_reparti = ["Tutti i reparti"] + sorted([reparto for sublist in REPARTI.values() for reparto in sublist])
-    else:
-        lista_reparti = ["Tutti i reparti"] + sorted(REPARTI[area_selezionata])
-    
-    reparto_selezionato = st.sidebar.selectbox("Reparto Specifico", lista_reparti)
+    # --- KPI cards ---
+    sketch = sketch_selezione(impronta, log, indice, selezione)
+    schede_kpi(df, sketch)
 
-    if reparto_selezionato != "Tutti i reparti":
-        df = df[df["department"] == reparto_selezionato]
-    elif area_selezionata != "Tutte le aree":
-        df = df[df["department"].isin(REPARTI[area_selezionata])]
+    st.divider()
 
-    st.sidebar.subheader("Filtri Clinico")
-    if 'clinician_id' in df.columns:
-        clinicians = sorted(df["clinician_id"].unique())
-        selected_clin = st.sidebar.multiselect("Filtra per clinico", options=clinicians, default=clinicians)
-        df = df[df["clinician_id"].isin(selected_clin)]
+    # --- Distribuzione per attività ---
+    st.subheader("Distribuzione tempo per attività")
+    act = share_time_by_activity(df)
+    with stage("plot.activity", rows_in=len(act)):
+        if grafici_nativi:
+            activity_chart(act)
+        else:
+            st.image(activity_png(act), width="stretch")
+
+    # --- Carico per clinico ---
+    st.subheader("Carico per clinico (minuti totali)")
+    cl = clinicians_workload(df)
+    with stage("plot.workload", rows_in=len(cl)):
+        if grafici_nativi:
+            workload_chart(cl)
+        else:
+            st.image(workload_png(cl), width="stretch")
+
+    # --- Attività sovrapposte ---
+    st.subheader("Attività sovrapposte per clinico e giorno")
+    sovrapposte = clinician_overlaps(df)
+    st.dataframe(sovrapposte[sovrapposte["overlap_minutes"] > 0], hide_index=True)
+
+    sezione_trend(df, chiave_vista(impronta, selezione))
+
+    sezione_outlier(df, sketch)
+
+    # --- Download ---
+    # export generati solo su richiesta: il rerun non serializza il dataset
+    export_widget(df, "dataset", "clinical_logs", key="export_logs")
+    export_widget(act, "aggregati per attività", "activity_aggregates", key="export_act", index=True)
+
+# =====================================================================
+# 3) CARTELLA DI LOG PARTIZIONATI (un file per reparto/giorno, multi-core)
+# =====================================================================
+elif dataset_type == "Cartella Log Burocrazia":
+    st.title("🩺 Clinical Bureaucracy KPI Dashboard (log partizionati)")
+    st.caption("KPI calcolati in parallelo su tutti i file della cartella, senza caricare il log intero in memoria.")
+
+    sorgente = st.sidebar.text_input("Cartella o pattern glob dei log", value="logs")
+    # motore predefinito da KPI_BACKEND: pandas (processi in parallelo) o duckdb (out-of-core)
+    motori = ["pandas", "duckdb"]
+    motore = st.sidebar.selectbox("Motore KPI", motori, index=motori.index(kpi_duckdb.kpi_backend()))
+    workers = int(st.sidebar.number_input("Processi" if motore == "pandas" else "Thread", 1, os.cpu_count() or 1, os.cpu_count() or 1))
+    percorsi = log_paths(sorgente)
+    if not percorsi:
+        st.info("Indica una cartella con file CSV (anche .csv.gz) o Parquet, o un pattern come 'logs/**/*.csv'.")
+        st.stop()
+    firma = file_signature(percorsi)
+    snapshot = snapshot_attivo()
+    if snapshot is not None and snapshot_matches(snapshot, firma):
+        # risultati precalcolati: i filtri reparto/clinico si servono dai cubi dello snapshot
+        manifest = snapshot["manifest"]
+        st.sidebar.subheader("Filtri")
+        reparti = st.sidebar.multiselect("Reparti", manifest["departments"], default=manifest["departments"])
+        clinici = st.sidebar.multiselect("Clinici", manifest["clinicians"], default=manifest["clinicians"])
+        risultato = snapshot_kpis(
+            snapshot,
+            None if len(reparti) == len(manifest["departments"]) else reparti,
+            None if len(clinici) == len(manifest["clinicians"]) else clinici,
+        )
+        st.caption(f"Snapshot {manifest['version']} del {manifest['created']}.")
+    else:
+        with st.spinner(f"Elaborazione di {len(percorsi)} file in corso..."):
+            try:
+                risultato = kpi_partizionati(firma, workers, motore)
+            except ImportError:
+                st.error("Motore DuckDB non disponibile: installa duckdb.")
+                st.stop()
+    st.success(f"{risultato['rows']} righe da {risultato['files']} file.")
 
     # --- KPI cards ---
-    kpi = kpi_overview(df)
+    kpi = risultato["kpi_overview"]
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("⏱️ Min/visita (medio)", f"{kpi['avg_minutes_per_visit']:.2f}")
     c2.metric("🌙 After-hours min/visita", f"{kpi['avg_after_hours_minutes_per_visit']:.2f}")
@@ -362,42 +643,24 @@ elif dataset_type == "Carica CSV Burocrazia":
 
     # --- Distribuzione per attività ---
     st.subheader("Distribuzione tempo per attività")
-    act = share_time_by_activity(df)
-    fig1, ax1 = plt.subplots()
-    ax1.bar(act.index, act["minutes"])
-    ax1.set_xlabel("Attività")
-    ax1.set_ylabel("Minuti totali")
-    ax1.set_title("Tempo totale per attività")
-    st.pyplot(fig1, use_container_width=True)
+    act = risultato["share_time_by_activity"]
+    if grafici_nativi:
+        activity_chart(act)
+    else:
+        st.image(activity_png(act), width="stretch")
 
     # --- Carico per clinico ---
     st.subheader("Carico per clinico (minuti totali)")
-    cl = clinicians_workload(df)
-    fig2, ax2 = plt.subplots()
-    ax2.bar(cl["clinician_id"], cl["total_minutes"])
-    ax2.set_xlabel("Clinico")
-    ax2.set_ylabel("Minuti totali")
-    ax2.set_title("Workload totale (ordinato)")
-    plt.xticks(rotation=45)
-    st.pyplot(fig2, use_container_width=True)
+    cl = risultato["clinicians_workload"]
+    if grafici_nativi:
+        workload_chart(cl)
+    else:
+        st.image(workload_png(cl), width="stretch")
 
     # --- Outlier ---
     st.subheader("Visite outlier (durata totale elevata)")
-    out = outlier_visits(df)
-    st.dataframe(out)
+    st.dataframe(risultato["outlier_visits"])
 
-    # --- Download ---
-    st.download_button(
-        "⬇️ Scarica dataset (CSV)",
-        data=df.to_csv(index=False).encode("utf-8"),
-        file_name="clinical_logs.csv",
-        mime="text/csv",
-    )
-    st.download_button(
-        "⬇️ Scarica aggregati per attività (CSV)",
-        data=act.to_csv().encode("utf-8"),
-        file_name="activity_aggregates.csv",
-        mime="text/csv",
-    )
+    export_widget(act, "aggregati per attività", "activity_aggregates", key="export_act", index=True)
 else:
     st.error("Selezione non valida.")
\ No newline at end of file
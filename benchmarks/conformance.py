@@ -0,0 +1,135 @@
+"""
+Conformità tra i backend KPI: pandas (src/kpi.py) e DuckDB (src/kpi_duckdb.py).
+
+Uso:
+    python benchmarks/conformance.py                 # casi sintetici
+    python benchmarks/conformance.py logs/ altri/*.csv
+
+Per ogni sorgente ogni KPI viene calcolato con entrambi i backend: il backend
+pandas sul log caricato con load_log_file e concatenato, DuckDB direttamente
+sui file. I valori scalari devono coincidere esattamente, le tabelle a meno
+dell'ordine delle righe a pari merito. Esce con codice 1 alla prima differenza
+trovata in una sorgente.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+KPI_FUNCTIONS = [
+    "total_minutes_per_visit",
+    "avg_minutes_per_visit",
+    "share_time_by_activity",
+    "avg_after_hours_minutes_per_visit",
+    "ai_note_share",
+    "ai_correction_avg_minutes",
+    "clinicians_workload",
+    "clinician_overlaps",
+    "outlier_visits",
+    "kpi_overview",
+]
+
+def _canonical(value):
+    # tabelle confrontate senza indice, con chiavi come stringhe e righe ordinate
+    if isinstance(value, pd.Series):
+        value = value.rename("value").rename_axis("key").reset_index()
+    if not isinstance(value, pd.DataFrame):
+        return value
+    value = value.reset_index() if value.index.name else value.reset_index(drop=True)
+    for col in value.columns:
+        if value[col].dtype == object or isinstance(value[col].dtype, pd.CategoricalDtype):
+            value[col] = value[col].astype(str)
+    return value.sort_values(list(value.columns), ignore_index=True)
+
+def check_source(paths: list) -> list:
+    """Differenze tra i due backend sui file indicati (lista vuota se conformi)."""
+    from src import kpi, kpi_duckdb
+    from src.utils import load_log_file
+
+    df = pd.concat([load_log_file(p) for p in paths], ignore_index=True)
+    con = kpi_duckdb.open_logs(paths)
+    failures = []
+    for name in KPI_FUNCTIONS:
+        expected = _canonical(getattr(kpi, name)(df))
+        actual = _canonical(getattr(kpi_duckdb, name)(con))
+        try:
+            if isinstance(expected, pd.DataFrame):
+                pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_exact=False, rtol=1e-9)
+            else:
+                assert actual == expected, f"{actual!r} != {expected!r}"
+        except AssertionError as e:
+            failures.append(f"{name}: {str(e).splitlines()[0]}")
+    return failures
+
+def synthetic_sources(workdir: str) -> dict:
+    """
+    Casi sintetici: log con minuti after-hours nel file e senza (calcolati da
+    entrambi i backend), visite divise tra più file, file con tipi diversi per
+    la stessa colonna, Parquet da datasets.py.
+    """
+    from datasets import create_simulated_clinical_data
+    from src.utils import create_synthetic_logs
+
+    rng = np.random.default_rng(0)
+    logs = create_synthetic_logs(2_000, 15, seed=7)
+    sources = {}
+    for case, frame in {
+        "csv_after_hours": logs,
+        "csv_calcolati": logs.drop(columns=["after_hours_minutes", "is_after_hours", "minutes"]),
+    }.items():
+        part = rng.integers(0, 5, len(frame))  # righe di una visita su file diversi
+        paths = []
+        for i in range(5):
+            paths.append(os.path.join(workdir, f"{case}_{i}.csv"))
+            frame[part == i].to_csv(paths[-1], index=False)
+        sources[case] = paths
+
+    # stessi nomi di colonna ma tipi diversi tra i file: interi e decimali,
+    # interi e testo (visit_id); ogni file va letto con i propri tipi
+    base = logs.drop(columns=["after_hours_minutes", "is_after_hours"])
+    mixed = {
+        "csv_int_float": lambda i, part: part.assign(
+            minutes=part["minutes"] + 0.5, ai_edit_minutes=part["ai_edit_minutes"] + 0.5
+        ) if i == 2 else part,
+        "csv_int_string": lambda i, part: part.assign(visit_id="V" + part["visit_id"].astype(str)) if i == 2 else part,
+    }
+    numeric = base.assign(visit_id=base["visit_id"].str.extract(r"(\d+)")[0].astype(int))
+    size = -(-len(numeric) // 3)
+    for case, transform in mixed.items():
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(workdir, f"{case}_{i}.csv"))
+            transform(i, numeric.iloc[i * size:(i + 1) * size]).to_csv(paths[-1], index=False)
+        sources[case] = paths
+
+    simulated = create_simulated_clinical_data(5_000, 25, seed=3)
+    simulated["activity"] = simulated["activity"].cat.rename_categories(str.lower)
+    path = os.path.join(workdir, "simulated.parquet")
+    simulated.to_parquet(path, index=False)
+    sources["parquet_datasets"] = [path]
+    return sources
+
+def main():
+    from src.partitioned import log_paths
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        if len(sys.argv) > 1:
+            sources = {arg: log_paths(arg) or [arg] for arg in sys.argv[1:]}
+        else:
+            sources = synthetic_sources(workdir)
+        for name, paths in sources.items():
+            failures = check_source(paths)
+            failed |= bool(failures)
+            print(f"{name:<30} {'OK' if not failures else 'DIFFERENZE'}")
+            for failure in failures:
+                print(f"    {failure}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
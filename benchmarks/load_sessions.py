@@ -0,0 +1,160 @@
+"""
+Load test di N sessioni concorrenti della vista burocrazia, con RSS e latenza.
+
+Uso:
+    python benchmarks/load_sessions.py --sessions 50 --reruns 20
+    python benchmarks/load_sessions.py --sessions 50 --copies      # confronto: una copia per sessione
+    python benchmarks/load_sessions.py --sessions 50 --model modello_dimissione.joblib --admissions simulated_ricoveri.json
+
+Le sessioni sono thread dello stesso processo, come le sessioni Streamlit. A
+ogni rerun una sessione prende il log indicizzato dalla sorgente condivisa
+(memory-mapped, src/shared.py) oppure, con --copies, una copia deserializzata
+come faceva cache_data; applica un proprio filtro reparto/clinico con l'indice,
+calcola i KPI della pagina e, con --model e --admissions, la previsione di un
+ricovero del file (modello condiviso, o riletto da disco con --copies).
+Riporta RSS del processo (picco, finale, incremento per sessione), la parte
+anonima non condivisibile e la latenza p50/p95 dei rerun.
+"""
+import argparse
+import json
+import os
+import pickle
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import joblib
+
+from src.perf import rss_mb
+
+def anon_rss_mb() -> float | None:
+    # memoria privata del processo (senza pagine di file mappati), solo Linux
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+class RssSampler(threading.Thread):
+    """Campiona l'RSS a intervalli regolari per misurarne il picco."""
+
+    def __init__(self, interval: float = 0.02):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_mb()
+        self.peak_anon = anon_rss_mb()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+            anon = anon_rss_mb()
+            if anon is not None:
+                self.peak_anon = max(self.peak_anon, anon)
+
+def session(source, copies: bool, reruns: int, seed: int, model_path: str | None, admissions, timings: list):
+    from src.index import index_clinicians, index_departments, select_rows
+    from src.kpi import clinician_overlaps, clinicians_workload, kpi_overview, outlier_visits, share_time_by_activity
+    from src.prediction import load_model_and_predict
+
+    rng = random.Random(seed)
+    for _ in range(reruns):
+        start = time.perf_counter()
+        df, indice = pickle.loads(source) if copies else source
+        reparti_indice = index_departments(indice)
+        reparti = rng.sample(reparti_indice, k=max(1, len(reparti_indice) // 3))
+        clinici = index_clinicians(indice, reparti)
+        view = select_rows(df, indice, reparti, rng.sample(clinici, k=max(1, len(clinici) // 2)))
+        kpi_overview(view)
+        share_time_by_activity(view)
+        clinicians_workload(view)
+        clinician_overlaps(view)
+        outlier_visits(view)
+        if model_path:
+            input_data = admissions.iloc[[rng.randrange(len(admissions))]]
+            if copies:
+                joblib.load(model_path).predict(input_data)
+            else:
+                load_model_and_predict(input_data, model_path=model_path)
+        timings.append(time.perf_counter() - start)
+        del df, view
+
+def run(sessions: int, reruns: int, visits: int, clinicians: int, copies: bool,
+        model_path: str | None = None, admissions_path: str | None = None) -> dict:
+    from src.prediction import FEATURES_TO_DROP, load_and_preprocess_data
+    from src.shared import shared_log_index
+    from src.utils import create_synthetic_logs
+
+    logs = create_synthetic_logs(n_visits=visits, n_clinicians=clinicians, seed=42)
+    source = shared_log_index(logs)
+    rows = len(source[0])
+    if copies:
+        source = pickle.dumps(source, protocol=pickle.HIGHEST_PROTOCOL)
+    del logs
+    admissions = None
+    if model_path and admissions_path and os.path.exists(model_path):
+        admissions = load_and_preprocess_data(admissions_path).drop(columns=FEATURES_TO_DROP, errors="ignore")
+    if admissions is None or admissions.empty:
+        model_path = None
+
+    # un rerun a vuoto: import, cache del modello e pagine del file già caricati
+    session(source, copies, 1, 0, model_path, admissions, [])
+    rss_start, anon_start = rss_mb(), anon_rss_mb()
+    sampler = RssSampler()
+    sampler.start()
+    timings: list = []
+    threads = [
+        threading.Thread(target=session, args=(source, copies, reruns, i, model_path, admissions, timings))
+        for i in range(sessions)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    sampler.stopped.set()
+    sampler.join()
+
+    timings.sort()
+    result = {
+        "sessions": sessions,
+        "reruns_per_session": reruns,
+        "rows": rows,
+        "mode": "copie per sessione" if copies else "condiviso (memory-mapped)",
+        "model": model_path,
+        "throughput_reruns_s": round(len(timings) / elapsed, 1),
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 1),
+        "p95_ms": round(timings[int(0.95 * (len(timings) - 1))] * 1000, 1),
+        "rss_start_mb": round(rss_start, 1),
+        "rss_peak_mb": round(sampler.peak, 1),
+        "rss_end_mb": round(rss_mb(), 1),
+        "rss_peak_per_session_mb": round((sampler.peak - rss_start) / sessions, 2),
+    }
+    if anon_start is not None:
+        result["anon_start_mb"] = round(anon_start, 1)
+        result["anon_peak_mb"] = round(sampler.peak_anon, 1)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--reruns", type=int, default=10, help="rerun per sessione")
+    parser.add_argument("--visits", type=int, default=50_000, help="visite del log sintetico")
+    parser.add_argument("--clinicians", type=int, default=40)
+    parser.add_argument("--copies", action="store_true", help="una copia del log per sessione (comportamento di cache_data)")
+    parser.add_argument("--model", help="modello joblib per le previsioni (saltate se il file non esiste)")
+    parser.add_argument("--admissions", help="file JSON/JSONL dei ricoveri da cui estrarre gli input delle previsioni")
+    args = parser.parse_args()
+    result = run(args.sessions, args.reruns, args.visits, args.clinicians, args.copies, args.model, args.admissions)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Misura tempo di rendering e RSS del processo su N rerun della vista burocrazia.
+
+Uso:
+    python benchmarks/rerun_app.py --reruns 1000 [--native]
+
+Sfrutta streamlit.testing (AppTest): l'app gira nello stesso processo, quindi
+una crescita dell'RSS tra i rerun indica figure o dati non rilasciati.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.perf import rss_mb
+
+def run(reruns: int, native: bool) -> dict:
+    os.chdir(ROOT)
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.run()
+    at.sidebar.radio[0].set_value("Burocrazia EHR")
+    if native:
+        at.sidebar.toggle[0].set_value(True)
+    at.run()
+
+    timings = []
+    rss = [rss_mb()]
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - start)
+        rss.append(rss_mb())
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+    timings.sort()
+    return {
+        "reruns": reruns,
+        "renderer": "vega" if native else "matplotlib",
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 2),
+        "p95_ms": round(timings[int(0.95 * (len(timings) - 1))] * 1000, 2),
+        "rss_start_mb": round(rss[0], 1),
+        "rss_end_mb": round(rss[-1], 1),
+        "rss_growth_mb": round(rss[-1] - rss[0], 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=1000)
+    parser.add_argument("--native", action="store_true", help="usa i grafici Vega-Lite nativi")
+    args = parser.parse_args()
+    print(json.dumps(run(args.reruns, args.native), indent=2))
+
+if __name__ == "__main__":
+    main()
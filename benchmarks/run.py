@@ -0,0 +1,275 @@
+"""
+Benchmark dei percorsi critici: KPI, loader, generatori, previsione, KPI partizionati e NLP.
+
+Uso:
+    python benchmarks/run.py run --sizes 1000 10000 100000 --output bench.json
+    python benchmarks/run.py compare base.json bench.json --threshold 0.15
+
+Ogni caso viene eseguito su dataset creati con i generatori del repository
+(datasets.py, genera_dati.py, src/utils.py) a più dimensioni. Per ogni misura
+si registrano il tempo migliore e medio su --repeat esecuzioni e il picco di
+memoria allocata (tracemalloc). "compare" segnala le regressioni tra due run
+ed esce con codice 1 se ne trova.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+KPI_FUNCTIONS = [
+    "total_minutes_per_visit",
+    "avg_minutes_per_visit",
+    "share_time_by_activity",
+    "avg_after_hours_minutes_per_visit",
+    "ai_note_share",
+    "ai_correction_avg_minutes",
+    "clinicians_workload",
+    "outlier_visits",
+    "kpi_overview",
+    "ai_note_share_approx",
+    "outlier_visits_approx",
+    "kpi_overview_approx",
+    "distinct_counts_approx",
+]
+SAMPLE_NOTE = (
+    "Patient admitted with community acquired pneumonia and acute kidney injury. "
+    "History of type 2 diabetes mellitus, hypertension and atrial fibrillation. "
+    "Started on ceftriaxone and azithromycin; creatinine 2.1 mg/dL, CRP 85 mg/L. "
+)
+
+# --- Dataset ---
+
+def make_logs(visits: int, seed: int = 0) -> pd.DataFrame:
+    """Log burocrazia da datasets.py, con le attività nel formato atteso da src/kpi.py."""
+    from datasets import create_simulated_clinical_data
+
+    df = create_simulated_clinical_data(visits, num_clinicians=40, seed=seed)
+    df["activity"] = df["activity"].cat.rename_categories(str.lower)
+    return df
+
+def make_admissions(n: int, seed: int = 0) -> pd.DataFrame:
+    """Ricoveri simulati dal generatore vettoriale di genera_dati.py."""
+    import random
+    import numpy as np
+    from genera_dati import NUM_PAZIENTI, generate_admissions_batch, generate_patient_pool
+
+    pool = pd.DataFrame(generate_patient_pool(NUM_PAZIENTI, rng=random.Random(seed)))
+    return generate_admissions_batch(pool, n, np.random.default_rng(seed))
+
+def make_log_pdf(df: pd.DataFrame, rows_per_page: int = 40) -> bytes:
+    """PDF con il log disegnato come tabella a griglia, leggibile da page.find_tables()."""
+    import fitz
+
+    columns = list(df.columns)
+    cell_w, cell_h, margin = 78, 14, 20
+    doc = fitz.open()
+    for start in range(0, len(df), rows_per_page):
+        page = doc.new_page(width=margin * 2 + cell_w * len(columns), height=margin * 2 + cell_h * (rows_per_page + 1))
+        chunk = df.iloc[start:start + rows_per_page].astype(str).values.tolist()
+        for r, values in enumerate([columns] + chunk):
+            for c, value in enumerate(values):
+                rect = fitz.Rect(margin + c * cell_w, margin + r * cell_h, margin + (c + 1) * cell_w, margin + (r + 1) * cell_h)
+                page.draw_rect(rect, color=(0, 0, 0), width=0.5)
+                page.insert_textbox(rect, value, fontsize=6)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+# --- Casi ---
+
+def kpi_cases(size):
+    from src import kpi
+
+    from src.index import build_log_index, cell_partials, select_partials
+
+    df = make_logs(size)
+    # i KPI approssimati usano gli sketch per cella reparto/clinico, costruiti una
+    # volta come nell'app: si misura l'unione delle celle e la stima
+    cells = cell_partials(*build_log_index(df), kpi.approx_partial)
+    cases = {}
+    for name in KPI_FUNCTIONS:
+        fn = getattr(kpi, name)
+        if name.endswith("_approx"):
+            cases[f"kpi.{name}"] = lambda fn=fn: fn(partial=kpi.merge_approx(*select_partials(cells)))
+        else:
+            cases[f"kpi.{name}"] = lambda fn=fn: fn(df)
+    return cases, len(df)
+
+def loader_cases(size):
+    from src.utils import create_synthetic_logs, load_csv, load_pdf
+
+    df = make_logs(size)
+    csv_bytes = df.to_csv(index=False).encode("utf-8")
+    cases = {
+        "utils.load_csv": lambda: load_csv(io.BytesIO(csv_bytes)),
+        # create_synthetic_logs distribuisce le visite su 7 reparti
+        "utils.create_synthetic_logs": lambda: create_synthetic_logs(n_visits=size, n_clinicians=40),
+    }
+    # find_tables costa circa 0.4 s a pagina (40 righe): solo dimensioni piccole
+    if len(df) <= 2_000:
+        pdf_bytes = make_log_pdf(df)
+        cases["utils.load_pdf"] = lambda: load_pdf(io.BytesIO(pdf_bytes))
+    return cases, len(df)
+
+def prediction_cases(size, workdir):
+    from src.prediction import (
+        FEATURES_TO_DROP,
+        load_and_preprocess_data,
+        load_model_and_predict,
+        train_evaluate_and_save_best_model,
+    )
+
+    json_path = os.path.join(workdir, f"ricoveri_{size}.jsonl")
+    make_admissions(size).to_json(json_path, orient="records", lines=True)
+    model_path = os.path.join(workdir, "modello_bench.joblib")
+    if not os.path.exists(model_path):
+        # modello addestrato una sola volta su un campione piccolo
+        train_path = os.path.join(workdir, "ricoveri_train.jsonl")
+        make_admissions(2_000, seed=1).to_json(train_path, orient="records", lines=True)
+        train_evaluate_and_save_best_model(load_and_preprocess_data(train_path), model_path=model_path)
+
+    features = load_and_preprocess_data(json_path)
+    features = features.drop(columns=FEATURES_TO_DROP, errors="ignore")
+    return {
+        "prediction.load_and_preprocess_data": lambda: load_and_preprocess_data(json_path),
+        "prediction.load_model_and_predict": lambda: load_model_and_predict(features, model_path=model_path),
+    }, size
+
+def partitioned_cases(size, workdir, partitions: int = 16):
+    from src.partitioned import compute_partitioned
+
+    # log diviso in partizioni per reparto/giorno come in produzione, con le
+    # righe di alcune visite su file diversi
+    df = make_logs(size)
+    shard_dir = os.path.join(workdir, f"logs_{size}")
+    os.makedirs(shard_dir, exist_ok=True)
+    keys = df["department"].cat.codes.to_numpy().astype(int) * 1000 + df["start_time"].dt.dayofyear.to_numpy()
+    for i, (_, part) in enumerate(df.groupby(keys % partitions)):
+        part.to_csv(os.path.join(shard_dir, f"part_{i:03d}.csv"), index=False)
+    cores = os.cpu_count() or 1
+    cases = {"partitioned.compute_partitioned[1]": lambda: compute_partitioned(shard_dir, workers=1)}
+    if cores > 1:
+        # confronto con workers=1 per misurare la scalabilità sui core
+        cases[f"partitioned.compute_partitioned[{cores}]"] = lambda: compute_partitioned(shard_dir, workers=cores)
+    return cases, len(df)
+
+def nlp_cases(size):
+    import spacy
+    from src.nlp import extract_entities
+
+    if not spacy.util.is_package("en_core_sci_sm"):
+        raise ImportError("en_core_sci_sm non installato")
+    # size = numero di caratteri circa, limitato a quanto accetta spaCy di default
+    text = (SAMPLE_NOTE * (size // len(SAMPLE_NOTE) + 1))[:min(size, 900_000)]
+    extract_entities(SAMPLE_NOTE)  # carica il modello fuori dalla misura
+    return {"nlp.extract_entities": lambda: extract_entities(text)}, len(text)
+
+# --- Misura ---
+
+def measure(fn, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "wall_s": min(times),
+        "wall_mean_s": sum(times) / len(times),
+        "peak_mb": peak / 1024 ** 2,
+    }
+
+def run(sizes, repeat, groups) -> dict:
+    results, skipped = [], []
+    with tempfile.TemporaryDirectory() as workdir:
+        builders = {
+            "kpi": kpi_cases,
+            "loader": loader_cases,
+            "prediction": lambda size: prediction_cases(size, workdir),
+            "partitioned": lambda size: partitioned_cases(size, workdir),
+            "nlp": nlp_cases,
+        }
+        for group in groups:
+            for size in sizes:
+                try:
+                    cases, rows = builders[group](size)
+                except ImportError as e:
+                    skipped.append({"group": group, "size": size, "reason": str(e)})
+                    print(f"-- {group} @ {size}: saltato ({e})")
+                    continue
+                for name, fn in cases.items():
+                    stats = measure(fn, repeat)
+                    results.append({"name": name, "size": size, "rows": rows, **stats})
+                    print(f"{name:<45} size={size:<9} {stats['wall_s'] * 1000:10.2f} ms {stats['peak_mb']:9.1f} MB")
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "repeat": repeat,
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    with open(base_path, encoding="utf-8") as f:
+        base = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    with open(new_path, encoding="utf-8") as f:
+        new = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+
+    regressions = 0
+    print(f"{'caso':<45} {'size':>9} {'tempo':>8} {'memoria':>8}")
+    for key in sorted(base.keys() & new.keys()):
+        old, cur = base[key], new[key]
+        time_ratio = cur["wall_s"] / max(old["wall_s"], 1e-9)
+        mem_ratio = cur["peak_mb"] / max(old["peak_mb"], 1e-9)
+        flag = time_ratio > 1 + threshold or mem_ratio > 1 + threshold
+        regressions += flag
+        print(f"{key[0]:<45} {key[1]:>9} {time_ratio:7.2f}x {mem_ratio:7.2f}x{'  <-- REGRESSIONE' if flag else ''}")
+    for key in sorted(base.keys() ^ new.keys()):
+        print(f"{key[0]:<45} {key[1]:>9}  presente in un solo run")
+    print(f"\n{regressions} regressioni oltre il {threshold:.0%}")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run", help="esegue i benchmark e salva i risultati in JSON")
+    p_run.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    p_run.add_argument("--repeat", type=int, default=3)
+    p_run.add_argument("--groups", nargs="+", choices=["kpi", "loader", "prediction", "partitioned", "nlp"], default=["kpi", "loader", "prediction", "partitioned", "nlp"])
+    p_run.add_argument("--output", default="bench.json")
+    p_cmp = sub.add_parser("compare", help="confronta due run e segnala le regressioni")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=0.15, help="peggioramento relativo tollerato (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(compare(args.base, args.new, args.threshold))
+    report = run(args.sizes, args.repeat, args.groups)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Risultati salvati in '{args.output}'")
+
+if __name__ == "__main__":
+    main()
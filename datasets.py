@@ -1,65 +1,147 @@
+import argparse
+import os
+import time
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
 
-def create_simulated_clinical_data(num_visits=100, num_clinicians=10):
+ACTIVITIES = ["Documentation", "Review", "Orders", "Inbox"]
+DEPARTMENTS = ["Cardiology", "Oncology", "Pediatrics", "Neurology", "General Medicine"]
+COLUMNS = [
+    "visit_id",
+    "clinician_id",
+    "department",
+    "activity",
+    "start_time",
+    "end_time",
+    "minutes",
+    "is_after_hours",
+    "is_ai_note",
+    "ai_edit_minutes"
+]
+CHUNK_VISITS = 250_000
+# fixed reference time: with the same seed the timestamps are identical on every run
+DEFAULT_NOW = datetime(2025, 1, 1, 12, 0)
+
+def create_simulated_clinical_data(num_visits=100, num_clinicians=10, seed=None, rng=None, first_visit_id=0, now=None):
     """
     Generates a simulated dataset for the Clinical Bureaucracy Dashboard.
+
+    Every column is built with array operations on a seeded numpy Generator
+    (pass `rng` to continue an existing stream, e.g. across chunks). Timestamps
+    end shortly before `now` (default DEFAULT_NOW).
     """
-    activities = ["Documentation", "Review", "Orders", "Inbox"]
-    departments = ["Cardiology", "Oncology", "Pediatrics", "Neurology", "General Medicine"]
-    
-    data = []
-    
+    rng = rng if rng is not None else np.random.default_rng(seed)
+    now = np.datetime64((now or DEFAULT_NOW).replace(microsecond=0), "s")
+    n_rows = num_visits * len(ACTIVITIES)
+
+    # one row per (visit, activity): visit attributes are drawn once and repeated
+    visit_clinician = rng.integers(0, num_clinicians, num_visits)
+    visit_department = rng.integers(0, len(DEPARTMENTS), num_visits)
+    activity = np.tile(np.arange(len(ACTIVITIES)), num_visits)
+
+    offset = rng.integers(60, 180, n_rows) * 60 + rng.integers(0, 59, n_rows)
+    start_time = now - offset.astype("timedelta64[s]")
+    minutes = rng.integers(2, 25, n_rows)
+    end_time = start_time + (minutes * 60).astype("timedelta64[s]")
+
+    is_after_hours = rng.random(n_rows) < 0.15
+    # 40% chance of AI note on documentation rows
+    is_ai_note = (activity == ACTIVITIES.index("Documentation")) & (rng.random(n_rows) > 0.6)
+    ai_edit_minutes = np.where(is_ai_note, rng.integers(1, 5, n_rows), 0)
+
     clinicians = [f"Clinician_{i+1}" for i in range(num_clinicians)]
-    
-    for visit_id in range(num_visits):
-        visit_clinician = np.random.choice(clinicians)
-        visit_department = np.random.choice(departments)
-        
-        # Simulate a series of activities for each visit
-        for activity in activities:
-            start_time = datetime.now() - timedelta(minutes=np.random.randint(60, 180), seconds=np.random.randint(0, 59))
-            minutes = np.random.randint(2, 25)
-            end_time = start_time + timedelta(minutes=minutes)
-            
-            is_after_hours = np.random.choice([True, False], p=[0.15, 0.85])
-            
-            is_ai_note = False
-            ai_edit_minutes = 0
-            if activity == "Documentation" and np.random.random() > 0.6:  # 40% chance of AI note
-                is_ai_note = True
-                ai_edit_minutes = np.random.randint(1, 5)
-
-            data.append([
-                visit_id,
-                visit_clinician,
-                visit_department,
-                activity,
-                start_time,
-                end_time,
-                minutes,
-                is_after_hours,
-                is_ai_note,
-                ai_edit_minutes
-            ])
-
-    df = pd.DataFrame(data, columns=[
-        "visit_id",
-        "clinician_id",
-        "department",
-        "activity",
-        "start_time",
-        "end_time",
-        "minutes",
-        "is_after_hours",
-        "is_ai_note",
-        "ai_edit_minutes"
-    ])
-    
-    return df
-
-# Create the dataframe and save to CSV
-df = create_simulated_clinical_data()
-df.to_csv("simulated_clinical_logs.csv", index=False)
-print("Simulated dataset created and saved to 'simulated_clinical_logs.csv'")
\ No newline at end of file
+    return pd.DataFrame({
+        "visit_id": np.repeat(np.arange(first_visit_id, first_visit_id + num_visits), len(ACTIVITIES)),
+        "clinician_id": pd.Categorical.from_codes(np.repeat(visit_clinician, len(ACTIVITIES)), clinicians),
+        "department": pd.Categorical.from_codes(np.repeat(visit_department, len(ACTIVITIES)), DEPARTMENTS),
+        "activity": pd.Categorical.from_codes(activity, ACTIVITIES),
+        "start_time": start_time,
+        "end_time": end_time,
+        "minutes": minutes,
+        "is_after_hours": is_after_hours,
+        "is_ai_note": is_ai_note,
+        "ai_edit_minutes": ai_edit_minutes,
+    }, columns=COLUMNS)
+
+def iter_simulated_chunks(num_visits, num_clinicians=10, seed=None, chunk_visits=CHUNK_VISITS, now=None):
+    """
+    Yields the simulated dataset in chunks of `chunk_visits` visits from a single
+    seeded stream, so the same seed always produces the same rows.
+    """
+    rng = np.random.default_rng(seed)
+    now = now or DEFAULT_NOW
+    for start in range(0, num_visits, chunk_visits):
+        yield create_simulated_clinical_data(
+            min(chunk_visits, num_visits - start), num_clinicians, rng=rng, first_visit_id=start, now=now
+        )
+
+def write_simulated_data(path, num_visits, num_clinicians=10, seed=None, chunk_visits=CHUNK_VISITS, now=None):
+    """
+    Streams the simulated dataset to CSV or Parquet (chosen by file extension).
+    Memory stays bounded by one chunk. Parquet requires pyarrow.
+    """
+    chunks = iter_simulated_chunks(num_visits, num_clinicians, seed, chunk_visits, now=now)
+    rows = 0
+    if path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+    try:
+        # pyarrow's CSV writer is an order of magnitude faster than DataFrame.to_csv
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        pa = None
+
+    if pa is None:
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(f, index=False, header=i == 0)
+                rows += len(chunk)
+        return rows
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pa_csv.CSVWriter(path, table.schema, write_options=pa_csv.WriteOptions(quoting_style="needed"))
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate simulated clinical bureaucracy logs.")
+    parser.add_argument("--visits", type=int, default=100)
+    parser.add_argument("--clinicians", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--chunk-visits", type=int, default=CHUNK_VISITS)
+    parser.add_argument("--now", type=datetime.fromisoformat, default=DEFAULT_NOW,
+                        help="reference time the visits end before (ISO format, default %(default)s)")
+    parser.add_argument("--output", default="simulated_clinical_logs.csv", help=".csv or .parquet")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = write_simulated_data(args.output, args.visits, args.clinicians, args.seed, args.chunk_visits, now=args.now)
+    elapsed = time.perf_counter() - start
+    print(f"Simulated dataset with {rows} rows saved to '{os.path.basename(args.output)}' in {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,64 @@
+import argparse
 import json
+import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
+import numpy as np
+import pandas as pd
+
 # --- CONFIGURAZIONE ---
 NUM_PAZIENTI = 400
 NUM_ADMISSIONS = 1200
 OUTPUT_FILENAME = "simulated_ricoveri_arricchito.json"
+SEED = None  # None = non deterministico
+# data di riferimento fissa: con lo stesso seed le date dei ricoveri non cambiano da un giorno all'altro
+DATA_RIFERIMENTO = datetime(2025, 1, 1)
+BATCH_SIZE = 50_000  # ricoveri per row group Parquet
 # --------------------
 
-def generate_patient_pool(num_patients):
+# --- Tabelle statiche (costruite una volta sola) ---
+GROUPS = ["Medicina", "Chirurgia", "Riabilitazione", "Maternita_Pediatria", "Neurologia", "Sensoriali_Dermato"]
+DEPARTMENTS = {
+    "Medicina": ["Cardiologia", "Gastroenterologia", "Endocrinologia", "Nefrologia", "Geriatria", "Medicina Interna", "Medicina d'Urgenza", "Pneumologia"],
+    "Chirurgia": ["Chirurgia Generale", "Chirurgia Toracica", "Chirurgia Vascolare", "Chirurgia Plastica", "Ortopedia e Traumatologia", "Neurochirurgia"],
+    "Riabilitazione": ["Fisioterapia", "Logopedia", "Riabilitazione Generale"],
+    "Maternita_Pediatria": ["Sala Parto", "Ostetricia e Ginecologia", "Pediatria"],
+    "Neurologia": ["Neurologia", "Neuropsichiatria Infantile"],
+    "Sensoriali_Dermato": ["Dermatologia", "Otorinolaringoiatria (ORL)"]
+}
+DIAGNOSES = {
+    "Polmonite": {"group": "Medicina", "base_los": 8},
+    "Insufficienza Renale": {"group": "Medicina", "base_los": 7},
+    "Frattura": {"group": "Chirurgia", "base_los": 5},
+    "Diabete": {"group": "Medicina", "base_los": 4},
+    "Ipertensione": {"group": "Medicina", "base_los": 3},
+    "Neoplasia": {"group": "Chirurgia", "base_los": 12},
+    "Ictus": {"group": "Neurologia", "base_los": 10},
+    "Asma": {"group": "Medicina", "base_los": 3},
+    "Parto": {"group": "Maternita_Pediatria", "base_los": 3},
+    "Riabilitazione post-op": {"group": "Riabilitazione", "base_los": 15}
+}
+DIAGNOSIS_NAMES = list(DIAGNOSES.keys())
+COMORBIDITIES_OPTIONS = ["Diabete", "Ipertensione", "Insufficienza Renale", "BPCO", "Fibrillazione Atriale", "Obesità"]
+SEVERITIES = ["low", "moderate", "high"]
+
+# --- Tabelle di lookup per il simulatore vettoriale ---
+_DIAG_GROUP = np.array([GROUPS.index(DIAGNOSES[d]["group"]) for d in DIAGNOSIS_NAMES])
+_DIAG_BASE_LOS = np.array([DIAGNOSES[d]["base_los"] for d in DIAGNOSIS_NAMES], dtype=np.int64)
+_DEPT_FLAT = np.array([dept for g in GROUPS for dept in DEPARTMENTS[g]], dtype=object)
+_GROUP_DEPT_COUNT = np.array([len(DEPARTMENTS[g]) for g in GROUPS])
+_GROUP_DEPT_START = np.concatenate(([0], np.cumsum(_GROUP_DEPT_COUNT)[:-1]))
+# stringa delle comorbidità per (numero, prime tre posizioni della permutazione)
+_N_OPT = len(COMORBIDITIES_OPTIONS)
+_COMORBIDITY_LUT = np.array([
+    ";".join(COMORBIDITIES_OPTIONS[p] for p in (p0, p1, p2)[:k]) if k else "None"
+    for k in range(4) for p0 in range(_N_OPT) for p1 in range(_N_OPT) for p2 in range(_N_OPT)
+], dtype=object)
+
+def generate_patient_pool(num_patients, rng=random):
     """Genera un pool di pazienti unici."""
     patients = []
     first_names_m = ["Marco", "Paolo", "Andrea", "Giovanni", "Giuseppe", "Raffaele", "Luca", "Alessandro", "Davide"]
@@ -16,125 +66,104 @@ def generate_patient_pool(num_patients):
     last_names = ["Romano", "Russo", "Marino", "Rossi", "Ferrari", "Bianchi", "Gallo", "Giordano", "Ricci", "Verdi", "Esposito"]
     
     for i in range(1, num_patients + 1):
-        sex = random.choice(["M", "F"])
+        sex = rng.choice(["M", "F"])
         if sex == "M":
-            name = f"{random.choice(first_names_m)} {random.choice(last_names)}"
+            name = f"{rng.choice(first_names_m)} {rng.choice(last_names)}"
         else:
-            name = f"{random.choice(first_names_f)} {random.choice(last_names)}"
+            name = f"{rng.choice(first_names_f)} {rng.choice(last_names)}"
         
         patients.append({
             "patient_id": f"P{i:04d}",
             "patient_name": name,
-            "age": random.randint(18, 95),
+            "age": rng.randint(18, 95),
             "sex": sex
         })
     print(f"✅ Creato un pool di {len(patients)} pazienti.")
     return patients
 
-def generate_admission_data(admission_id, patient_data):
+def generate_admission_data(admission_id, patient_data, rng=random, today=None):
     """
     Genera i dati di un singolo ricovero con logica clinica correlata.
+    rng è un'istanza di random.Random (di default il generatore globale);
+    today fissa la data di riferimento per rendere l'output riproducibile.
     """
-    groups = ["Medicina", "Chirurgia", "Riabilitazione", "Maternita_Pediatria", "Neurologia", "Sensoriali_Dermato"]
-    departments = {
-        "Medicina": ["Cardiologia", "Gastroenterologia", "Endocrinologia", "Nefrologia", "Geriatria", "Medicina Interna", "Medicina d'Urgenza", "Pneumologia"],
-        "Chirurgia": ["Chirurgia Generale", "Chirurgia Toracica", "Chirurgia Vascolare", "Chirurgia Plastica", "Ortopedia e Traumatologia", "Neurochirurgia"],
-        "Riabilitazione": ["Fisioterapia", "Logopedia", "Riabilitazione Generale"],
-        "Maternita_Pediatria": ["Sala Parto", "Ostetricia e Ginecologia", "Pediatria"],
-        "Neurologia": ["Neurologia", "Neuropsichiatria Infantile"],
-        "Sensoriali_Dermato": ["Dermatologia", "Otorinolaringoiatria (ORL)"]
-    }
-    diagnoses = {
-        "Polmonite": {"group": "Medicina", "base_los": 8},
-        "Insufficienza Renale": {"group": "Medicina", "base_los": 7},
-        "Frattura": {"group": "Chirurgia", "base_los": 5},
-        "Diabete": {"group": "Medicina", "base_los": 4},
-        "Ipertensione": {"group": "Medicina", "base_los": 3},
-        "Neoplasia": {"group": "Chirurgia", "base_los": 12},
-        "Ictus": {"group": "Neurologia", "base_los": 10},
-        "Asma": {"group": "Medicina", "base_los": 3},
-        "Parto": {"group": "Maternita_Pediatria", "base_los": 3},
-        "Riabilitazione post-op": {"group": "Riabilitazione", "base_los": 15}
-    }
-    comorbidities_options = ["Diabete", "Ipertensione", "Insufficienza Renale", "BPCO", "Fibrillazione Atriale", "Obesità"]
-    
     # --- Selezione coerente di diagnosi e reparto ---
-    diagnosis = random.choice(list(diagnoses.keys()))
-    group = diagnoses[diagnosis]["group"]
+    diagnosis = rng.choice(DIAGNOSIS_NAMES)
+    group = DIAGNOSES[diagnosis]["group"]
     
     # Logica per Maternità/Pediatria
     if group == "Maternita_Pediatria":
         if patient_data["sex"] == "M" or patient_data["age"] > 45:
             diagnosis = "Frattura" # Diagnosi più generica
             group = "Chirurgia"
-    department = random.choice(departments[group])
+    department = rng.choice(DEPARTMENTS[group])
 
     # --- Generazione Comorbidità Robusta ---
-    num_comorbidities = random.choices([0, 1, 2, 3], weights=[0.3, 0.4, 0.2, 0.1], k=1)[0]
+    num_comorbidities = rng.choices([0, 1, 2, 3], weights=[0.3, 0.4, 0.2, 0.1], k=1)[0]
     if num_comorbidities == 0:
         comorbidities = "None"
     else:
-        comorbidities = ";".join(random.sample(comorbidities_options, num_comorbidities))
+        comorbidities = ";".join(rng.sample(COMORBIDITIES_OPTIONS, num_comorbidities))
 
     # --- Generazione Durata Ricovero (length_days) CORRELATA ---
-    los = diagnoses[diagnosis]["base_los"]
-    severity = random.choices(["low", "moderate", "high"], weights=[0.5, 0.35, 0.15], k=1)[0]
+    los = DIAGNOSES[diagnosis]["base_los"]
+    severity = rng.choices(["low", "moderate", "high"], weights=[0.5, 0.35, 0.15], k=1)[0]
 
-    if severity == 'moderate': los += random.randint(2, 6)
-    if severity == 'high': los += random.randint(5, 15)
-    if patient_data['age'] > 75: los += random.randint(1, 5)
-    los += num_comorbidities * random.randint(1, 3)
+    if severity == 'moderate': los += rng.randint(2, 6)
+    if severity == 'high': los += rng.randint(5, 15)
+    if patient_data['age'] > 75: los += rng.randint(1, 5)
+    los += num_comorbidities * rng.randint(1, 3)
     
-    intervento_chirurgico = (group == "Chirurgia" and random.random() > 0.2)
-    if intervento_chirurgico: los += random.randint(3, 7)
+    intervento_chirurgico = (group == "Chirurgia" and rng.random() > 0.2)
+    if intervento_chirurgico: los += rng.randint(3, 7)
     
-    los += random.randint(-2, 2) # Aggiunge un po' di rumore
+    los += rng.randint(-2, 2) # Aggiunge un po' di rumore
     length_days = max(1, int(los)) # Assicura che sia almeno 1 giorno
 
-    admission_date = datetime.now() - timedelta(days=random.randint(1, 1095))
+    admission_date = (today or datetime.now()) - timedelta(days=rng.randint(1, 1095))
     discharge_date = admission_date + timedelta(days=length_days)
 
     # --- Generazione Valori Clinici CORRELATI ---
     # Valori di base per un paziente sano
-    pressione_sistolica = random.randint(115, 130)
-    pressione_diastolica = random.randint(75, 85)
-    frequenza_cardiaca = random.randint(65, 85)
-    saturazione_ossigeno = random.randint(96, 99)
-    livello_creatinina = round(random.uniform(0.7, 1.1), 1)
-    globuli_bianchi = random.randint(5000, 9000)
-    indice_pcr = round(random.uniform(1.0, 8.0), 1)
+    pressione_sistolica = rng.randint(115, 130)
+    pressione_diastolica = rng.randint(75, 85)
+    frequenza_cardiaca = rng.randint(65, 85)
+    saturazione_ossigeno = rng.randint(96, 99)
+    livello_creatinina = round(rng.uniform(0.7, 1.1), 1)
+    globuli_bianchi = rng.randint(5000, 9000)
+    indice_pcr = round(rng.uniform(1.0, 8.0), 1)
 
     # Alterazioni basate sulla diagnosi
     if diagnosis in ["Polmonite", "Infezione"]:
-        saturazione_ossigeno = random.randint(90, 95)
-        globuli_bianchi = random.randint(11000, 18000)
-        indice_pcr = random.uniform(50, 150)
+        saturazione_ossigeno = rng.randint(90, 95)
+        globuli_bianchi = rng.randint(11000, 18000)
+        indice_pcr = rng.uniform(50, 150)
     elif diagnosis == "Insufficienza Renale" or "Insufficienza Renale" in comorbidities:
-        livello_creatinina = random.uniform(1.5, 3.5)
-        pressione_sistolica += random.randint(10, 20)
+        livello_creatinina = rng.uniform(1.5, 3.5)
+        pressione_sistolica += rng.randint(10, 20)
     elif diagnosis in ["Ictus", "Infarto"]:
-        pressione_sistolica = random.randint(150, 190)
-        frequenza_cardiaca = random.randint(90, 115)
-        indice_pcr = random.uniform(20, 60)
+        pressione_sistolica = rng.randint(150, 190)
+        frequenza_cardiaca = rng.randint(90, 115)
+        indice_pcr = rng.uniform(20, 60)
     elif diagnosis == "Ipertensione" or "Ipertensione" in comorbidities:
-        pressione_sistolica += random.randint(15, 30)
-        pressione_diastolica += random.randint(5, 15)
+        pressione_sistolica += rng.randint(15, 30)
+        pressione_diastolica += rng.randint(5, 15)
     
     if intervento_chirurgico:
-        indice_pcr += random.uniform(20, 50)
-        globuli_bianchi += random.randint(1000, 4000)
+        indice_pcr += rng.uniform(20, 50)
+        globuli_bianchi += rng.randint(1000, 4000)
 
     # Alterazioni basate sulla gravità
     if severity == 'moderate':
-        pressione_sistolica += random.randint(5, 10)
-        frequenza_cardiaca += random.randint(5, 10)
+        pressione_sistolica += rng.randint(5, 10)
+        frequenza_cardiaca += rng.randint(5, 10)
         indice_pcr *= 1.2
     elif severity == 'high':
-        pressione_sistolica += random.randint(10, 25)
-        frequenza_cardiaca += random.randint(10, 20)
+        pressione_sistolica += rng.randint(10, 25)
+        frequenza_cardiaca += rng.randint(10, 20)
         saturazione_ossigeno = max(88, saturazione_ossigeno - 5)
         indice_pcr *= 1.8
-        globuli_bianchi += random.randint(2000, 6000)
+        globuli_bianchi += rng.randint(2000, 6000)
         livello_creatinina *= 1.2
 
     return {
@@ -151,9 +180,9 @@ def generate_admission_data(admission_id, patient_data):
         "diagnosis": diagnosis,
         "comorbidities": comorbidities,
         "severity": severity,
-        "prior_admissions": random.randint(0, 5),
-        "from_emergency": random.random() < 0.4, # 40% di probabilità
-        "ai_note": random.random() < 0.3, # 30% di probabilità
+        "prior_admissions": rng.randint(0, 5),
+        "from_emergency": rng.random() < 0.4, # 40% di probabilità
+        "ai_note": rng.random() < 0.3, # 30% di probabilità
         "pressione_sistolica": int(pressione_sistolica),
         "pressione_diastolica": int(pressione_diastolica),
         "frequenza_cardiaca": int(frequenza_cardiaca),
@@ -164,21 +193,315 @@ def generate_admission_data(admission_id, patient_data):
         "intervento_chirurgico": intervento_chirurgico
     }
 
+def iter_admissions(patient_pool, count, rng=random, first_id=1, today=None):
+    """Genera i ricoveri uno alla volta, senza accumularli in memoria."""
+    for i in range(first_id, first_id + count):
+        yield generate_admission_data(f"A{i:05d}", rng.choice(patient_pool), rng=rng, today=today)
+
+def generate_admissions_batch(patients, n, rng, first_id=1, today=None):
+    """
+    Versione vettoriale di generate_admission_data: genera n ricoveri in un colpo
+    solo con la stessa logica clinica correlata. patients è il pool di pazienti
+    come DataFrame, rng un numpy.random.Generator.
+    """
+    today = np.datetime64((today or datetime.now()).date(), "D")
+    pat = patients.iloc[rng.integers(0, len(patients), n)].reset_index(drop=True)
+    age = pat["age"].to_numpy()
+    sex = pat["sex"].to_numpy()
+
+    # --- Selezione coerente di diagnosi e reparto ---
+    diag = rng.integers(0, len(DIAGNOSIS_NAMES), n)
+    # Logica per Maternità/Pediatria
+    maternity = (_DIAG_GROUP[diag] == GROUPS.index("Maternita_Pediatria")) & ((sex == "M") | (age > 45))
+    diag = np.where(maternity, DIAGNOSIS_NAMES.index("Frattura"), diag)
+    group = _DIAG_GROUP[diag]
+    department = _DEPT_FLAT[_GROUP_DEPT_START[group] + (rng.random(n) * _GROUP_DEPT_COUNT[group]).astype(np.int64)]
+
+    # --- Comorbidità: le prime k posizioni di una permutazione casuale ---
+    num_comorbidities = rng.choice(4, size=n, p=[0.3, 0.4, 0.2, 0.1])
+    perm = np.argsort(rng.random((n, _N_OPT)), axis=1)[:, :3]
+    comorbidities = _COMORBIDITY_LUT[num_comorbidities * _N_OPT ** 3 + perm[:, 0] * _N_OPT ** 2 + perm[:, 1] * _N_OPT + perm[:, 2]]
+    chosen = np.arange(3) < num_comorbidities[:, None]
+    has_renal = ((perm == COMORBIDITIES_OPTIONS.index("Insufficienza Renale")) & chosen).any(axis=1)
+    has_hypertension = ((perm == COMORBIDITIES_OPTIONS.index("Ipertensione")) & chosen).any(axis=1)
+
+    # --- Durata Ricovero (length_days) CORRELATA ---
+    severity = rng.choice(3, size=n, p=[0.5, 0.35, 0.15])
+    moderate, high = severity == 1, severity == 2
+    los = _DIAG_BASE_LOS[diag].copy()
+    los += np.where(moderate, rng.integers(2, 7, n), 0)
+    los += np.where(high, rng.integers(5, 16, n), 0)
+    los += np.where(age > 75, rng.integers(1, 6, n), 0)
+    los += num_comorbidities * rng.integers(1, 4, n)
+    intervento_chirurgico = (group == GROUPS.index("Chirurgia")) & (rng.random(n) > 0.2)
+    los += np.where(intervento_chirurgico, rng.integers(3, 8, n), 0)
+    los += rng.integers(-2, 3, n)
+    length_days = np.maximum(1, los)
+
+    admission_date = today - rng.integers(1, 1096, n).astype("timedelta64[D]")
+    discharge_date = admission_date + length_days.astype("timedelta64[D]")
+
+    # --- Valori clinici di base (paziente sano) ---
+    pressione_sistolica = rng.integers(115, 131, n)
+    pressione_diastolica = rng.integers(75, 86, n)
+    frequenza_cardiaca = rng.integers(65, 86, n)
+    saturazione_ossigeno = rng.integers(96, 100, n)
+    livello_creatinina = np.round(rng.uniform(0.7, 1.1, n), 1)
+    globuli_bianchi = rng.integers(5000, 9001, n)
+    indice_pcr = np.round(rng.uniform(1.0, 8.0, n), 1)
+
+    # Alterazioni basate sulla diagnosi: stessi rami esclusivi della catena if/elif
+    polmonite = diag == DIAGNOSIS_NAMES.index("Polmonite")
+    renale = ~polmonite & ((diag == DIAGNOSIS_NAMES.index("Insufficienza Renale")) | has_renal)
+    ictus = ~polmonite & ~renale & (diag == DIAGNOSIS_NAMES.index("Ictus"))
+    iperteso = ~polmonite & ~renale & ~ictus & ((diag == DIAGNOSIS_NAMES.index("Ipertensione")) | has_hypertension)
+
+    saturazione_ossigeno = np.where(polmonite, rng.integers(90, 96, n), saturazione_ossigeno)
+    globuli_bianchi = np.where(polmonite, rng.integers(11000, 18001, n), globuli_bianchi)
+    indice_pcr = np.where(polmonite, rng.uniform(50, 150, n), indice_pcr)
+    livello_creatinina = np.where(renale, rng.uniform(1.5, 3.5, n), livello_creatinina)
+    pressione_sistolica = pressione_sistolica + np.where(renale, rng.integers(10, 21, n), 0)
+    pressione_sistolica = np.where(ictus, rng.integers(150, 191, n), pressione_sistolica)
+    frequenza_cardiaca = np.where(ictus, rng.integers(90, 116, n), frequenza_cardiaca)
+    indice_pcr = np.where(ictus, rng.uniform(20, 60, n), indice_pcr)
+    pressione_sistolica = pressione_sistolica + np.where(iperteso, rng.integers(15, 31, n), 0)
+    pressione_diastolica = pressione_diastolica + np.where(iperteso, rng.integers(5, 16, n), 0)
+
+    indice_pcr = indice_pcr + np.where(intervento_chirurgico, rng.uniform(20, 50, n), 0)
+    globuli_bianchi = globuli_bianchi + np.where(intervento_chirurgico, rng.integers(1000, 4001, n), 0)
+
+    # Alterazioni basate sulla gravità
+    pressione_sistolica = pressione_sistolica + np.where(moderate, rng.integers(5, 11, n), 0) + np.where(high, rng.integers(10, 26, n), 0)
+    frequenza_cardiaca = frequenza_cardiaca + np.where(moderate, rng.integers(5, 11, n), 0) + np.where(high, rng.integers(10, 21, n), 0)
+    saturazione_ossigeno = np.where(high, np.maximum(88, saturazione_ossigeno - 5), saturazione_ossigeno)
+    indice_pcr = indice_pcr * np.select([moderate, high], [1.2, 1.8], 1.0)
+    globuli_bianchi = globuli_bianchi + np.where(high, rng.integers(2000, 6001, n), 0)
+    livello_creatinina = np.where(high, livello_creatinina * 1.2, livello_creatinina)
+
+    return pd.DataFrame({
+        "admission_id": "A" + pd.Series(np.arange(first_id, first_id + n)).astype(str).str.zfill(5),
+        "patient_id": pat["patient_id"],
+        "patient_name": pat["patient_name"],
+        "age": age,
+        "sex": sex,
+        "group": np.array(GROUPS, dtype=object)[group],
+        "department": department,
+        "admission_date": np.datetime_as_string(admission_date, unit="D"),
+        "discharge_date": np.datetime_as_string(discharge_date, unit="D"),
+        "length_days": length_days,
+        "diagnosis": np.array(DIAGNOSIS_NAMES, dtype=object)[diag],
+        "comorbidities": comorbidities,
+        "severity": np.array(SEVERITIES, dtype=object)[severity],
+        "prior_admissions": rng.integers(0, 6, n),
+        "from_emergency": rng.random(n) < 0.4,
+        "ai_note": rng.random(n) < 0.3,
+        "pressione_sistolica": pressione_sistolica,
+        "pressione_diastolica": pressione_diastolica,
+        "frequenza_cardiaca": frequenza_cardiaca,
+        "saturazione_ossigeno": saturazione_ossigeno,
+        "livello_creatinina": np.round(livello_creatinina, 1),
+        "globuli_bianchi": globuli_bianchi,
+        "indice_pcr": np.round(indice_pcr, 1),
+        "intervento_chirurgico": intervento_chirurgico,
+    })
+
+def iter_admission_batches(patients, count, rng, first_id=1, today=None, batch_size=BATCH_SIZE):
+    """Genera i ricoveri a blocchi di batch_size righe con il simulatore vettoriale."""
+    for start in range(0, count, batch_size):
+        n = min(batch_size, count - start)
+        yield generate_admissions_batch(patients, n, rng, first_id=first_id + start, today=today)
+
+NUMERIC_COLUMNS = [
+    "length_days", "prior_admissions", "pressione_sistolica", "pressione_diastolica", "frequenza_cardiaca",
+    "saturazione_ossigeno", "livello_creatinina", "globuli_bianchi", "indice_pcr",
+]
+CATEGORICAL_COLUMNS = ["diagnosis", "group", "department", "severity", "intervento_chirurgico", "from_emergency", "ai_note"]
+
+def compare_engines(n=20_000, seed=0):
+    """
+    Confronta le distribuzioni del simulatore vettoriale con quelle della versione
+    scalare: statistica KS a due campioni per le colonne numeriche, massima
+    differenza di frequenza per quelle categoriche.
+    """
+    pool = generate_patient_pool(NUM_PAZIENTI, rng=random.Random(seed))
+    today = DATA_RIFERIMENTO
+    scalar = pd.DataFrame(iter_admissions(pool, n, rng=random.Random(seed), today=today))
+    vector = generate_admissions_batch(pd.DataFrame(pool), n, np.random.default_rng(seed), today=today)
+    # soglia KS con alpha = 0.01
+    ks_limit = 1.63 * np.sqrt(2 / n)
+
+    rows = []
+    for col in NUMERIC_COLUMNS:
+        a = np.sort(scalar[col].to_numpy(dtype=float))
+        b = np.sort(vector[col].to_numpy(dtype=float))
+        grid = np.union1d(a, b)
+        ks = np.max(np.abs(np.searchsorted(a, grid, side="right") / n - np.searchsorted(b, grid, side="right") / n))
+        rows.append({"colonna": col, "scalare": a.mean(), "vettoriale": b.mean(), "distanza": ks, "ok": ks < ks_limit})
+    for col in CATEGORICAL_COLUMNS:
+        freq = pd.concat([scalar[col].value_counts(normalize=True), vector[col].value_counts(normalize=True)], axis=1).fillna(0)
+        diff = float((freq.iloc[:, 0] - freq.iloc[:, 1]).abs().max())
+        rows.append({"colonna": col, "scalare": np.nan, "vettoriale": np.nan, "distanza": diff, "ok": diff < 0.02})
+    return pd.DataFrame(rows)
+
+def write_json(path, admissions):
+    """Scrive un array JSON un ricovero alla volta (compatibile con pd.read_json)."""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for admission in admissions:
+            if count:
+                f.write(",\n")
+            f.write(json.dumps(admission, indent=4, ensure_ascii=False))
+            count += 1
+        f.write("\n]\n")
+    return count
+
+def write_jsonl(path, admissions):
+    """Scrive un ricovero per riga (JSON Lines)."""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for admission in admissions:
+            f.write(json.dumps(admission, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+def write_parquet(path, admissions, batch_size=BATCH_SIZE):
+    """Scrive i ricoveri in Parquet a row group di batch_size righe. Richiede pyarrow."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    count = 0
+    writer = None
+    batch = []
+    try:
+        for admission in admissions:
+            batch.append(admission)
+            if len(batch) == batch_size:
+                writer = _write_parquet_batch(pa, pq, writer, path, batch)
+                count += len(batch)
+                batch = []
+        if batch or writer is None:
+            writer = _write_parquet_batch(pa, pq, writer, path, batch)
+            count += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+def _write_parquet_batch(pa, pq, writer, path, batch):
+    schema = writer.schema if writer is not None else None
+    table = pa.Table.from_pylist(batch, schema=schema)
+    if writer is None:
+        writer = pq.ParquetWriter(path, table.schema)
+    writer.write_table(table)
+    return writer
+
+def write_frames(path, frames, fmt):
+    """Scrive i blocchi DataFrame del simulatore vettoriale nel formato richiesto."""
+    count = 0
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for frame in frames:
+                schema = writer.schema if writer is not None else None
+                table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                count += len(frame)
+        finally:
+            if writer is not None:
+                writer.close()
+        return count
+
+    with open(path, "w", encoding="utf-8") as f:
+        if fmt == "json":
+            f.write("[\n")
+        for frame in frames:
+            if fmt == "jsonl":
+                text = frame.to_json(orient="records", lines=True, force_ascii=False)
+                f.write(text if text.endswith("\n") or not text else text + "\n")
+            else:
+                body = frame.to_json(orient="records", force_ascii=False)[1:-1]
+                if count and body:
+                    f.write(",\n")
+                f.write(body)
+            count += len(frame)
+        if fmt == "json":
+            f.write("\n]\n")
+    return count
+
+WRITERS = {"json": (".json", write_json), "jsonl": (".jsonl", write_jsonl), "parquet": (".parquet", write_parquet)}
+
+def shard_seed(seed, shard):
+    """Seed deterministico per shard: stesso seed e stesso shard danno gli stessi ricoveri."""
+    return None if seed is None else f"{seed}:{shard}"
+
+def shard_path(output, shard, num_shards):
+    if num_shards == 1:
+        return output
+    stem, ext = os.path.splitext(output)
+    return f"{stem}-{shard:04d}{ext}"
+
+def generate_shard(shard, num_shards, num_admissions, patient_pool, seed, fmt, output, today, engine="python"):
+    """Genera e scrive la porzione di ricoveri assegnata allo shard."""
+    per_shard, extra = divmod(num_admissions, num_shards)
+    count = per_shard + (1 if shard < extra else 0)
+    first_id = 1 + shard * per_shard + min(shard, extra)
+    path = shard_path(output, shard, num_shards)
+    if engine == "numpy":
+        rng = np.random.default_rng(None if seed is None else [seed, shard])
+        frames = iter_admission_batches(pd.DataFrame(patient_pool), count, rng, first_id=first_id, today=today)
+        return path, write_frames(path, frames, fmt)
+    rng = random.Random(shard_seed(seed, shard))
+    admissions = iter_admissions(patient_pool, count, rng=rng, first_id=first_id, today=today)
+    return path, WRITERS[fmt][1](path, admissions)
+
 def main():
-    """Funzione principale per generare il file JSON completo."""
-    patient_pool = generate_patient_pool(NUM_PAZIENTI)
-    all_admissions = []
-    
-    for i in range(1, NUM_ADMISSIONS + 1):
-        admission_id = f"A{i:05d}"
-        random_patient = random.choice(patient_pool)
-        admission_data = generate_admission_data(admission_id, random_patient)
-        all_admissions.append(admission_data)
-        
-    with open(OUTPUT_FILENAME, "w", encoding="utf-8") as f:
-        json.dump(all_admissions, f, indent=4, ensure_ascii=False)
-    
-    print(f"✅ File '{OUTPUT_FILENAME}' con {len(all_admissions)} ricoveri generato con successo!")
+    """Funzione principale per generare il file dei ricoveri simulati."""
+    parser = argparse.ArgumentParser(description="Genera ricoveri simulati con logica clinica correlata.")
+    parser.add_argument("--admissions", type=int, default=NUM_ADMISSIONS)
+    parser.add_argument("--patients", type=int, default=NUM_PAZIENTI)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--format", choices=list(WRITERS), default="jsonl", help="jsonl (default, in streaming), json o parquet")
+    parser.add_argument("--today", type=datetime.fromisoformat, default=DATA_RIFERIMENTO,
+                        help="data di riferimento dei ricoveri, formato ISO (default %(default)s)")
+    parser.add_argument("--output", default=None, help="percorso di output (default in base al formato)")
+    parser.add_argument("--shards", type=int, default=1, help="numero di file/porzioni generati in parallelo")
+    parser.add_argument("--workers", type=int, default=None, help="processi paralleli (default: numero di CPU)")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python", help="generatore scalare o vettoriale")
+    parser.add_argument("--validate", action="store_true", help="confronta le distribuzioni dei due generatori ed esce")
+    args = parser.parse_args()
+
+    if args.validate:
+        report = compare_engines(seed=args.seed or 0)
+        print(report.to_string(index=False))
+        print("✅ Distribuzioni compatibili" if report["ok"].all() else "⚠️ Distribuzioni divergenti")
+        return
+
+    output = args.output or os.path.splitext(OUTPUT_FILENAME)[0] + WRITERS[args.format][0]
+    # pool e data di riferimento condivisi da tutti gli shard
+    patient_pool = generate_patient_pool(args.patients, rng=random.Random(args.seed))
+    today = args.today.replace(hour=0, minute=0, second=0, microsecond=0)
+    num_shards = max(1, args.shards)
+
+    start = time.perf_counter()
+    jobs = [(shard, num_shards, args.admissions, patient_pool, args.seed, args.format, output, today, args.engine) for shard in range(num_shards)]
+    if num_shards == 1:
+        results = [generate_shard(*jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(generate_shard, *zip(*jobs)))
+    elapsed = time.perf_counter() - start
+
+    total = sum(count for _, count in results)
+    for path, count in results:
+        print(f"✅ File '{path}' con {count} ricoveri generato con successo!")
+    print(f"⏱ {total} ricoveri in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} ricoveri/s)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
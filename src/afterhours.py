@@ -0,0 +1,105 @@
+from __future__ import annotations
+from datetime import date, timedelta
+
+import pandas as pd
+import numpy as np
+
+from src.perf import instrument
+
+# Orario di lavoro standard: fuori da questa fascia, nei weekend e nei festivi
+# l'attività conta come after-hours. department_shifts sovrascrive la fascia
+# per reparto, es. {"Pronto Soccorso": ("07:00", "19:00")} (turni nella stessa giornata).
+DEFAULT_CALENDAR = {
+    "work_start": "08:00",
+    "work_end": "18:00",
+    "weekend": (5, 6),  # sabato, domenica (lunedì = 0)
+    "holidays": (),
+    "department_shifts": {},
+}
+SECONDS_PER_DAY = 86_400
+
+def _seconds(hhmm: str) -> int:
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 3600 + int(minutes) * 60
+
+def _easter(year: int) -> date:
+    # algoritmo gregoriano anonimo (Meeus/Jones/Butcher)
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = (h + l - 7 * m + 114) % 31 + 1
+    return date(year, month, day)
+
+def italian_holidays(years) -> list:
+    """
+    Festività nazionali italiane (incluso il Lunedì dell'Angelo) per gli anni indicati.
+    """
+    fixed = [(1, 1), (1, 6), (4, 25), (5, 1), (6, 2), (8, 15), (11, 1), (12, 8), (12, 25), (12, 26)]
+    holidays = []
+    for year in years:
+        holidays.extend(date(year, month, day) for month, day in fixed)
+        holidays.append(_easter(year) + timedelta(days=1))
+    return sorted(holidays)
+
+def _epoch_seconds(ts: pd.Series) -> tuple:
+    # orari locali "naive": il giorno di calendario è quello dell'orologio di reparto
+    values = ts.to_numpy(dtype="datetime64[s]")
+    return values.astype(np.int64), np.isnat(values)
+
+@instrument("afterhours.after_hours_minutes")
+def after_hours_minutes(df: pd.DataFrame, calendar: dict | None = None) -> pd.Series:
+    """
+    Minuti esatti di ogni attività [start_time, end_time) che cadono fuori
+    dall'orario di lavoro del suo reparto, nei weekend o nei festivi.
+
+    Calcolo vettoriale: W(t) = minuti lavorativi cumulati fino a t, ottenuti da
+    un cumulato dei giorni lavorativi e dalla posizione di t nella fascia del
+    giorno; i minuti lavorativi di un intervallo sono W(end) - W(start) e il
+    resto è after-hours. Gestisce anche intervalli su più giorni.
+    """
+    if "start_time" not in df.columns or "end_time" not in df.columns:
+        return pd.Series(np.nan, index=df.index, name="after_hours_minutes")
+    calendar = {**DEFAULT_CALENDAR, **(calendar or {})}
+
+    # orari non interpretabili -> NaT: la riga resta senza minuti after-hours
+    start, start_nat = _epoch_seconds(pd.to_datetime(df["start_time"], errors="coerce"))
+    end, end_nat = _epoch_seconds(pd.to_datetime(df["end_time"], errors="coerce"))
+    valid = ~(start_nat | end_nat) & (end >= start)
+    if not valid.any():
+        return pd.Series(np.nan, index=df.index, name="after_hours_minutes")
+    start = np.where(valid, start, 0)
+    end = np.where(valid, end, 0)
+
+    # fascia lavorativa per riga (default o turno del reparto)
+    shift_start = np.full(len(df), _seconds(calendar["work_start"]), dtype=np.int64)
+    shift_end = np.full(len(df), _seconds(calendar["work_end"]), dtype=np.int64)
+    if calendar["department_shifts"] and "department" in df.columns:
+        shifts = {dept: (_seconds(a), _seconds(b)) for dept, (a, b) in calendar["department_shifts"].items()}
+        dept = df["department"].astype(object)
+        shift_start = dept.map({k: v[0] for k, v in shifts.items()}).fillna(pd.Series(shift_start, index=df.index)).to_numpy(dtype=np.int64)
+        shift_end = dept.map({k: v[1] for k, v in shifts.items()}).fillna(pd.Series(shift_end, index=df.index)).to_numpy(dtype=np.int64)
+    shift_len = np.maximum(shift_end - shift_start, 0)
+
+    # calendario dei giorni coperti dal log: giorni lavorativi e loro cumulato
+    start_day = start // SECONDS_PER_DAY
+    end_day = end // SECONDS_PER_DAY
+    first_day = start_day[valid].min()
+    days = np.arange(first_day, end_day[valid].max() + 1)
+    weekday = (days + 3) % 7  # 1970-01-01 era un giovedì
+    holidays = np.array([np.datetime64(pd.Timestamp(h).date(), "D").astype(np.int64) for h in calendar["holidays"]], dtype=np.int64)
+    workday = ~np.isin(weekday, list(calendar["weekend"])) & ~np.isin(days, holidays)
+    workdays_before = np.concatenate(([0], np.cumsum(workday)))
+
+    def worked_until(t, day):
+        idx = np.where(valid, day - first_day, 0)
+        into_shift = np.clip(t - day * SECONDS_PER_DAY - shift_start, 0, shift_len)
+        return workdays_before[idx] * shift_len + workday[idx] * into_shift
+
+    working = worked_until(end, end_day) - worked_until(start, start_day)
+    after = (end - start - working) / 60
+    return pd.Series(np.where(valid, after, np.nan), index=df.index, name="after_hours_minutes")
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import hashlib
+import io
+import pandas as pd
+import streamlit as st
+from matplotlib.figure import Figure
+
+def data_hash(data: pd.DataFrame) -> str:
+    """
+    Hash stabile di un aggregato (indice incluso), usato come chiave di cache dei grafici.
+    """
+    hashed = pd.util.hash_pandas_object(data, index=True).values
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _bar_png(key: str, _labels: tuple, _values: tuple, xlabel: str, ylabel: str, title: str, rotate: int = 0) -> bytes:
+    # in cache vanno i byte del PNG, non la Figure: ogni sessione riceve la sua
+    # copia immutabile e la figura, costruita senza pyplot, vive solo qui dentro
+    fig = Figure()
+    ax = fig.subplots()
+    ax.bar(_labels, _values)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    if rotate:
+        ax.tick_params(axis="x", labelrotation=rotate)
+    fig.tight_layout()
+    buf = io.BytesIO()
+    # stessa risoluzione e ritaglio di st.pyplot
+    fig.savefig(buf, format="png", dpi=200, bbox_inches="tight")
+    return buf.getvalue()
+
+def activity_png(act: pd.DataFrame) -> bytes:
+    """
+    Grafico a barre (PNG) del tempo totale per attività (output di share_time_by_activity).
+    """
+    return _bar_png(
+        data_hash(act), tuple(act.index), tuple(act["minutes"]),
+        "Attività", "Minuti totali", "Tempo totale per attività",
+    )
+
+def workload_png(cl: pd.DataFrame) -> bytes:
+    """
+    Grafico a barre (PNG) del carico per clinico (output di clinicians_workload).
+    """
+    return _bar_png(
+        data_hash(cl), tuple(cl["clinician_id"]), tuple(cl["total_minutes"]),
+        "Clinico", "Minuti totali", "Workload totale (ordinato)", rotate=45,
+    )
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _bar_spec(key: str, _records: list, x: str, y: str, x_title: str, y_title: str, title: str) -> dict:
+    # lo spec include i dati: a parità di hash viene riusato così com'è
+    return {
+        "title": title,
+        "data": {"values": _records},
+        "mark": {"type": "bar", "tooltip": True},
+        "encoding": {
+            # mantiene l'ordinamento decrescente già calcolato dalle funzioni KPI
+            "x": {"field": x, "type": "nominal", "sort": "-y", "title": x_title},
+            "y": {"field": y, "type": "quantitative", "title": y_title},
+        },
+    }
+
+def activity_chart(act: pd.DataFrame) -> None:
+    """
+    Variante nativa (Vega-Lite) del grafico per attività, senza matplotlib.
+    """
+    records = act.rename_axis("activity").reset_index().to_dict("records")
+    spec = _bar_spec(data_hash(act), records, "activity", "minutes", "Attività", "Minuti totali", "Tempo totale per attività")
+    st.vega_lite_chart(spec=spec, width="stretch")
+
+def workload_chart(cl: pd.DataFrame) -> None:
+    """
+    Variante nativa (Vega-Lite) del grafico per clinico, senza matplotlib.
+    """
+    records = cl.to_dict("records")
+    spec = _bar_spec(data_hash(cl), records, "clinician_id", "total_minutes", "Clinico", "Minuti totali", "Workload totale (ordinato)")
+    st.vega_lite_chart(spec=spec, width="stretch")
@@ -0,0 +1,125 @@
+from __future__ import annotations
+import functools
+import io
+import tempfile
+import zlib
+import pandas as pd
+import streamlit as st
+
+from src.charts import data_hash
+from src.perf import instrument
+
+# formato -> (estensione, mime type)
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "CSV compresso (gzip)": (".csv.gz", "application/gzip"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+CHUNK_ROWS = 100_000
+
+def iter_csv_chunks(df: pd.DataFrame, chunk_rows: int = CHUNK_ROWS, index: bool = False):
+    """
+    Serializza il DataFrame in CSV a blocchi di chunk_rows righe (intestazione nel primo blocco).
+    """
+    yield df.iloc[0:0].to_csv(index=index).encode("utf-8")
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=index, header=False).encode("utf-8")
+
+def iter_gzip_chunks(chunks):
+    """
+    Comprime in streaming una sequenza di blocchi di byte in formato gzip.
+    """
+    compressor = zlib.compressobj(wbits=31)  # wbits=31: contenitore gzip
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+def write_parquet(df: pd.DataFrame, sink, chunk_rows: int = CHUNK_ROWS, index: bool = False) -> None:
+    """
+    Scrive il DataFrame in Parquet un row group alla volta. Richiede pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # schema calcolato sull'intero DataFrame: i blocchi restano coerenti anche
+    # se una colonna è tutta vuota in un singolo blocco
+    schema = pa.Schema.from_pandas(df, preserve_index=index)
+    with pq.ParquetWriter(sink, schema) as writer:
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=index))
+
+@instrument("export.write_export")
+def write_export(df: pd.DataFrame, fmt: str, sink, index: bool = False) -> None:
+    """
+    Scrive l'export nel formato richiesto (chiave di EXPORT_FORMATS) su un file
+    binario aperto, un blocco alla volta.
+    """
+    if fmt == "Parquet":
+        write_parquet(df, sink, index=index)
+        return
+    chunks = iter_csv_chunks(df, index=index)
+    if fmt == "CSV compresso (gzip)":
+        chunks = iter_gzip_chunks(chunks)
+    for chunk in chunks:
+        sink.write(chunk)
+
+def export_bytes(df: pd.DataFrame, fmt: str, index: bool = False) -> bytes:
+    """
+    Contenuto dell'export nel formato richiesto, interamente in memoria.
+    """
+    buffer = io.BytesIO()
+    write_export(df, fmt, buffer, index=index)
+    return buffer.getvalue()
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _export_file(key: str, _df: pd.DataFrame, fmt: str, index: bool):
+    # l'export va su un file temporaneo e in cache resta solo il suo handle.
+    # Il file viene cancellato quando l'handle non è più referenziato: la
+    # rimozione dalla cache non basta finché un pulsante di download lo usa
+    ext, _ = EXPORT_FORMATS[fmt]
+    tmp = tempfile.NamedTemporaryFile(prefix="export_", suffix=ext)
+    write_export(_df, fmt, tmp, index=index)
+    tmp.flush()
+    return tmp
+
+def _read_file(tmp) -> bytes:
+    # riceve l'handle e non il percorso: il download differito lo tiene in vita.
+    # Handle separato a ogni download: nessuna posizione condivisa tra sessioni
+    with open(tmp.name, "rb") as f:
+        return f.read()
+
+def export_widget(df: pd.DataFrame, label: str, file_stem: str, key: str, index: bool = False) -> None:
+    """
+    Pulsante di export su richiesta: il file viene generato su disco solo dopo il
+    click su "Prepara", resta in cache per hash dei dati filtrati e formato, e
+    viene letto solo quando si scarica. L'export preparato resta in session_state
+    e il download rimane visibile finché dati filtrati e formato non cambiano.
+    """
+    fmt = st.selectbox(f"Formato {label}", list(EXPORT_FORMATS), key=f"{key}_fmt")
+    state_key = f"{key}_export"
+    clicked = st.button(f"⚙️ Prepara {label}", key=f"{key}_prep")
+    prepared = st.session_state.get(state_key)
+    if not clicked and prepared is None:
+        return
+    digest = data_hash(df)
+    if clicked:
+        try:
+            prepared = {"digest": digest, "fmt": fmt, "file": _export_file(digest, df, fmt, index)}
+        except ImportError:
+            st.error("Export Parquet non disponibile: installa pyarrow.")
+            return
+        st.session_state[state_key] = prepared
+    elif prepared["fmt"] != fmt or prepared["digest"] != digest:
+        # filtri o formato cambiati: l'export preparato non corrisponde più
+        del st.session_state[state_key]
+        return
+    ext, mime = EXPORT_FORMATS[fmt]
+    # download differito: Streamlit non invia file a blocchi, ma così i byte
+    # vengono letti dal disco solo al click e non restano in memoria nel rerun
+    st.download_button(
+        f"⬇️ Scarica {label}", data=functools.partial(_read_file, prepared["file"]),
+        file_name=f"{file_stem}{ext}", mime=mime, key=f"{key}_dl",
+    )
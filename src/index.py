@@ -0,0 +1,115 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+
+INDEX_COLUMNS = ("department", "clinician_id")
+
+def build_log_index(df: pd.DataFrame) -> tuple[pd.DataFrame, dict]:
+    """
+    Ordina il log per reparto e clinico e costruisce la tabella degli offset
+    {reparto: {clinico: (start, stop)}}. Ogni coppia reparto/clinico diventa
+    una fetta contigua del log ordinato, quindi i filtri non scansionano le righe.
+    Reparto o clinico mancanti sono indicizzati con la chiave None: quelle righe
+    compaiono solo finché la relativa dimensione non è filtrata.
+    """
+    if df.empty or any(col not in df.columns for col in INDEX_COLUMNS):
+        return df, {}
+
+    dept_codes, depts = pd.factorize(df["department"], sort=True)
+    clin_codes, clins = pd.factorize(df["clinician_id"], sort=True)
+    # i valori mancanti hanno codice -1: finiscono in testa, con chiave None
+    order = np.lexsort((clin_codes, dept_codes))
+    df_sorted = df.iloc[order].reset_index(drop=True)
+
+    key = dept_codes[order].astype(np.int64) * (len(clins) + 1) + clin_codes[order]
+    change = np.flatnonzero(np.diff(key)) + 1
+    starts = np.concatenate(([0], change))
+    stops = np.concatenate((change, [len(key)]))
+
+    offsets: dict = {}
+    for start, stop in zip(starts, stops):
+        d = dept_codes[order[start]]
+        c = clin_codes[order[start]]
+        dept = depts[d] if d >= 0 else None
+        clin = clins[c] if c >= 0 else None
+        offsets.setdefault(dept, {})[clin] = (int(start), int(stop))
+    return df_sorted, offsets
+
+def index_departments(offsets: dict) -> list:
+    """Reparti presenti nell'indice (senza la chiave None dei reparti mancanti)."""
+    return sorted(dept for dept in offsets if dept is not None)
+
+def _clinician_keys(offsets: dict, departments=None) -> set:
+    # chiavi dei clinici, compresa None se qualche riga non ha il clinico
+    found = set()
+    for dept in offsets.keys() if departments is None else departments:
+        found.update(offsets.get(dept, {}))
+    return found
+
+def index_clinicians(offsets: dict, departments=None) -> list:
+    """
+    Clinici presenti nei reparti indicati (tutti se departments è None), letti dall'indice.
+    """
+    return sorted(clin for clin in _clinician_keys(offsets, departments) if clin is not None)
+
+def select_rows(df: pd.DataFrame, offsets: dict, departments=None, clinicians=None) -> pd.DataFrame:
+    """
+    Restituisce le righe dei reparti/clinici richiesti come fette del log ordinato
+    da build_log_index. None significa "tutti" (righe senza valore comprese, come
+    senza filtro): se nessun filtro restringe davvero la selezione il log torna
+    invariato, senza copie né scansioni.
+    """
+    wanted = None if clinicians is None else set(clinicians)
+    if departments is None:
+        if wanted is None or wanted.issuperset(_clinician_keys(offsets)):
+            return df
+        departments = offsets.keys()
+
+    slices = []
+    for dept in departments:
+        per_clin = offsets.get(dept)
+        if not per_clin:
+            continue
+        if wanted is None or wanted.issuperset(per_clin):
+            # l'intero reparto è contiguo nel log ordinato
+            bounds = per_clin.values()
+            slices.append((min(b[0] for b in bounds), max(b[1] for b in bounds)))
+        else:
+            slices.extend(bounds for clin, bounds in per_clin.items() if clin in wanted)
+
+    if not slices:
+        return df.iloc[0:0]
+
+    # fonde le fette adiacenti per restituire, quando possibile, una sola vista
+    slices.sort()
+    merged = [list(slices[0])]
+    for start, stop in slices[1:]:
+        if start == merged[-1][1]:
+            merged[-1][1] = stop
+        else:
+            merged.append([start, stop])
+    if len(merged) == 1:
+        return df.iloc[merged[0][0]:merged[0][1]]
+    positions = np.concatenate([np.arange(start, stop) for start, stop in merged])
+    return df.iloc[positions]
+
+def cell_partials(df: pd.DataFrame, offsets: dict, fn) -> dict:
+    """
+    Applica fn a ogni cella reparto/clinico del log ordinato e restituisce
+    {reparto: {clinico: fn(fetta)}}: aggregati parziali costruiti una volta,
+    da combinare per qualsiasi selezione con select_partials.
+    """
+    return {
+        dept: {clin: fn(df.iloc[start:stop]) for clin, (start, stop) in per_clin.items()}
+        for dept, per_clin in offsets.items()
+    }
+
+def select_partials(partials: dict, departments=None, clinicians=None) -> list:
+    """Parziali delle celle selezionate, con le stesse regole di select_rows (None = tutti)."""
+    wanted = None if clinicians is None else set(clinicians)
+    selected = []
+    for dept in partials if departments is None else departments:
+        for clin, partial in partials.get(dept, {}).items():
+            if wanted is None or clin in wanted:
+                selected.append(partial)
+    return selected
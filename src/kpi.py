@@ -2,11 +2,18 @@ from __future__ import annotations
 import pandas as pd
 import numpy as np
 
+from src.perf import instrument
+from src.sketches import (
+    bottom_k, digest_cdf, digest_merge, digest_quantile, digest_sketch, hll_count, hll_merge, hll_sketch, reservoir_merge,
+)
+
+@instrument("kpi.total_minutes_per_visit")
 def total_minutes_per_visit(df: pd.DataFrame) -> pd.Series:
     if "visit_id" not in df.columns:
         return pd.Series(dtype=float)
     return df.groupby("visit_id")["minutes"].sum()
 
+@instrument("kpi.avg_minutes_per_visit")
 def avg_minutes_per_visit(df: pd.DataFrame) -> float:
     if "visit_id" not in df.columns:
         return 0.0
@@ -16,6 +23,7 @@ def avg_minutes_per_visit(df: pd.DataFrame) -> float:
         return 0.0
     return float(total_minutes.mean())
 
+@instrument("kpi.share_time_by_activity")
 def share_time_by_activity(df: pd.DataFrame) -> pd.DataFrame:
     if "minutes" not in df.columns or "activity" not in df.columns:
         return pd.DataFrame(columns=["minutes", "percent"])
@@ -26,17 +34,24 @@ def share_time_by_activity(df: pd.DataFrame) -> pd.DataFrame:
     pct = (by_act / tot * 100).round(1)
     return pd.DataFrame({"minutes": by_act, "percent": pct})
 
-def avg_after_hours_minutes_per_visit(df: pd.DataFrame) -> float:
-    if "visit_id" not in df.columns or "is_after_hours" not in df.columns or "minutes" not in df.columns:
+@instrument("kpi.avg_after_hours_minutes_per_visit")
+def avg_after_hours_minutes_per_visit(df: pd.DataFrame, use_intervals: bool = True) -> float:
+    if "visit_id" not in df.columns:
+        return 0.0
+    # minuti after-hours esatti (src/afterhours.py) se disponibili, altrimenti il flag per riga
+    if use_intervals and "after_hours_minutes" in df.columns:
+        after = df["after_hours_minutes"].fillna(0)
+    elif "is_after_hours" in df.columns and "minutes" in df.columns:
+        after = df["minutes"].where(df["is_after_hours"].astype(bool), 0)
+    else:
         return 0.0
-    def _after(x):
-        return x.loc[x["is_after_hours"], "minutes"].sum()
     # handle empty series
-    per_visit = df.groupby("visit_id").apply(_after)
+    per_visit = after.groupby(df["visit_id"]).sum()
     if per_visit.empty:
         return 0.0
     return float(per_visit.mean())
 
+@instrument("kpi.ai_note_share")
 def ai_note_share(df: pd.DataFrame) -> float:
     if "visit_id" not in df.columns or "is_ai_note" not in df.columns:
         return 0.0
@@ -47,6 +62,7 @@ def ai_note_share(df: pd.DataFrame) -> float:
         return 0.0
     return float(per_visit_ai.mean() * 100)
 
+@instrument("kpi.ai_correction_avg_minutes")
 def ai_correction_avg_minutes(df: pd.DataFrame) -> float:
     if "activity" not in df.columns or "is_ai_note" not in df.columns or "ai_edit_minutes" not in df.columns:
         return 0.0
@@ -55,6 +71,7 @@ def ai_correction_avg_minutes(df: pd.DataFrame) -> float:
         return 0.0
     return float(ai_docs["ai_edit_minutes"].mean())
 
+@instrument("kpi.clinicians_workload")
 def clinicians_workload(df: pd.DataFrame) -> pd.DataFrame:
     if "clinician_id" not in df.columns or "minutes" not in df.columns:
         return pd.DataFrame(columns=["clinician_id", "total_minutes"])
@@ -62,6 +79,58 @@ def clinicians_workload(df: pd.DataFrame) -> pd.DataFrame:
     per_clin.rename(columns={"minutes": "total_minutes"}, inplace=True)
     return per_clin
 
+@instrument("kpi.clinician_overlaps")
+def clinician_overlaps(df: pd.DataFrame) -> pd.DataFrame:
+    cols = ["clinician_id", "day", "overlap_minutes", "peak_concurrency"]
+    if any(col not in df.columns for col in ["clinician_id", "start_time", "end_time"]):
+        return pd.DataFrame(columns=cols)
+    # orari non interpretabili -> NaT, scartati dalla maschera valid
+    start = pd.to_datetime(df["start_time"], errors="coerce").to_numpy(dtype="datetime64[s]")
+    end = pd.to_datetime(df["end_time"], errors="coerce").to_numpy(dtype="datetime64[s]")
+    valid = ~np.isnat(start) & ~np.isnat(end) & (end > start)
+    if not valid.any():
+        return pd.DataFrame(columns=cols)
+    codes, clinicians = pd.factorize(df["clinician_id"].to_numpy()[valid])
+
+    start = start[valid].astype(np.int64)
+    end = end[valid].astype(np.int64)
+
+    # eventi neutri a ogni mezzanotte attraversata: dividono i segmenti tra i giorni
+    crossings = (end - 1) // 86_400 - start // 86_400
+    midnight_clin = np.repeat(codes, crossings)
+    first_midnight = np.repeat((start // 86_400 + 1) * 86_400, crossings)
+    offset = np.arange(crossings.sum()) - np.repeat(np.cumsum(crossings) - crossings, crossings)
+    midnight_time = first_midnight + offset * 86_400
+
+    # sweep line: +1 a ogni inizio, -1 a ogni fine, un solo ordinamento per clinico e tempo
+    # (a parità di istante le fine precedono gli inizi: attività contigue non si sovrappongono)
+    n = len(codes)
+    ev_clin = np.concatenate((codes, codes, midnight_clin))
+    ev_time = np.concatenate((start, end, midnight_time))
+    ev_delta = np.concatenate((np.ones(n, dtype=np.int64), -np.ones(n, dtype=np.int64), np.zeros(len(midnight_time), dtype=np.int64)))
+    order = np.lexsort((ev_delta, ev_time, ev_clin))
+    clin, t, delta = ev_clin[order], ev_time[order], ev_delta[order]
+    # ogni clinico chiude a zero, quindi il cumulato globale è la concorrenza per clinico
+    concurrency = np.cumsum(delta)
+
+    # tempo tra un evento e il successivo dello stesso clinico
+    segment = np.zeros(len(t), dtype=np.int64)
+    same = clin[1:] == clin[:-1]
+    segment[:-1] = np.where(same, t[1:] - t[:-1], 0)
+    overlap = np.where(concurrency >= 2, segment, 0)
+
+    events = pd.DataFrame({"clin": clin, "day": t // 86_400, "overlap": overlap, "concurrency": concurrency})
+    per_day = events.groupby(["clin", "day"], sort=False).agg(
+        overlap_seconds=("overlap", "sum"), peak_concurrency=("concurrency", "max")
+    ).reset_index()
+    return pd.DataFrame({
+        "clinician_id": clinicians[per_day["clin"].to_numpy()],
+        "day": pd.to_datetime(per_day["day"].to_numpy(), unit="D"),
+        "overlap_minutes": (per_day["overlap_seconds"] / 60).round(1),
+        "peak_concurrency": per_day["peak_concurrency"],
+    }).sort_values(["overlap_minutes", "peak_concurrency"], ascending=False, ignore_index=True)
+
+@instrument("kpi.outlier_visits")
 def outlier_visits(df: pd.DataFrame) -> pd.DataFrame:
     if "visit_id" not in df.columns:
         return pd.DataFrame(columns=["visit_id", "total_minutes"])
@@ -73,6 +142,133 @@ def outlier_visits(df: pd.DataFrame) -> pd.DataFrame:
     cut = q3 + 1.5 * iqr
     return tv[tv["total_minutes"] > cut].sort_values("total_minutes", ascending=False)
 
+# --- Modalità approssimata (sketch combinabili, vedi src/sketches.py) ---
+# Gli sketch si costruiscono una volta per partizione (file, cella
+# reparto/clinico dell'indice, snapshot) con approx_partial e si uniscono con
+# merge_approx: le stime per una selezione di partizioni non riscansionano le
+# righe. Ogni partizione tiene solo sketch di dimensione fissa (HyperLogLog,
+# t-digest, bottom-k delle visite più lunghe) e somme, mai dati per visita.
+# Una visita divisa tra partizioni entra nel t-digest e nell'anteprima come
+# parti separate. partial accetta lo sketch già unito delle partizioni.
+
+def approx_partial(df: pd.DataFrame, p: int = 14, delta: float = 200, k: int = 1000) -> dict:
+    """
+    Sketch di una partizione del log: HyperLogLog di visite, visite con nota AI
+    e clinici, t-digest dei minuti per visita, le k visite più lunghe (anteprima
+    degli outlier) e le somme per le medie delle schede KPI.
+    """
+    has_visits = "visit_id" in df.columns
+    totals = total_minutes_per_visit(df) if has_visits else pd.Series(dtype=float)
+    ai = df["is_ai_note"].fillna(False).astype(bool) if "is_ai_note" in df.columns else pd.Series(False, index=df.index)
+    if "after_hours_minutes" in df.columns:
+        after = df["after_hours_minutes"].fillna(0)
+    elif "is_after_hours" in df.columns and "minutes" in df.columns:
+        after = df["minutes"].where(df["is_after_hours"].astype(bool), 0)
+    else:
+        after = pd.Series(0.0, index=df.index)
+    edits = df.loc[(df["activity"] == "documentation") & ai, "ai_edit_minutes"] if {"activity", "ai_edit_minutes"} <= set(df.columns) else pd.Series(dtype=float)
+    longest = pd.DataFrame({"visit_id": totals.index.to_numpy(dtype=object), "total_minutes": totals.to_numpy(dtype=np.float64)})
+    return {
+        "visits": hll_sketch(totals.index, p),
+        "ai_visits": hll_sketch(df.loc[ai, "visit_id"] if has_visits else [], p),
+        "clinicians": hll_sketch(df["clinician_id"] if "clinician_id" in df.columns else [], p),
+        "digest": digest_sketch(totals, delta),
+        "longest": bottom_k(longest, -longest["total_minutes"].to_numpy(), k),
+        "minutes": float(df["minutes"].sum()) if "minutes" in df.columns else 0.0,
+        "after_hours_minutes": float(after.sum()) if has_visits else 0.0,
+        "ai_edit": (float(edits.sum()), int(edits.count())),
+    }
+
+def merge_approx(*partials: dict) -> dict:
+    """Unione degli sketch di più partizioni, con lo stesso formato di approx_partial."""
+    partials = [partial for partial in partials if partial is not None]
+    return {
+        "visits": hll_merge(*(partial["visits"] for partial in partials)),
+        "ai_visits": hll_merge(*(partial["ai_visits"] for partial in partials)),
+        "clinicians": hll_merge(*(partial["clinicians"] for partial in partials)),
+        "digest": digest_merge(*(partial["digest"] for partial in partials)),
+        "longest": reservoir_merge(*(partial["longest"] for partial in partials)),
+        "minutes": sum(partial["minutes"] for partial in partials),
+        "after_hours_minutes": sum(partial["after_hours_minutes"] for partial in partials),
+        "ai_edit": tuple(map(sum, zip(*(partial["ai_edit"] for partial in partials)))),
+    }
+
+def _approx_sketch(df: pd.DataFrame | None, partial: dict | None, **params) -> dict | None:
+    # sketch di df (se presente) unito a partial; None se non c'è nessuna delle due
+    if df is None:
+        return partial
+    own = approx_partial(df, **params)
+    return own if partial is None else merge_approx(own, partial)
+
+@instrument("kpi.outlier_visits_approx")
+def outlier_visits_approx(df: pd.DataFrame | None = None, delta: float = 200, partial: dict | None = None) -> pd.DataFrame:
+    """
+    Visite outlier con la soglia IQR stimata dal t-digest: le più lunghe oltre
+    la soglia, dall'anteprima bottom-k costruita per partizione. attrs riporta
+    soglia, errore di rango dei quartili e numero stimato di outlier.
+    """
+    sketch = _approx_sketch(df, partial, delta=delta)
+    if sketch is None or not len(sketch["digest"]["means"]):
+        return pd.DataFrame(columns=["visit_id", "total_minutes"])
+    digest = sketch["digest"]
+    q1, q3 = digest_quantile(digest, 0.25), digest_quantile(digest, 0.75)
+    cut = q3["value"] + 1.5 * (q3["value"] - q1["value"])
+    longest = sketch["longest"]["rows"]
+    out = longest[longest["total_minutes"] > cut].sort_values("total_minutes", ascending=False, ignore_index=True)
+    count = (1 - digest_cdf(digest, cut)) * digest["weights"].sum()
+    out.attrs.update(
+        cut=cut, rank_error=max(q1["rank_error"], q3["rank_error"]),
+        # l'anteprima è completa se non tutte le k visite tenute superano la soglia
+        count=max(round(count), len(out)) if len(out) == sketch["longest"]["k"] else len(out),
+    )
+    return out
+
+@instrument("kpi.ai_note_share_approx")
+def ai_note_share_approx(df: pd.DataFrame | None = None, p: int = 14, partial: dict | None = None) -> dict:
+    sketch = _approx_sketch(df, partial, p=p)
+    if sketch is None:
+        return {"value": 0.0, "error": 0.0}
+    total, ai = hll_count(sketch["visits"]), hll_count(sketch["ai_visits"])
+    if total["value"] == 0:
+        return {"value": 0.0, "error": 0.0, "visits": sketch["visits"], "ai_visits": sketch["ai_visits"]}
+    share = min(ai["value"] / total["value"], 1.0) * 100
+    # errori relativi indipendenti sommati in quadratura
+    error = share * np.hypot(ai["relative_error"], total["relative_error"])
+    return {"value": share, "error": error, "visits": sketch["visits"], "ai_visits": sketch["ai_visits"]}
+
+@instrument("kpi.distinct_counts_approx")
+def distinct_counts_approx(df: pd.DataFrame | None = None, p: int = 14, partial: dict | None = None) -> dict:
+    """Visite e clinici distinti stimati dagli HyperLogLog dello sketch."""
+    sketch = _approx_sketch(df, partial, p=p)
+    if sketch is None:
+        return {}
+    return {
+        col: {**hll_count(sketch[key]), "sketch": sketch[key]}
+        for col, key in [("visit_id", "visits"), ("clinician_id", "clinicians")]
+    }
+
+@instrument("kpi.kpi_overview_approx")
+def kpi_overview_approx(df: pd.DataFrame | None = None, p: int = 14, partial: dict | None = None) -> dict:
+    """
+    Schede di kpi_overview dallo sketch, ognuna come {"value", "error"}: le
+    medie per visita dividono somme esatte per le visite stimate con HyperLogLog.
+    """
+    sketch = _approx_sketch(df, partial, p=p)
+    if sketch is None:
+        return {}
+    visits = hll_count(sketch["visits"])
+    per_visit = lambda total: (total / visits["value"], float(total / visits["value"] * visits["relative_error"])) if visits["value"] else (0.0, 0.0)
+    minutes, after = per_visit(sketch["minutes"]), per_visit(sketch["after_hours_minutes"])
+    ai_share = ai_note_share_approx(partial=sketch, p=p)
+    edit_sum, edit_count = sketch["ai_edit"]
+    return {
+        "avg_minutes_per_visit": {"value": round(minutes[0], 1), "error": round(minutes[1], 1)},
+        "avg_after_hours_minutes_per_visit": {"value": round(after[0], 2), "error": round(after[1], 2)},
+        "ai_note_share_percent": {"value": round(ai_share["value"], 1), "error": round(float(ai_share["error"]), 1)},
+        "ai_correction_avg_minutes": {"value": round(edit_sum / edit_count, 2) if edit_count else 0.0, "error": 0.0},
+    }
+
+@instrument("kpi.kpi_overview")
 def kpi_overview(df: pd.DataFrame) -> dict:
     return {
         "avg_minutes_per_visit": round(avg_minutes_per_visit(df), 1),
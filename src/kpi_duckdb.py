@@ -0,0 +1,337 @@
+from __future__ import annotations
+import os
+
+import pandas as pd
+import numpy as np
+
+from src.afterhours import DEFAULT_CALENDAR, SECONDS_PER_DAY, _seconds
+from src.perf import instrument
+from src.partitioned import resolve_paths
+
+# Backend out-of-core per i KPI di src/kpi.py: le stesse definizioni come query
+# DuckDB direttamente sui file CSV/Parquet, con scansioni multi-thread e spill
+# su disco, senza caricare il log in un DataFrame. Le funzioni ricevono una
+# connessione creata da open_logs, che espone il log normalizzato come vista
+# "logs" (stesse regole di load_csv: minutes e minuti after-hours calcolati se
+# mancano). Gli arrotondamenti restano in Python, come nel backend pandas.
+# Richiede duckdb.
+
+def _quote(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+INTEGER_TYPES = {"TINYINT", "SMALLINT", "INTEGER", "BIGINT", "UTINYINT", "USMALLINT", "UINTEGER"}
+NUMERIC_TYPES = INTEGER_TYPES | {"UBIGINT", "HUGEINT", "FLOAT", "DOUBLE"}
+
+def _widen(types: set) -> str:
+    # tipo comune di una colonna rilevata con tipi diversi nei vari file
+    if len(types) == 1:
+        return next(iter(types))
+    if types <= INTEGER_TYPES:
+        return "BIGINT"
+    if types <= NUMERIC_TYPES:
+        return "DOUBLE"
+    if types <= {"DATE", "TIMESTAMP"}:
+        return "TIMESTAMP"
+    return "VARCHAR"
+
+def _sniff_csv(con, path: str) -> tuple[dict, dict]:
+    """
+    Formato (separatore, quote, formati data...) e tipi delle colonne di un
+    CSV, rilevati sull'intero file.
+    """
+    row = con.execute(
+        "SELECT Delimiter, Quote, Escape, NewLineDelimiter, Comment, SkipRows, HasHeader, Columns, DateFormat, TimestampFormat "
+        f"FROM sniff_csv({_quote(path)}, sample_size = -1)"
+    ).fetchone()
+    delim, quote, escape, new_line, comment, skip, header, columns, date_format, ts_format = row
+    empty = lambda value: "" if value in (None, "(empty)") else value
+    dialect = {
+        "delim": delim, "quote": empty(quote), "escape": empty(escape), "new_line": new_line,
+        "comment": empty(comment), "skip": int(skip), "header": bool(header),
+    }
+    if date_format:
+        dialect["dateformat"] = date_format
+    if ts_format:
+        dialect["timestampformat"] = ts_format
+    return dialect, {col["name"]: col["type"] for col in columns}
+
+def _read_expr(con, paths: list) -> str:
+    files = lambda group: "[" + ", ".join(_quote(p) for p in group) + "]"
+    if all(p.endswith(".parquet") for p in paths):
+        return f"read_parquet({files(paths)}, union_by_name = true)"
+    # ogni file è analizzato una volta sola qui: formato proprio e tipi allargati
+    # al tipo comune tra i file (es. interi e decimali -> DOUBLE, numeri e testo
+    # -> VARCHAR); le query successive leggono con formato e tipi fissati
+    sniffed = {p: _sniff_csv(con, p) for p in paths}
+    types: dict = {}
+    for _, columns in sniffed.values():
+        for name, dtype in columns.items():
+            types.setdefault(name, set()).add(dtype)
+    widened = {name: _widen(dtypes) for name, dtypes in types.items()}
+    # file con stesso formato e stesse colonne letti con un'unica read_csv
+    groups: dict = {}
+    for path, (dialect, columns) in sniffed.items():
+        groups.setdefault((tuple(sorted(dialect.items())), tuple(columns)), []).append(path)
+    reads = []
+    for (dialect, names), group in groups.items():
+        columns = "{" + ", ".join(f"{_quote(name)}: {_quote(widened[name])}" for name in names) + "}"
+        options = ", ".join(f"{key} = {_quote(value) if isinstance(value, str) else str(value).lower()}" for key, value in dialect)
+        reads.append(f"SELECT * FROM read_csv({files(group)}, auto_detect = false, {options}, columns = {columns})")
+    return "(" + " UNION ALL BY NAME ".join(reads) + ")"
+
+def _columns(con, relation: str) -> set:
+    return {row[0] for row in con.execute(f"DESCRIBE {relation}").fetchall()}
+
+def _register_calendar(con, calendar: dict) -> bool:
+    # tabelle per W(t) di src/afterhours.py: giorni lavorativi con il loro
+    # cumulato e fasce per reparto; False se il log non ha intervalli validi
+    first, last = con.execute(
+        f"SELECT min(start_s) // {SECONDS_PER_DAY}, max(end_s) // {SECONDS_PER_DAY} FROM raw_logs "
+        "WHERE start_s IS NOT NULL AND end_s IS NOT NULL"
+    ).fetchone()
+    if first is None:
+        return False
+    days = np.arange(first, last + 1)
+    holidays = [np.datetime64(pd.Timestamp(h).date(), "D").astype(np.int64) for h in calendar["holidays"]]
+    workday = ~np.isin((days + 3) % 7, list(calendar["weekend"])) & ~np.isin(days, holidays)
+    con.register("calendar_days", pd.DataFrame({
+        "day": days,
+        "workday": workday.astype(np.int64),
+        "workdays_before": np.cumsum(workday) - workday,
+    }))
+    shifts = {dept: (_seconds(a), _seconds(b)) for dept, (a, b) in calendar["department_shifts"].items()}
+    con.register("department_shifts", pd.DataFrame({
+        "department": list(shifts), "shift_start": [s for s, _ in shifts.values()], "shift_end": [e for _, e in shifts.values()],
+    }, dtype=object))
+    return True
+
+def _create_views(con, paths: list, calendar: dict) -> None:
+    con.execute(f"CREATE OR REPLACE VIEW source_logs AS SELECT * FROM {_read_expr(con, paths)}")
+    columns = _columns(con, "source_logs")
+    has_times = {"start_time", "end_time"} <= columns
+    times = (
+        "floor(epoch(TRY_CAST(start_time AS TIMESTAMP)))::BIGINT AS start_s, floor(epoch(TRY_CAST(end_time AS TIMESTAMP)))::BIGINT AS end_s"
+        if has_times else "NULL::BIGINT AS start_s, NULL::BIGINT AS end_s"
+    )
+    extra = [times]
+    if "minutes" not in columns and has_times:
+        extra.append("floor((epoch(TRY_CAST(end_time AS TIMESTAMP)) - epoch(TRY_CAST(start_time AS TIMESTAMP))) / 60) AS minutes")
+    con.execute(f"CREATE OR REPLACE VIEW raw_logs AS SELECT *, {', '.join(extra)} FROM source_logs")
+
+    select = ["raw_logs.*"]
+    joins = ""
+    if "after_hours_minutes" not in columns and has_times and _register_calendar(con, calendar):
+        # W(t) in SQL: minuti lavorativi cumulati, after-hours = durata - (W(end) - W(start))
+        default_start, default_end = _seconds(calendar["work_start"]), _seconds(calendar["work_end"])
+        if "department" in columns and calendar["department_shifts"]:
+            joins += " LEFT JOIN department_shifts sh ON raw_logs.department = sh.department"
+            shift_start = f"coalesce(CAST(sh.shift_start AS BIGINT), {default_start})"
+            shift_end = f"coalesce(CAST(sh.shift_end AS BIGINT), {default_end})"
+        else:
+            shift_start, shift_end = str(default_start), str(default_end)
+        shift_len = f"greatest({shift_end} - {shift_start}, 0)"
+        joins += (
+            f" LEFT JOIN calendar_days cs ON cs.day = raw_logs.start_s // {SECONDS_PER_DAY}"
+            f" LEFT JOIN calendar_days ce ON ce.day = raw_logs.end_s // {SECONDS_PER_DAY}"
+        )
+        worked = (
+            "({c}.workdays_before * {len} + {c}.workday * least(greatest(raw_logs.{t} - {c}.day * {spd} - {start}, 0), {len}))"
+        )
+        w_end = worked.format(c="ce", t="end_s", len=shift_len, spd=SECONDS_PER_DAY, start=shift_start)
+        w_start = worked.format(c="cs", t="start_s", len=shift_len, spd=SECONDS_PER_DAY, start=shift_start)
+        after = (
+            "CASE WHEN raw_logs.end_s >= raw_logs.start_s "
+            f"THEN (raw_logs.end_s - raw_logs.start_s - ({w_end} - {w_start})) / 60.0 END"
+        )
+        select.append(f"{after} AS after_hours_minutes")
+        # come normalize_logs: il flag segue i minuti calcolati, quello del file
+        # resta per le righe senza orari validi
+        if "is_after_hours" in columns:
+            select[0] = "raw_logs.* EXCLUDE (is_after_hours)"
+            select.append(f"coalesce({after} > 0, CAST(raw_logs.is_after_hours AS BOOLEAN), false) AS is_after_hours")
+        else:
+            select.append(f"coalesce({after} > 0, false) AS is_after_hours")
+    con.execute(f"CREATE OR REPLACE VIEW logs AS SELECT {', '.join(select)} FROM raw_logs{joins}")
+
+def open_logs(source, threads: int | None = None, memory_limit: str | None = None, calendar: dict | None = None):
+    """
+    Connessione DuckDB con la vista "logs" sui file di source (cartella, glob o
+    lista di percorsi CSV/Parquet). threads e memory_limit (es. "4GB") limitano
+    le risorse; oltre il limite DuckDB scrive su disco.
+    """
+    import duckdb
+
+    paths = resolve_paths(source)
+    con = duckdb.connect()
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    if memory_limit:
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+    _create_views(con, paths, {**DEFAULT_CALENDAR, **(calendar or {})})
+    return con
+
+def _has(con, *cols) -> bool:
+    return set(cols) <= _columns(con, "logs")
+
+def _scalar(con, query: str) -> float:
+    value = con.execute(query).fetchone()[0]
+    return 0.0 if value is None or pd.isna(value) else float(value)
+
+@instrument("kpi_duckdb.total_minutes_per_visit")
+def total_minutes_per_visit(con) -> pd.Series:
+    if not _has(con, "visit_id"):
+        return pd.Series(dtype=float)
+    df = con.execute(
+        "SELECT visit_id, sum(minutes) AS minutes FROM logs WHERE visit_id IS NOT NULL GROUP BY visit_id ORDER BY visit_id"
+    ).df()
+    return df.set_index("visit_id")["minutes"]
+
+@instrument("kpi_duckdb.avg_minutes_per_visit")
+def avg_minutes_per_visit(con) -> float:
+    if not _has(con, "visit_id"):
+        return 0.0
+    return _scalar(con, "SELECT avg(m) FROM (SELECT sum(minutes) AS m FROM logs WHERE visit_id IS NOT NULL GROUP BY visit_id)")
+
+@instrument("kpi_duckdb.share_time_by_activity")
+def share_time_by_activity(con) -> pd.DataFrame:
+    if not _has(con, "minutes", "activity"):
+        return pd.DataFrame(columns=["minutes", "percent"])
+    tot = _scalar(con, "SELECT sum(minutes) FROM logs")
+    if tot == 0:
+        return pd.DataFrame(columns=["minutes", "percent"])
+    by_act = con.execute(
+        "SELECT activity, sum(minutes) AS minutes FROM logs WHERE activity IS NOT NULL GROUP BY activity ORDER BY activity"
+    ).df().set_index("activity")["minutes"].sort_values(ascending=False)
+    return pd.DataFrame({"minutes": by_act, "percent": (by_act / tot * 100).round(1)})
+
+@instrument("kpi_duckdb.avg_after_hours_minutes_per_visit")
+def avg_after_hours_minutes_per_visit(con) -> float:
+    if not _has(con, "visit_id"):
+        return 0.0
+    if _has(con, "after_hours_minutes"):
+        after = "coalesce(after_hours_minutes, 0)"
+    elif _has(con, "is_after_hours", "minutes"):
+        after = "CASE WHEN CAST(is_after_hours AS BOOLEAN) THEN minutes ELSE 0 END"
+    else:
+        return 0.0
+    return _scalar(con, f"SELECT avg(a) FROM (SELECT sum({after}) AS a FROM logs WHERE visit_id IS NOT NULL GROUP BY visit_id)")
+
+@instrument("kpi_duckdb.ai_note_share")
+def ai_note_share(con) -> float:
+    if not _has(con, "visit_id", "is_ai_note"):
+        return 0.0
+    return _scalar(con, (
+        "SELECT avg(CAST(ai AS DOUBLE)) * 100 FROM "
+        "(SELECT bool_or(CAST(is_ai_note AS BOOLEAN)) AS ai FROM logs WHERE visit_id IS NOT NULL GROUP BY visit_id)"
+    ))
+
+@instrument("kpi_duckdb.ai_correction_avg_minutes")
+def ai_correction_avg_minutes(con) -> float:
+    if not _has(con, "activity", "is_ai_note", "ai_edit_minutes"):
+        return 0.0
+    return _scalar(con, (
+        "SELECT avg(ai_edit_minutes) FROM logs "
+        "WHERE activity = 'documentation' AND CAST(is_ai_note AS BOOLEAN)"
+    ))
+
+@instrument("kpi_duckdb.clinicians_workload")
+def clinicians_workload(con) -> pd.DataFrame:
+    if not _has(con, "clinician_id", "minutes"):
+        return pd.DataFrame(columns=["clinician_id", "total_minutes"])
+    return con.execute(
+        "SELECT clinician_id, sum(minutes) AS total_minutes FROM logs WHERE clinician_id IS NOT NULL "
+        "GROUP BY clinician_id ORDER BY total_minutes DESC, clinician_id"
+    ).df()
+
+@instrument("kpi_duckdb.clinician_overlaps")
+def clinician_overlaps(con) -> pd.DataFrame:
+    cols = ["clinician_id", "day", "overlap_minutes", "peak_concurrency"]
+    if not _has(con, "clinician_id", "start_time", "end_time"):
+        return pd.DataFrame(columns=cols)
+    # stessa sweep line di src/kpi.py con funzioni finestra: +1/-1 agli estremi,
+    # eventi neutri a ogni mezzanotte, fine prima degli inizi a parità di istante
+    per_day = con.execute(f"""
+        WITH intervals AS (
+            SELECT clinician_id AS clin, start_s, end_s FROM logs
+            WHERE clinician_id IS NOT NULL AND start_s IS NOT NULL AND end_s IS NOT NULL AND end_s > start_s
+        ),
+        events AS (
+            SELECT clin, start_s AS t, 1 AS delta FROM intervals
+            UNION ALL SELECT clin, end_s, -1 FROM intervals
+            UNION ALL SELECT clin, unnest(range(start_s // {SECONDS_PER_DAY} + 1, (end_s - 1) // {SECONDS_PER_DAY} + 1)) * {SECONDS_PER_DAY}, 0
+            FROM intervals WHERE (end_s - 1) // {SECONDS_PER_DAY} > start_s // {SECONDS_PER_DAY}
+        ),
+        swept AS (
+            SELECT clin, t, sum(delta) OVER w AS concurrency, lead(t) OVER w - t AS segment
+            FROM events
+            WINDOW w AS (PARTITION BY clin ORDER BY t, delta ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+        )
+        SELECT clin AS clinician_id, t // {SECONDS_PER_DAY} AS day,
+               sum(CASE WHEN concurrency >= 2 THEN coalesce(segment, 0) ELSE 0 END) AS overlap_seconds,
+               max(concurrency) AS peak_concurrency
+        FROM swept GROUP BY clin, day
+    """).df()
+    if per_day.empty:
+        return pd.DataFrame(columns=cols)
+    return pd.DataFrame({
+        "clinician_id": per_day["clinician_id"],
+        "day": pd.to_datetime(per_day["day"].to_numpy(dtype=np.int64), unit="D"),
+        "overlap_minutes": (per_day["overlap_seconds"].astype(float) / 60).round(1),
+        "peak_concurrency": per_day["peak_concurrency"].astype(np.int64),
+    }).sort_values(["overlap_minutes", "peak_concurrency", "clinician_id", "day"], ascending=[False, False, True, True], ignore_index=True)
+
+@instrument("kpi_duckdb.outlier_visits")
+def outlier_visits(con) -> pd.DataFrame:
+    if not _has(con, "visit_id"):
+        return pd.DataFrame(columns=["visit_id", "total_minutes"])
+    # quantile_cont interpola linearmente come Series.quantile
+    return con.execute("""
+        WITH tv AS (SELECT visit_id, sum(minutes) AS total_minutes FROM logs WHERE visit_id IS NOT NULL GROUP BY visit_id),
+        q AS (SELECT quantile_cont(total_minutes, 0.25) AS q1, quantile_cont(total_minutes, 0.75) AS q3 FROM tv)
+        SELECT visit_id, total_minutes FROM tv, q
+        WHERE total_minutes > q3 + 1.5 * (q3 - q1)
+        ORDER BY total_minutes DESC, visit_id
+    """).df()
+
+@instrument("kpi_duckdb.kpi_overview")
+def kpi_overview(con) -> dict:
+    return {
+        "avg_minutes_per_visit": round(avg_minutes_per_visit(con), 1),
+        "avg_after_hours_minutes_per_visit": round(avg_after_hours_minutes_per_visit(con), 2),
+        "ai_note_share_percent": round(ai_note_share(con), 1),
+        "ai_correction_avg_minutes": round(ai_correction_avg_minutes(con), 2),
+    }
+
+@instrument("kpi_duckdb.cell_aggregates")
+def cell_aggregates(con) -> dict:
+    """
+    Cubi reparto/clinico per gli snapshot (stesso formato di merge_cells in
+    src/snapshots.py), calcolati sulla connessione già aperta per i KPI.
+    """
+    missing = [col for col in ["visit_id", "department", "clinician_id", "activity", "minutes"] if not _has(con, col)]
+    if missing:
+        raise ValueError(f"Colonne mancanti per lo snapshot: {', '.join(missing)}")
+    has_ai = _has(con, "is_ai_note")
+    after = "coalesce(after_hours_minutes, 0)" if _has(con, "after_hours_minutes") else "0"
+    ai = "coalesce(CAST(is_ai_note AS BOOLEAN), false)" if has_ai else "false"
+    visits = con.execute(
+        f"SELECT department, clinician_id, visit_id, sum(minutes) AS minutes, sum({after}) AS after_hours_minutes, "
+        f"bool_or({ai}) AS is_ai_note FROM logs WHERE visit_id IS NOT NULL GROUP BY ALL ORDER BY ALL"
+    ).df()
+    activity = con.execute(
+        "SELECT department, clinician_id, activity, sum(minutes) AS minutes, count(*) AS rows FROM logs GROUP BY ALL ORDER BY ALL"
+    ).df()
+    edits = pd.DataFrame(columns=["department", "clinician_id", "ai_edit_sum", "ai_edit_count"])
+    if has_ai and _has(con, "ai_edit_minutes"):
+        edits = con.execute(
+            "SELECT department, clinician_id, sum(ai_edit_minutes) AS ai_edit_sum, count(ai_edit_minutes) AS ai_edit_count "
+            f"FROM logs WHERE activity = 'documentation' AND {ai} GROUP BY ALL ORDER BY ALL"
+        ).df()
+    return {"visits": visits, "activity": activity, "edits": edits, "has_ai": has_ai}
+
+def kpi_backend() -> str:
+    """Backend KPI scelto da configurazione (variabile KPI_BACKEND: pandas o duckdb)."""
+    backend = os.getenv("KPI_BACKEND", "pandas").lower()
+    if backend not in ("pandas", "duckdb"):
+        raise ValueError(f"KPI_BACKEND non valido: '{backend}' (valori ammessi: pandas, duckdb)")
+    return backend
@@ -1,6 +1,8 @@
 import spacy
 import streamlit as st
 
+from src.perf import instrument
+
 @st.cache_resource
 def load_model():
     """
@@ -13,6 +15,7 @@ def load_model():
         st.stop()
     return nlp
 
+@instrument("nlp.extract_entities")
 def extract_entities(text: str):
     """
     Extracts clinical entities from a text.
@@ -0,0 +1,173 @@
+from __future__ import annotations
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from src.perf import instrument
+from src.utils import load_log_file
+
+# Esecuzione partizionata dei KPI su log divisi in più file (es. un CSV per
+# reparto per giorno). Ogni worker legge una partizione e produce aggregati
+# parziali combinabili; il reducer li unisce e calcola gli stessi risultati di
+# kpi_overview, share_time_by_activity, clinicians_workload e outlier_visits
+# sul log concatenato.
+#
+# Una visita può comparire in più partizioni (es. attività dopo mezzanotte nel
+# file del giorno dopo): per questo i parziali per visita restano indicizzati
+# per visit_id e vengono ricombinati prima di calcolare medie e quartili.
+
+LOG_PATTERNS = ("*.csv", "*.csv.gz", "*.parquet")
+VISIT_AGG = {"minutes": "sum", "after_hours_minutes": "sum", "is_ai_note": "max"}
+
+def log_paths(source: str) -> list:
+    """
+    File di log di una cartella (CSV, anche compressi, o Parquet) o di un pattern glob, in ordine.
+    """
+    if os.path.isdir(source):
+        paths = [p for pattern in LOG_PATTERNS for p in glob.glob(os.path.join(source, "**", pattern), recursive=True)]
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(set(paths))
+
+def partial_aggregates(df: pd.DataFrame) -> dict:
+    """
+    Aggregati parziali di una partizione del log. Le parti non calcolabili per
+    colonne mancanti restano None.
+    """
+    partial = {
+        "rows": len(df), "minutes": None, "visits": None, "has_after": False, "has_ai": False,
+        "activity": None, "clinicians": None, "ai_edit": None,
+    }
+    if "minutes" not in df.columns:
+        return partial
+    partial["minutes"] = float(df["minutes"].sum())
+
+    if "visit_id" in df.columns:
+        # stessa regola di avg_after_hours_minutes_per_visit: minuti esatti o flag per riga
+        partial["has_after"] = "after_hours_minutes" in df.columns or "is_after_hours" in df.columns
+        partial["has_ai"] = "is_ai_note" in df.columns
+        if "after_hours_minutes" in df.columns:
+            after = df["after_hours_minutes"].fillna(0)
+        elif "is_after_hours" in df.columns:
+            after = df["minutes"].where(df["is_after_hours"].astype(bool), 0)
+        else:
+            after = 0
+        ai = df["is_ai_note"].astype(bool) if partial["has_ai"] else False
+        visits = pd.DataFrame({"minutes": df["minutes"], "after_hours_minutes": after, "is_ai_note": ai}, index=df.index)
+        partial["visits"] = visits.groupby(df["visit_id"].to_numpy()).agg(VISIT_AGG)
+
+    if "activity" in df.columns:
+        partial["activity"] = df.groupby("activity", observed=True)["minutes"].sum()
+    if "clinician_id" in df.columns:
+        partial["clinicians"] = df.groupby("clinician_id", observed=True)["minutes"].sum()
+    if {"activity", "is_ai_note", "ai_edit_minutes"} <= set(df.columns):
+        ai_docs = df.loc[(df["activity"] == "documentation") & df["is_ai_note"].astype(bool), "ai_edit_minutes"]
+        partial["ai_edit"] = (float(ai_docs.sum()), int(ai_docs.count()))
+    return partial
+
+def _merge_series(parts: list):
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return None
+    return pd.concat(parts).groupby(level=0).sum()
+
+def merge_partials(partials: list) -> dict:
+    """
+    Unisce gli aggregati parziali di più partizioni (operazione associativa:
+    il risultato può essere a sua volta unito ad altri parziali).
+    """
+    minutes = [p["minutes"] for p in partials if p["minutes"] is not None]
+    visits = [p["visits"] for p in partials if p["visits"] is not None]
+    ai_edit = [p["ai_edit"] for p in partials if p["ai_edit"] is not None]
+    merged_visits = None
+    if visits:
+        # le visite divise tra partizioni vengono ricomposte qui
+        merged_visits = pd.concat(visits).groupby(level=0).agg(VISIT_AGG)
+    return {
+        "rows": sum(p["rows"] for p in partials),
+        "minutes": sum(minutes) if minutes else None,
+        "visits": merged_visits,
+        "has_after": any(p["has_after"] for p in partials),
+        "has_ai": any(p["has_ai"] for p in partials),
+        "activity": _merge_series([p["activity"] for p in partials]),
+        "clinicians": _merge_series([p["clinicians"] for p in partials]),
+        "ai_edit": (sum(s for s, _ in ai_edit), sum(n for _, n in ai_edit)) if ai_edit else None,
+    }
+
+def finalize(partial: dict) -> dict:
+    """
+    KPI finali da un parziale unito, con lo stesso formato delle funzioni di src/kpi.py.
+    """
+    visits = partial["visits"]
+    overview = {
+        "avg_minutes_per_visit": 0.0,
+        "avg_after_hours_minutes_per_visit": 0.0,
+        "ai_note_share_percent": 0.0,
+        "ai_correction_avg_minutes": 0.0,
+    }
+    outliers = pd.DataFrame(columns=["visit_id", "total_minutes"])
+    if visits is not None and not visits.empty:
+        overview["avg_minutes_per_visit"] = round(float(visits["minutes"].mean()), 1)
+        if partial["has_after"]:
+            overview["avg_after_hours_minutes_per_visit"] = round(float(visits["after_hours_minutes"].mean()), 2)
+        if partial["has_ai"]:
+            overview["ai_note_share_percent"] = round(float(visits["is_ai_note"].mean() * 100), 1)
+        tv = visits["minutes"].rename_axis("visit_id").reset_index(name="total_minutes")
+        q1, q3 = tv["total_minutes"].quantile([0.25, 0.75])
+        cut = q3 + 1.5 * (q3 - q1)
+        outliers = tv[tv["total_minutes"] > cut].sort_values("total_minutes", ascending=False)
+    if partial["ai_edit"] is not None and partial["ai_edit"][1]:
+        overview["ai_correction_avg_minutes"] = round(partial["ai_edit"][0] / partial["ai_edit"][1], 2)
+
+    activity = pd.DataFrame(columns=["minutes", "percent"])
+    if partial["activity"] is not None and partial["minutes"]:
+        by_act = partial["activity"].sort_values(ascending=False)
+        activity = pd.DataFrame({"minutes": by_act, "percent": (by_act / partial["minutes"] * 100).round(1)})
+
+    workload = pd.DataFrame(columns=["clinician_id", "total_minutes"])
+    if partial["clinicians"] is not None:
+        workload = partial["clinicians"].sort_values(ascending=False).rename_axis("clinician_id").reset_index(name="total_minutes")
+
+    return {
+        "rows": partial["rows"],
+        "kpi_overview": overview,
+        "share_time_by_activity": activity,
+        "clinicians_workload": workload,
+        "outlier_visits": outliers,
+    }
+
+def partition_partial(path: str) -> dict:
+    """Legge una partizione e ne calcola gli aggregati parziali (eseguita nei worker)."""
+    return partial_aggregates(load_log_file(path))
+
+def resolve_paths(source) -> list:
+    """File di source (cartella, glob o lista di percorsi); errore se non ce ne sono."""
+    paths = log_paths(source) if isinstance(source, str) else sorted(source)
+    if not paths:
+        raise FileNotFoundError(f"Nessun file di log trovato in '{source}'")
+    return paths
+
+def map_partitions(fn, paths: list, workers: int | None = None) -> list:
+    """
+    Applica fn a ogni percorso con un pool di workers processi (default: tutti
+    i core); fn deve essere una funzione di modulo, serializzabile con pickle.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        return [fn(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fn, paths))
+
+@instrument("partitioned.compute_partitioned")
+def compute_partitioned(source, workers: int | None = None) -> dict:
+    """
+    KPI su tutti i file di source (cartella, glob o lista di percorsi) in
+    parallelo. Ogni worker legge e aggrega una partizione, quindi solo i
+    parziali attraversano i processi.
+    """
+    paths = resolve_paths(source)
+    result = finalize(merge_partials(map_partitions(partition_partial, paths, workers)))
+    result["files"] = len(paths)
+    return result
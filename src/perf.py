@@ -0,0 +1,140 @@
+from __future__ import annotations
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+MAX_RECORDS = 5000
+
+_records: deque = deque(maxlen=MAX_RECORDS)
+# totali per stage dall'avvio del processo, non limitati dalla finestra di _records
+_totals: dict = {}
+_lock = threading.Lock()
+_run_ids = itertools.count(1)
+# rerun e sessione correnti per thread: le sessioni Streamlit girano in thread diversi
+_current = threading.local()
+
+def rss_mb() -> float:
+    """
+    RSS corrente del processo in MB. Da /proc su Linux; altrove il picco di
+    getrusage (modulo resource, solo Unix) o 0 se non disponibile.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+def _rows(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    return None
+
+def start_run(session: str | None = None) -> int:
+    """
+    Apre un nuovo rerun nel thread corrente: le misure successive del thread
+    vengono raggruppate sotto questo id e sotto la sessione indicata.
+    """
+    with _lock:
+        run_id = next(_run_ids)
+    _current.run, _current.session = run_id, session
+    return run_id
+
+@contextmanager
+def stage(name: str, rows_in=None):
+    """
+    Misura durata, righe e variazione di RSS di un blocco di codice.
+    Il dizionario restituito permette di impostare rows_out dall'interno del blocco.
+    """
+    record = {
+        "run": getattr(_current, "run", None),
+        "session": getattr(_current, "session", None),
+        "stage": name, "rows_in": rows_in, "rows_out": None,
+    }
+    rss_start = rss_mb()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        record["mem_delta_mb"] = round(rss_mb() - rss_start, 3)
+        record["ts"] = time.time()
+        with _lock:
+            _records.append(record)
+            totals = _totals.setdefault(name, {"count": 0, "seconds": 0.0, "rows_in": 0, "rows_out": 0, "mem": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += record["duration_ms"] / 1000
+            totals["rows_in"] += rows_in or 0
+            totals["rows_out"] += record["rows_out"] or 0
+            totals["mem"] = record["mem_delta_mb"]
+
+def instrument(name: str):
+    """
+    Decoratore che registra ogni chiamata come stage: le righe in ingresso sono
+    quelle del primo argomento DataFrame, quelle in uscita del risultato.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            rows_in = next((_rows(a) for a in args if _rows(a) is not None), None)
+            with stage(name, rows_in=rows_in) as record:
+                result = fn(*args, **kwargs)
+                record["rows_out"] = _rows(result)
+            return result
+        return wrapper
+    return decorator
+
+def records(last_runs=None, session: str | None = None) -> list:
+    """
+    Misure registrate, eventualmente solo quelle di una sessione e dei suoi
+    ultimi last_runs rerun.
+    """
+    with _lock:
+        data = list(_records)
+    if session is not None:
+        data = [r for r in data if r["session"] == session]
+    if last_runs is None:
+        return data
+    runs = set(sorted({r["run"] for r in data if r["run"] is not None})[-last_runs:])
+    return [r for r in data if r["run"] in runs]
+
+def to_jsonl(last_runs=None, session: str | None = None) -> str:
+    """Misure in formato JSON lines, una per riga."""
+    return "".join(json.dumps(r) + "\n" for r in records(last_runs, session))
+
+def to_prometheus() -> str:
+    """
+    Misure per stage dall'avvio del processo nel formato testuale di Prometheus
+    (durata e righe come contatori cumulativi, ultima variazione di memoria come gauge).
+    """
+    with _lock:
+        stats = {name: dict(totals) for name, totals in _totals.items()}
+
+    metrics = [
+        ("stage_duration_seconds_sum", "counter", "Tempo totale speso nello stage", "seconds"),
+        ("stage_duration_seconds_count", "counter", "Numero di esecuzioni dello stage", "count"),
+        ("stage_rows_in_total", "counter", "Righe in ingresso allo stage", "rows_in"),
+        ("stage_rows_out_total", "counter", "Righe in uscita dallo stage", "rows_out"),
+        ("stage_last_mem_delta_megabytes", "gauge", "Variazione di RSS dell'ultima esecuzione", "mem"),
+    ]
+    lines = []
+    for metric, kind, help_text, key in metrics:
+        lines.append(f"# HELP clinical_dashboard_{metric} {help_text}")
+        lines.append(f"# TYPE clinical_dashboard_{metric} {kind}")
+        for name, s in sorted(stats.items()):
+            lines.append(f'clinical_dashboard_{metric}{{stage="{name}"}} {s[key]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,197 @@
+"""
+Pipeline batch senza interfaccia: ingest dei log -> normalizzazione -> KPI ->
+previsione della durata dei ricoveri, con i risultati scritti su disco.
+
+Uso:
+    python -m src.pipeline --logs logs/ --admissions simulated_ricoveri.jsonl --output report/
+    python -m src.pipeline --logs "logs/**/*.csv" --engine duckdb --workers 8 --format json
+    python -m src.pipeline --logs logs/ --admissions ricoveri.jsonl --snapshot-dir snapshots
+
+Ogni tabella viene scritta in Parquet (default) o JSON in --output, insieme a
+report.json con i KPI di sintesi, i file elaborati e i tempi per stage. A fine
+esecuzione i tempi vengono stampati; il codice d'uscita è 0 solo se tutti gli
+stage richiesti sono completati. Con --snapshot-dir i risultati vengono anche
+pubblicati come nuova versione di snapshot per la dashboard (src/snapshots.py).
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from src.kpi_duckdb import kpi_backend
+from src.perf import records, stage, start_run
+
+def write_table(df: pd.DataFrame, output_dir: str, name: str, fmt: str = "parquet") -> str:
+    """
+    Scrive una tabella del report (indice con nome incluso come colonna) e
+    restituisce il nome del file, relativo a output_dir.
+    """
+    if df.index.name is not None:
+        df = df.reset_index()
+    path = os.path.join(output_dir, f"{name}.{fmt}")
+    if fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_json(path, orient="records", date_format="iso", force_ascii=False)
+    return os.path.basename(path)
+
+def run_kpis(logs, engine: str = "pandas", workers: int | None = None, cells: bool = False) -> dict:
+    """
+    KPI sui log di una cartella/glob (o lista di file) con il motore indicato:
+    pandas (partizioni in processi paralleli) o duckdb (query out-of-core
+    multi-thread). Con cells=True il risultato contiene anche i cubi
+    reparto/clinico per build_snapshot, ricavati dalla stessa lettura dei file.
+    """
+    from src.partitioned import resolve_paths
+
+    paths = resolve_paths(logs)
+    if engine == "pandas":
+        if not cells:
+            from src.partitioned import compute_partitioned
+
+            return compute_partitioned(paths, workers=workers)
+        # i cubi contengono già tutto il necessario per i KPI: una sola lettura per file
+        from src.snapshots import kpis_from_cells, snapshot_cells
+
+        cubes = snapshot_cells(paths, workers)
+        return {**kpis_from_cells(cubes), "files": len(paths), "cells": cubes}
+
+    from src import kpi_duckdb
+
+    con = kpi_duckdb.open_logs(paths, threads=workers)
+    result = {
+        "rows": int(con.execute("SELECT count(*) FROM logs").fetchone()[0]),
+        "files": len(paths),
+        "kpi_overview": kpi_duckdb.kpi_overview(con),
+        "share_time_by_activity": kpi_duckdb.share_time_by_activity(con),
+        "clinicians_workload": kpi_duckdb.clinicians_workload(con),
+        "outlier_visits": kpi_duckdb.outlier_visits(con),
+        "clinician_overlaps": kpi_duckdb.clinician_overlaps(con),
+    }
+    if cells:
+        result["cells"] = kpi_duckdb.cell_aggregates(con)
+    return result
+
+def run_predictions(admissions: str, model_path: str, train: bool = False, search_budget: float | None = None) -> pd.DataFrame:
+    """
+    Durata prevista per ogni ricovero del file; con train=True il modello viene
+    addestrato sullo stesso file se non esiste ancora, con search_budget (secondi)
+    tramite la ricerca degli iperparametri.
+    """
+    from src.prediction import (
+        load_and_preprocess_data, predict_batch, search_and_save_best_model, train_evaluate_and_save_best_model,
+    )
+
+    df = load_and_preprocess_data(admissions)
+    if df.empty:
+        raise ValueError(f"Nessun ricovero utilizzabile in '{admissions}'")
+    if not os.path.exists(model_path):
+        if not train:
+            raise FileNotFoundError(f"Modello non trovato in '{model_path}' (usa --train per addestrarlo)")
+        if search_budget:
+            search_and_save_best_model(df, model_path=model_path, budget_seconds=search_budget)
+        else:
+            train_evaluate_and_save_best_model(df, model_path=model_path)
+    keep = [col for col in ["admission_id", "patient_id", "reparto", "diagnosi_principale", "giorni_ricovero"] if col in df.columns]
+    out = df[keep].reset_index(drop=True)
+    out["giorni_previsti"] = predict_batch(df, model_path=model_path)
+    return out
+
+def run_pipeline(output: str, logs: str | None = None, admissions: str | None = None, engine: str = "pandas",
+                 workers: int | None = None, fmt: str = "parquet", model_path: str = "modello_dimissione.joblib",
+                 train: bool = False, snapshot_dir: str | None = None, search_budget: float | None = None) -> dict:
+    """
+    Esegue gli stage richiesti e scrive tabelle e report.json in output.
+    Restituisce il report.
+    """
+    os.makedirs(output, exist_ok=True)
+    run_id = start_run()
+    started = time.perf_counter()
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "engine": engine, "workers": workers, "tables": {}}
+
+    if logs:
+        with stage("pipeline.kpi") as misura:
+            result = run_kpis(logs, engine, workers, cells=bool(snapshot_dir))
+            misura["rows_in"] = result["rows"]
+        cells = result.pop("cells", None)
+        report["logs"] = {"source": logs, "rows": result["rows"], "files": result.get("files")}
+        report["kpi_overview"] = result["kpi_overview"]
+        with stage("pipeline.write_kpi"):
+            for name, value in result.items():
+                if isinstance(value, pd.DataFrame):
+                    report["tables"][name] = write_table(value, output, name, fmt)
+
+    if admissions:
+        with stage("pipeline.prediction") as misura:
+            predictions = run_predictions(admissions, model_path, train, search_budget)
+            misura["rows_out"] = len(predictions)
+        report["predictions"] = {
+            "source": admissions,
+            "rows": len(predictions),
+            "mean_predicted_days": round(float(predictions["giorni_previsti"].mean()), 2),
+        }
+        with stage("pipeline.write_predictions"):
+            report["tables"]["predictions"] = write_table(predictions, output, "predictions", fmt)
+
+    if snapshot_dir and logs:
+        from src.snapshots import build_snapshot
+
+        with stage("pipeline.snapshot"):
+            manifest = build_snapshot(logs, snapshot_dir, workers, predictions=predictions if admissions else None, cells=cells)
+        report["snapshot"] = {"dir": snapshot_dir, "version": manifest["version"]}
+
+    report["stages"] = [
+        {key: r[key] for key in ["stage", "duration_ms", "rows_in", "rows_out", "mem_delta_mb"]}
+        for r in records() if r["run"] == run_id
+    ]
+    report["total_seconds"] = round(time.perf_counter() - started, 3)
+    with open(os.path.join(output, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logs", help="cartella o glob dei log burocrazia (CSV/Parquet)")
+    parser.add_argument("--admissions", help="file JSON/JSONL dei ricoveri da prevedere")
+    parser.add_argument("--output", default="report", help="cartella dei risultati")
+    parser.add_argument("--engine", choices=["pandas", "duckdb"], help="default: variabile KPI_BACKEND, altrimenti pandas")
+    parser.add_argument("--workers", type=int, default=None, help="processi (pandas) o thread (duckdb); default: tutti i core")
+    parser.add_argument("--format", choices=["parquet", "json"], default="parquet")
+    parser.add_argument("--model", default="modello_dimissione.joblib")
+    parser.add_argument("--train", action="store_true", help="addestra il modello se non esiste")
+    parser.add_argument("--search-budget", type=float, help="con --train: secondi per la ricerca degli iperparametri")
+    parser.add_argument("--snapshot-dir", help="pubblica i risultati come snapshot per la dashboard")
+    args = parser.parse_args()
+    if not args.logs and not args.admissions:
+        parser.error("indica almeno --logs o --admissions")
+    if args.snapshot_dir and not args.logs:
+        parser.error("--snapshot-dir richiede --logs")
+    if args.engine is None:
+        # il default da ambiente non passa dai choices di argparse: validato qui
+        try:
+            args.engine = kpi_backend()
+        except ValueError as exc:
+            parser.error(str(exc))
+
+    try:
+        report = run_pipeline(args.output, args.logs, args.admissions, args.engine, args.workers, args.format, args.model, args.train, args.snapshot_dir, args.search_budget)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"{'stage':<35} {'tempo':>10} {'righe':>12}")
+    for s in report["stages"]:
+        if not s["stage"].startswith("pipeline."):
+            continue
+        print(f"{s['stage']:<35} {s['duration_ms']:>8.0f}ms {s['rows_out'] or s['rows_in'] or '':>12}")
+    if "snapshot" in report:
+        print(f"Snapshot attivo: {report['snapshot']['version']}")
+    print(f"Totale {report['total_seconds']:.2f} s - risultati in '{args.output}'")
+
+if __name__ == "__main__":
+    main()
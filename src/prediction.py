@@ -1,12 +1,20 @@
 import pandas as pd
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import KFold, train_test_split
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
 import numpy as np
 import joblib
+from joblib import Parallel, delayed
+import hashlib
+import json
 import os
+import threading
+import time
+import warnings
+
+from src.perf import instrument
 
 
 # Importazione dei nuovi modelli da testare
@@ -15,6 +23,14 @@ from sklearn.linear_model import Ridge
 import xgboost as xgb
 import lightgbm as lgb
 
+# Colonne escluse dalle feature: non necessarie o causa di data leak
+FEATURES_TO_DROP = [
+    "admission_id", "patient_id", "patient_name", "group", "admission_date",
+    "discharge_date", "comorbidities", "severity", "from_emergency",
+    "ai_note", "giorni_ricovero", "data_ammissione", "data_dimissione"
+]
+
+@instrument("prediction.load_and_preprocess_data")
 def load_and_preprocess_data(json_path: str):
     """
     Carica i dati, esegue una pulizia robusta e crea nuove features 
@@ -24,7 +40,8 @@ def load_and_preprocess_data(json_path: str):
         print(f"Errore: Il file '{json_path}' non è stato trovato.")
         return pd.DataFrame()
         
-    df = pd.read_json(json_path)
+    # supporta sia l'array JSON sia il formato JSON Lines di genera_dati.py
+    df = pd.read_json(json_path, lines=json_path.endswith(".jsonl"))
 
     # --- INGEGNERIA DELLE CARATTERISTICHE (PULIZIA MIGLIORATA) ---
 
@@ -69,35 +86,35 @@ def load_and_preprocess_data(json_path: str):
     print("✅ Dati caricati e pre-elaborati con successo.")
     return df
 
+def build_preprocessor(X: pd.DataFrame) -> ColumnTransformer:
+    """
+    Preprocessore delle feature: numeriche invariate, categoriche in one-hot.
+    Le colonne vengono identificate automaticamente dal tipo.
+    """
+    numeric_features = X.select_dtypes(include=np.number).columns.tolist()
+    categorical_features = X.select_dtypes(exclude=np.number).columns.tolist()
+    return ColumnTransformer(
+        transformers=[
+            ("num", "passthrough", numeric_features),
+            ("cat", OneHotEncoder(handle_unknown="ignore", sparse_output=False), categorical_features),
+        ],
+        remainder='drop'
+    )
+
+@instrument("prediction.train_evaluate_and_save_best_model")
 def train_evaluate_and_save_best_model(df, model_path="modello_dimissione.joblib"):
     """
     Addestra più modelli, li valuta, stampa un confronto e salva il migliore.
     """
     # 1. Seleziona le caratteristiche (X) e la variabile target (y)
-    # Escludiamo le colonne non necessarie o che causerebbero data leak
-    features_to_drop = [
-        "admission_id", "patient_id", "patient_name", "group", "admission_date", 
-        "discharge_date", "comorbidities", "severity", "from_emergency", 
-        "ai_note", "giorni_ricovero", "data_ammissione", "data_dimissione"
-    ]
-    X = df.drop(columns=features_to_drop, errors='ignore')
+    X = df.drop(columns=FEATURES_TO_DROP, errors='ignore')
     y = df["giorni_ricovero"]
 
     # 2. Suddivide i dati in set di addestramento e di test
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
     # 3. Definisce il preprocessore
-    # Identifica automaticamente le colonne numeriche e categoriche
-    numeric_features = X.select_dtypes(include=np.number).columns.tolist()
-    categorical_features = X.select_dtypes(exclude=np.number).columns.tolist()
-
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ("num", "passthrough", numeric_features),
-            ("cat", OneHotEncoder(handle_unknown="ignore", sparse_output=False), categorical_features),
-        ],
-        remainder='drop'
-    )
+    preprocessor = build_preprocessor(X)
 
     # 4. Definisce i modelli da testare
     models = {
@@ -150,21 +167,266 @@ def train_evaluate_and_save_best_model(df, model_path="modello_dimissione.joblib
     else:
         print("⚠️ Nessun modello è stato addestrato con successo.")
 
+# --- Ricerca iperparametri a budget (successive halving) ---
+
+# Spazi di ricerca per modello. Per i modelli boosting il numero di alberi non è
+# cercato: lo decide l'early stopping su un fold di validazione.
+SEARCH_SPACES = {
+    "Random Forest": {
+        "n_estimators": [100, 200, 400],
+        "max_depth": [None, 8, 12, 20],
+        "min_samples_leaf": [1, 2, 5, 10],
+        "max_features": [1.0, 0.5, "sqrt"],
+    },
+    "XGBoost": {
+        "learning_rate": [0.03, 0.05, 0.1, 0.2],
+        "max_depth": [3, 4, 6, 8],
+        "subsample": [0.7, 0.85, 1.0],
+        "colsample_bytree": [0.6, 0.8, 1.0],
+        "min_child_weight": [1, 5, 10],
+        "reg_lambda": [0.5, 1.0, 5.0],
+    },
+    "LightGBM": {
+        "learning_rate": [0.03, 0.05, 0.1, 0.2],
+        "num_leaves": [15, 31, 63, 127],
+        "min_child_samples": [5, 20, 50],
+        "subsample": [0.7, 0.85, 1.0],
+        "subsample_freq": [1],
+        "colsample_bytree": [0.6, 0.8, 1.0],
+        "reg_lambda": [0.0, 1.0, 5.0],
+    },
+}
+BOOSTING_MODELS = ("XGBoost", "LightGBM")
+MAX_BOOSTING_ROUNDS = 2000
+EARLY_STOPPING_ROUNDS = 30
+VALIDATION_FRACTION = 0.15
+
+# feature preprocessate per hash dei dati: le prove della ricerca (e le ricerche
+# successive sugli stessi dati) non ripetono il one-hot encoding
+_FEATURE_CACHE: dict = {}
+FEATURE_CACHE_SIZE = 4
+
+def preprocess_features(X: pd.DataFrame):
+    """
+    Preprocessore addestrato su X e matrice delle feature, riusati se X è già
+    stato elaborato.
+    """
+    key = (tuple(X.columns), hashlib.blake2b(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes()).hexdigest())
+    if key not in _FEATURE_CACHE:
+        preprocessor = build_preprocessor(X)
+        matrix = np.asarray(preprocessor.fit_transform(X), dtype=np.float64)
+        if len(_FEATURE_CACHE) >= FEATURE_CACHE_SIZE:
+            _FEATURE_CACHE.pop(next(iter(_FEATURE_CACHE)))
+        _FEATURE_CACHE[key] = (preprocessor, matrix)
+    return _FEATURE_CACHE[key]
+
+def _make_regressor(name: str, params: dict, n_estimators: int | None = None):
+    # n_estimators=None: massimo di alberi con early stopping (solo boosting)
+    if name == "Random Forest":
+        return RandomForestRegressor(**params, random_state=42, n_jobs=1)
+    if name == "XGBoost":
+        return xgb.XGBRegressor(
+            **params, n_estimators=n_estimators or MAX_BOOSTING_ROUNDS, random_state=42, n_jobs=1, eval_metric="rmse",
+            early_stopping_rounds=None if n_estimators else EARLY_STOPPING_ROUNDS,
+        )
+    if name == "LightGBM":
+        return lgb.LGBMRegressor(**params, n_estimators=n_estimators or MAX_BOOSTING_ROUNDS, random_state=42, n_jobs=1, verbose=-1)
+    raise ValueError(f"Modello non supportato nella ricerca: {name}")
+
+def _fit_fold(name: str, params: dict, X: np.ndarray, y: np.ndarray, train_idx, test_idx, seed: int) -> dict:
+    # una prova su un fold di CV; per i boosting una parte del train fa da validazione
+    start = time.perf_counter()
+    model = _make_regressor(name, params)
+    X_train, y_train = X[train_idx], y[train_idx]
+    rounds = None
+    if name in BOOSTING_MODELS:
+        perm = np.random.default_rng(seed).permutation(len(train_idx))
+        n_val = max(1, int(len(perm) * VALIDATION_FRACTION))
+        val, fit = perm[:n_val], perm[n_val:]
+        eval_set = [(X_train[val], y_train[val])]
+        if name == "XGBoost":
+            model.fit(X_train[fit], y_train[fit], eval_set=eval_set, verbose=False)
+            rounds = int(model.best_iteration) + 1
+        else:
+            # eval_set è deprecato dalle versioni recenti di LightGBM ma è l'unica forma accettata da tutte
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", message=".*eval_set.*deprecated")
+                model.fit(X_train[fit], y_train[fit], eval_set=eval_set,
+                          callbacks=[lgb.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)])
+            rounds = int(model.best_iteration_ or MAX_BOOSTING_ROUNDS)
+    else:
+        model.fit(X_train, y_train)
+    y_pred = model.predict(X[test_idx])
+    return {
+        "r2": r2_score(y[test_idx], y_pred),
+        "mae": mean_absolute_error(y[test_idx], y_pred),
+        "rounds": rounds,
+        "fit_seconds": time.perf_counter() - start,
+    }
+
+def _sample_configs(space: dict, n: int, rng: np.random.Generator) -> list:
+    configs = []
+    for _ in range(n * 10):
+        config = {name: values[rng.integers(len(values))] for name, values in space.items()}
+        if config not in configs:
+            configs.append(config)
+        if len(configs) == n:
+            break
+    return configs
+
+@instrument("prediction.search_and_save_best_model")
+def search_and_save_best_model(df, model_path="modello_dimissione.joblib", budget_seconds: float = 300,
+                               n_configs: int = 9, eta: int = 3, cv: int = 3, n_jobs: int = -1,
+                               models=None, random_state: int = 42, trials_path: str | None = None) -> pd.DataFrame:
+    """
+    Ricerca degli iperparametri con successive halving su Random Forest,
+    XGBoost e LightGBM entro budget_seconds di tempo reale, poi salva il
+    migliore come pipeline (preprocessore + modello) in model_path.
+
+    Ogni modello parte con n_configs configurazioni casuali valutate in
+    cross-validation a cv fold su un sottoinsieme dei dati di training; a ogni
+    turno resta il miglior 1/eta (per R² medio) e i campioni crescono di eta
+    volte. I fold vengono eseguiti in parallelo (n_jobs come in joblib) e il
+    budget è controllato prima di ogni blocco di prove. Restituisce il log delle
+    prove (accuratezza e tempo trascorso), salvato anche in trials_path (CSV).
+    """
+    started = time.perf_counter()
+    over_budget = lambda: time.perf_counter() - started > budget_seconds
+    X = df.drop(columns=FEATURES_TO_DROP, errors='ignore')
+    y = df["giorni_ricovero"].to_numpy(dtype=np.float64)
+    # stesso hold-out di train_evaluate_and_save_best_model, escluso dalla ricerca
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    _, features = preprocess_features(X_train)
+
+    rng = np.random.default_rng(random_state)
+    models = models or list(SEARCH_SPACES)
+    candidates = [(name, config) for name in models for config in _sample_configs(SEARCH_SPACES[name], n_configs, rng)]
+    rungs = int(np.floor(np.log(max(n_configs, 1)) / np.log(eta))) + 1
+    order = rng.permutation(len(features))
+    min_samples = max(len(features) // eta ** (rungs - 1), cv * 20)
+    batch_size = max(1, joblib.effective_n_jobs(n_jobs))
+
+    trials, best = [], None
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for rung in range(rungs):
+            idx = order[:min(len(features), min_samples * eta ** rung)]
+            X_rung, y_rung = features[idx], y_train[idx]
+            folds = list(KFold(cv, shuffle=True, random_state=random_state).split(X_rung))
+            tasks = [(c, f) for c in range(len(candidates)) for f in range(cv)]
+            results: dict = {}
+            for start in range(0, len(tasks), batch_size):
+                if over_budget() and (trials or results):
+                    break
+                batch = tasks[start:start + batch_size]
+                outputs = parallel(
+                    delayed(_fit_fold)(*candidates[c], X_rung, y_rung, *folds[f], random_state + f) for c, f in batch
+                )
+                for (c, _), output in zip(batch, outputs):
+                    results.setdefault(c, []).append(output)
+
+            # solo le configurazioni con tutti i fold completati entrano nel confronto
+            scored = []
+            for c, folds_out in results.items():
+                if len(folds_out) < cv:
+                    continue
+                name, config = candidates[c]
+                rounds = [f["rounds"] for f in folds_out if f["rounds"] is not None]
+                trial = {
+                    "model": name,
+                    "params": json.dumps(config),
+                    "rung": rung,
+                    "samples": len(idx),
+                    "cv_r2": float(np.mean([f["r2"] for f in folds_out])),
+                    "cv_mae": float(np.mean([f["mae"] for f in folds_out])),
+                    "rounds": int(np.median(rounds)) if rounds else None,
+                    "fit_seconds": round(sum(f["fit_seconds"] for f in folds_out), 3),
+                    "elapsed_seconds": round(time.perf_counter() - started, 3),
+                }
+                trials.append(trial)
+                scored.append((trial["cv_r2"], c, trial))
+            if not scored:
+                break
+            scored.sort(key=lambda item: item[0], reverse=True)
+            best = scored[0][2]
+            candidates = [candidates[c] for _, c, _ in scored[:max(1, len(scored) // eta)]]
+            if over_budget() or len(candidates) == 1 and rung > 0:
+                break
+
+    trials = pd.DataFrame(trials)
+    if best is None:
+        raise RuntimeError("Budget esaurito prima di completare una configurazione")
+
+    # modello finale: migliore configurazione ri-addestrata su tutto il training,
+    # con il numero di alberi trovato dall'early stopping
+    regressor = _make_regressor(best["model"], json.loads(best["params"]), best["rounds"])
+    pipeline = Pipeline(steps=[("preprocessor", build_preprocessor(X_train)), ("regressor", regressor)])
+    pipeline.fit(X_train, y_train)
+    y_pred = pipeline.predict(X_test)
+    final = {
+        **best, "rung": "final", "samples": len(X_train),
+        "test_r2": r2_score(y_test, y_pred), "test_mae": mean_absolute_error(y_test, y_pred),
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+    }
+    trials = pd.concat([trials, pd.DataFrame([final])], ignore_index=True)
+    joblib.dump(pipeline, model_path)
+    if trials_path:
+        trials.to_csv(trials_path, index=False)
+
+    print("\n--- Ricerca iperparametri (successive halving) ---")
+    print(trials[["model", "rung", "samples", "cv_r2", "cv_mae", "elapsed_seconds"]].tail(10).to_string(index=False))
+    print(f"🏆 {best['model']} {best['params']}: R² test {final['test_r2']:.3f}, MAE {final['test_mae']:.2f} "
+          f"in {final['elapsed_seconds']:.1f} s, salvato in '{model_path}'")
+    return trials
+
+# un solo modello caricato per processo e file, condiviso tra sessioni e
+# chiamate; un file riaddestrato (mtime o dimensione diversi) viene ricaricato
+_MODEL_CACHE: dict = {}
+_MODEL_LOCK = threading.Lock()
+
+def load_shared_model(model_path="modello_dimissione.joblib"):
+    """
+    Modello salvato in model_path, letto da disco solo al primo uso o se il file
+    è cambiato. L'istanza è condivisa: va usata solo per predict.
+    """
+    path = os.path.abspath(model_path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _MODEL_LOCK:
+        cached = _MODEL_CACHE.get(path)
+        if cached is None or cached[0] != version:
+            cached = _MODEL_CACHE[path] = (version, joblib.load(path))
+    return cached[1]
+
+@instrument("prediction.load_model_and_predict")
 def load_model_and_predict(input_data: pd.DataFrame, model_path="modello_dimissione.joblib"):
     """
-    Carica il modello addestrato e restituisce la previsione.
+    Restituisce la previsione con il modello addestrato (condiviso, vedi load_shared_model).
     """
     if not os.path.exists(model_path):
         print(f"Errore: Modello non trovato in '{model_path}'")
         return None
     try:
-        model = joblib.load(model_path)
+        model = load_shared_model(model_path)
         prediction = model.predict(input_data)
         return prediction[0]
     except Exception as e:
         print(f"Errore durante la previsione: {e}")
         return None
 
+@instrument("prediction.predict_batch")
+def predict_batch(features: pd.DataFrame, model_path="modello_dimissione.joblib", chunk_rows: int = 100_000) -> np.ndarray:
+    """
+    Previsioni per tutte le righe di features, a blocchi di chunk_rows per
+    limitare la memoria del preprocessore (one-hot) su input grandi.
+    """
+    model = load_shared_model(model_path)
+    features = features.drop(columns=FEATURES_TO_DROP, errors="ignore")
+    if features.empty:
+        return np.array([])
+    return np.concatenate([
+        model.predict(features.iloc[start:start + chunk_rows]) for start in range(0, len(features), chunk_rows)
+    ])
+
 
 # --- BLOCCO DI ESECUZIONE DIRETTA ---
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+from __future__ import annotations
+import re
+
+import pandas as pd
+import numpy as np
+
+# Schema canonico del log burocrazia e allineamento delle tabelle estratte dai
+# PDF: le intestazioni vengono ricondotte ai nomi canonici, i valori convertiti
+# ai tipi attesi con operazioni vettoriali e le righe non interpretabili
+# segnalate invece di restare come stringhe.
+
+LOG_SCHEMA = {
+    "visit_id": "string",
+    "clinician_id": "string",
+    "department": "string",
+    "activity": "string",
+    "start_time": "datetime",
+    "end_time": "datetime",
+    "minutes": "number",
+    "is_after_hours": "bool",
+    "is_ai_note": "bool",
+    "ai_edit_minutes": "number",
+    "after_hours_minutes": "number",
+}
+
+# varianti di intestazione già normalizzate (minuscolo, separatori "_") -> colonna canonica
+HEADER_ALIASES = {
+    "visit": "visit_id", "visita": "visit_id", "id_visita": "visit_id", "visit_no": "visit_id", "encounter_id": "visit_id",
+    "clinician": "clinician_id", "clinico": "clinician_id", "medico": "clinician_id", "id_medico": "clinician_id",
+    "provider_id": "clinician_id", "doctor_id": "clinician_id",
+    "dept": "department", "reparto": "department", "unit": "department",
+    "attivita": "activity", "activity_type": "activity", "tipo_attivita": "activity",
+    "start": "start_time", "inizio": "start_time", "ora_inizio": "start_time", "start_datetime": "start_time",
+    "end": "end_time", "fine": "end_time", "ora_fine": "end_time", "end_datetime": "end_time",
+    "min": "minutes", "minuti": "minutes", "durata": "minutes", "duration": "minutes", "duration_min": "minutes",
+    "after_hours": "is_after_hours", "fuori_orario": "is_after_hours", "extra_orario": "is_after_hours",
+    "ai_note": "is_ai_note", "nota_ai": "is_ai_note", "ai": "is_ai_note",
+    "ai_edit": "ai_edit_minutes", "minuti_correzione_ai": "ai_edit_minutes", "correzione_ai": "ai_edit_minutes",
+    "minuti_after_hours": "after_hours_minutes", "minuti_fuori_orario": "after_hours_minutes",
+}
+
+HEADER_NAMES = {col: {col} | {alias for alias, target in HEADER_ALIASES.items() if target == col} for col in LOG_SCHEMA}
+
+TRUE_VALUES = ["true", "1", "yes", "y", "si", "sì", "vero", "x"]
+FALSE_VALUES = ["false", "0", "no", "n", "falso", ""]
+NULL_VALUES = ["", "nan", "none", "null", "-", "n/a", "nat"]
+DATETIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M",
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d-%m-%Y %H:%M",
+]
+ERROR_COLUMNS = ["row", "page", "column", "value", "reason"]
+
+def dewrap(text: str) -> str:
+    """
+    Ricompone il testo di una cella andato a capo. PyMuPDF estrae i trattini
+    bassi su una riga a parte ("chart review\\n_"): quelle righe indicano quali
+    spazi della prima riga erano "_". Le altre righe vengono unite con uno spazio.
+    """
+    lines = [line.strip() for line in str(text).split("\n")]
+    head, rest = lines[0], [line for line in lines[1:] if line]
+    if rest and all(re.fullmatch(r"[_ ]+", line) for line in rest):
+        for _ in range(sum(line.count("_") for line in rest)):
+            head = head.replace(" ", "_", 1)
+        return head
+    return " ".join([head] + rest)
+
+def header_key(name) -> str:
+    """Nome di colonna normalizzato: testo ricomposto, minuscolo, separatori "_"."""
+    key = re.sub(r"[^0-9a-zà-ù]+", "_", dewrap(name).lower()).strip("_")
+    return key.replace("à", "a").replace("ì", "i").replace("ù", "u")
+
+def canonical_columns(columns) -> dict:
+    """Mappa colonna originale -> canonica per le intestazioni riconosciute."""
+    mapping = {}
+    for col in columns:
+        key = header_key(col)
+        canonical = key if key in LOG_SCHEMA else HEADER_ALIASES.get(key)
+        if canonical and canonical not in mapping.values():
+            mapping[col] = canonical
+    return mapping
+
+def align_tables(tables: list) -> tuple[pd.DataFrame, list]:
+    """
+    Allinea le tabelle (DataFrame, pagina) allo schema canonico e le concatena.
+    Una tabella senza intestazioni riconosciute ma con lo stesso numero di
+    colonne della precedente è trattata come continuazione (la sua "intestazione"
+    è una riga di dati). Restituisce il log (stringhe, con la colonna _page) e
+    le colonne ignorate.
+    """
+    aligned, ignored, previous = [], set(), None
+    for table, page in tables:
+        mapping = canonical_columns(table.columns)
+        if not mapping and previous is not None and len(table.columns) == len(previous):
+            first = pd.DataFrame([list(table.columns)], columns=range(len(table.columns)))
+            table = pd.concat([first, table.set_axis(range(len(table.columns)), axis=1)], ignore_index=True)
+            mapping = {i: col for i, col in enumerate(previous) if col is not None}
+        elif mapping:
+            previous = [mapping.get(col) for col in table.columns]
+        ignored.update(str(col) for col in table.columns if col not in mapping)
+        if not mapping:
+            continue
+        part = table[list(mapping)].rename(columns=mapping)
+        # intestazioni ripetute dentro la tabella (es. a ogni pagina)
+        header_rows = np.ones(len(part), dtype=bool)
+        for col in part.columns:
+            keys = part[col].astype(str).str.lower().str.replace(r"[^0-9a-z]+", "_", regex=True).str.strip("_")
+            header_rows &= keys.isin(HEADER_NAMES[col]).to_numpy()
+        part = part[~header_rows].assign(_page=page)
+        aligned.append(part)
+    if not aligned:
+        return pd.DataFrame(), sorted(ignored)
+    columns = [col for col in LOG_SCHEMA if any(col in part.columns for part in aligned)] + ["_page"]
+    return pd.concat(aligned, ignore_index=True).reindex(columns=columns), sorted(ignored)
+
+def _detect_format(values: pd.Series) -> str | None:
+    # formato unico scelto su un campione: quello che interpreta più valori
+    sample = values.dropna().head(200)
+    if sample.empty:
+        return None
+    scores = {fmt: pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum() for fmt in DATETIME_FORMATS}
+    best = max(scores, key=scores.get)
+    return best if scores[best] else None
+
+def coerce_types(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Converte le colonne canoniche ai tipi di LOG_SCHEMA. Restituisce il log con
+    le sole righe valide e le celle non interpretabili (riga, pagina, colonna,
+    valore, motivo); una riga con almeno un errore viene esclusa dal log.
+    """
+    out = pd.DataFrame(index=df.index)
+    errors = []
+    for col in df.columns:
+        kind = LOG_SCHEMA.get(col)
+        if kind is None:
+            out[col] = df[col]
+            continue
+        raw = df[col].astype(object).where(df[col].notna(), "").astype(str).str.strip()
+        wrapped = raw.str.contains("\n", regex=False)
+        if wrapped.any():
+            raw[wrapped] = raw[wrapped].map(dewrap)
+        lower = raw.str.lower()
+        missing = lower.isin(NULL_VALUES)
+        if kind == "string":
+            out[col] = raw.where(~missing, np.nan)
+            failed = pd.Series(False, index=df.index)
+        elif kind == "number":
+            # separatore decimale italiano ammesso
+            values = pd.to_numeric(raw.where(~missing, np.nan).str.replace(",", ".", regex=False), errors="coerce")
+            out[col] = values
+            failed = values.isna() & ~missing
+            reason = "numero non valido"
+        elif kind == "bool":
+            is_true, is_false = lower.isin(TRUE_VALUES), lower.isin(FALSE_VALUES)
+            out[col] = is_true
+            failed = ~(is_true | is_false | missing)
+            reason = "booleano non valido"
+        else:
+            fmt = _detect_format(raw.where(~missing, np.nan))
+            values = pd.to_datetime(raw.where(~missing, np.nan), format=fmt, errors="coerce") if fmt else pd.Series(pd.NaT, index=df.index)
+            out[col] = values
+            failed = values.isna() & ~missing
+            reason = f"data non conforme al formato {fmt}" if fmt else "data non riconosciuta"
+        failed = failed.to_numpy(dtype=bool)
+        if failed.any():
+            errors.append(pd.DataFrame({
+                "row": df.index[failed],
+                "page": df["_page"].to_numpy()[failed] if "_page" in df.columns else None,
+                "column": col,
+                "value": raw.to_numpy()[failed],
+                "reason": reason,
+            }))
+    errors = pd.concat(errors, ignore_index=True).sort_values(["row", "column"], ignore_index=True) if errors else pd.DataFrame(columns=ERROR_COLUMNS)
+    valid = ~out.index.isin(errors["row"])
+    return out[valid].drop(columns="_page", errors="ignore").reset_index(drop=True), errors
@@ -0,0 +1,106 @@
+from __future__ import annotations
+import hashlib
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from src.index import build_log_index
+from src.perf import instrument
+
+# Dati condivisi in sola lettura tra le sessioni. Ogni dataset viene scritto una
+# volta in Arrow IPC non compresso e riletto memory-mapped. Puntano direttamente
+# alle pagine del file solo le colonne numeriche e datetime senza valori nulli
+# e, con pandas >= 3 (stringhe ArrowStringArray), le colonne di testo; i booleani
+# (bitmap in Arrow), le colonne intere con nulli e, con pandas 2, le stringhe
+# (object) vengono invece copiati una volta alla lettura. Le copie restano
+# comunque una per file e non una per sessione, e con Copy-on-Write una sessione
+# non può modificare i dati delle altre. Processi diversi che mappano lo stesso
+# file condividono anche la page cache del sistema operativo.
+# Il default è nella cartella temporanea comune: la cartella viene creata
+# accessibile al solo utente del processo e i file in sola lettura/scrittura
+# per lui, perché i log contengono dati dei clinici.
+
+SHARED_DIR = os.getenv("SHARED_DATA_DIR", os.path.join(tempfile.gettempdir(), "clinical_dashboard_shared"))
+KEEP_FILES = 16
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Hash del contenuto (colonne e valori): dataset uguali condividono lo stesso file."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(list(df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def map_frame(path: str) -> pd.DataFrame:
+    """
+    DataFrame memory-mapped da un file Arrow IPC (copiate solo le colonne che
+    pandas non può rappresentare sopra i buffer Arrow, vedi sopra).
+    """
+    with pa.memory_map(path, "r") as source:
+        table = ipc.open_file(source).read_all()
+    # split_blocks evita il consolidamento in blocchi 2D, che copierebbe le colonne
+    return table.to_pandas(split_blocks=True)
+
+def prune_shared(directory: str = SHARED_DIR, keep: int = KEEP_FILES) -> None:
+    """
+    Elimina i file condivisi meno recenti oltre i keep più nuovi. Su Linux un
+    file rimosso resta valido per chi lo ha già mappato; dove il sistema non lo
+    consente (file in uso) viene lasciato al prossimo giro.
+    """
+    files = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith(".arrow")),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in files[keep:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def _private_dir(directory: str) -> None:
+    # cartella dell'utente corrente e non accessibile ad altri: in una cartella
+    # temporanea condivisa un altro utente potrebbe averla creata prima
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} appartiene a un altro utente: imposta SHARED_DATA_DIR")
+    if info.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+@instrument("shared.share_frame")
+def share_frame(df: pd.DataFrame, directory: str = SHARED_DIR) -> pd.DataFrame:
+    """
+    Versione memory-mapped di df. Il file è scritto solo se il contenuto non è
+    già presente (scrittura atomica con os.replace).
+    """
+    _private_dir(directory)
+    path = os.path.join(directory, f"{frame_digest(df)}.arrow")
+    if not os.path.exists(path):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        # creato già con permessi 0o600, indipendentemente dalla umask
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp, path)
+        prune_shared(directory)
+    os.utime(path)
+    return map_frame(path)
+
+def shared_log_index(df: pd.DataFrame, directory: str = SHARED_DIR) -> tuple[pd.DataFrame, dict]:
+    """
+    Log ordinato e indicizzato da build_log_index, con il log memory-mapped.
+    Gli offset dell'indice restano validi: il file conserva l'ordine delle righe.
+    """
+    df_sorted, offsets = build_log_index(df)
+    if df_sorted.empty:
+        return df_sorted, offsets
+    try:
+        return share_frame(df_sorted, directory), offsets
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OSError):
+        # colonne non rappresentabili in Arrow (tipi misti) o cartella condivisa
+        # non utilizzabile (permessi, spazio): resta condiviso in memoria
+        return df_sorted, offsets
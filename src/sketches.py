@@ -0,0 +1,152 @@
+from __future__ import annotations
+import pandas as pd
+import numpy as np
+
+# Sketch combinabili per KPI approssimati su log molto grandi. Ogni sketch è un
+# dizionario di array numpy: si costruisce per partizione, si unisce con la
+# funzione *_merge corrispondente e si interroga alla fine, riportando sempre
+# un limite d'errore insieme alla stima.
+
+# --- HyperLogLog: conteggio di valori distinti ---
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    # bit_length esatto per uint64: le due metà da 32 bit sono rappresentabili in float64
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(hi > 0, 32 + np.frexp(hi)[1], np.frexp(lo)[1])
+
+def hll_sketch(values, p: int = 14) -> dict:
+    """
+    Sketch HyperLogLog con 2**p registri (errore standard relativo 1.04 / sqrt(2**p)).
+    """
+    registers = np.zeros(1 << p, dtype=np.uint8)
+    values = pd.Series(values).dropna()
+    if values.empty:
+        return {"p": p, "registers": registers}
+    hashes = pd.util.hash_array(values.to_numpy()).astype(np.uint64)
+    index = (hashes >> np.uint64(64 - p)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - p)) - 1)
+    rank = (64 - p) - _bit_length(rest) + 1
+    np.maximum.at(registers, index, rank.astype(np.uint8))
+    return {"p": p, "registers": registers}
+
+def hll_merge(*sketches: dict) -> dict:
+    """Unione di sketch HyperLogLog con lo stesso p."""
+    if len({s["p"] for s in sketches}) != 1:
+        raise ValueError("Gli sketch HyperLogLog devono avere lo stesso p")
+    return {"p": sketches[0]["p"], "registers": np.maximum.reduce([s["registers"] for s in sketches])}
+
+def hll_count(sketch: dict) -> dict:
+    """
+    Stima dei valori distinti con errore standard relativo; per cardinalità
+    piccole usa il linear counting.
+    """
+    registers = sketch["registers"]
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return {"value": float(estimate), "relative_error": 1.04 / np.sqrt(m)}
+
+# --- t-digest: quantili ---
+
+def _compress(means: np.ndarray, weights: np.ndarray, delta: float):
+    # cluster contigui in ordine di valore, con dimensione limitata dalla scala
+    # k1 = delta / (2 pi) * asin(2q - 1): cluster piccoli sulle code, grandi al centro
+    order = np.argsort(means, kind="stable")
+    means, weights = means[order], weights[order]
+    total = weights.sum()
+    q = (np.cumsum(weights) - weights / 2) / total
+    k = delta / (2 * np.pi) * np.arcsin(2 * q - 1)
+    cluster = np.floor(k - k[0]).astype(np.int64)
+    cluster = np.unique(cluster, return_inverse=True)[1]
+    new_weights = np.bincount(cluster, weights=weights)
+    new_means = np.bincount(cluster, weights=means * weights) / new_weights
+    return new_means, new_weights
+
+def digest_sketch(values, delta: float = 200) -> dict:
+    """
+    t-digest dei valori (circa delta centroidi, più fitti sulle code).
+    """
+    values = pd.Series(values, dtype=float).dropna().to_numpy()
+    if len(values) == 0:
+        return {"delta": delta, "means": values, "weights": values, "min": np.nan, "max": np.nan}
+    means, weights = _compress(values, np.ones(len(values)), delta)
+    return {"delta": delta, "means": means, "weights": weights, "min": values.min(), "max": values.max()}
+
+def digest_merge(*digests: dict) -> dict:
+    """Unione di t-digest: i centroidi vengono concatenati e ricompressi."""
+    digests = [d for d in digests if len(d["means"])]
+    delta = max(d["delta"] for d in digests) if digests else 200
+    if not digests:
+        return {"delta": delta, "means": np.array([]), "weights": np.array([]), "min": np.nan, "max": np.nan}
+    means, weights = _compress(
+        np.concatenate([d["means"] for d in digests]), np.concatenate([d["weights"] for d in digests]), delta
+    )
+    return {
+        "delta": delta, "means": means, "weights": weights,
+        "min": min(d["min"] for d in digests), "max": max(d["max"] for d in digests),
+    }
+
+def digest_quantile(digest: dict, q: float) -> dict:
+    """
+    Quantile q per interpolazione tra i centroidi. rank_error è metà del peso
+    del centroide che contiene q, come frazione del totale: l'incertezza sul
+    rango dovuta al raggruppamento.
+    """
+    means, weights = digest["means"], digest["weights"]
+    if len(means) == 0:
+        return {"value": np.nan, "rank_error": np.nan}
+    total = weights.sum()
+    centers = (np.cumsum(weights) - weights / 2) / total
+    value = float(np.interp(q, np.concatenate(([0], centers, [1])), np.concatenate(([digest["min"]], means, [digest["max"]]))))
+    containing = min(np.searchsorted(np.cumsum(weights) / total, q), len(weights) - 1)
+    return {"value": value, "rank_error": float(weights[containing] / total / 2)}
+
+def digest_cdf(digest: dict, value: float) -> float:
+    """Frazione stimata dei valori <= value (inversa di digest_quantile)."""
+    means, weights = digest["means"], digest["weights"]
+    if len(means) == 0:
+        return np.nan
+    centers = (np.cumsum(weights) - weights / 2) / weights.sum()
+    return float(np.interp(value, np.concatenate(([digest["min"]], means, [digest["max"]])), np.concatenate(([0], centers, [1]))))
+
+# --- Campione per anteprime: bottom-k su chiavi casuali ---
+
+def bottom_k(df: pd.DataFrame, keys: np.ndarray, k: int = 1000) -> dict:
+    """
+    Le k righe con chiave minore (es. chiave = -valore per le k maggiori): due
+    sketch si uniscono con reservoir_merge tenendo le k chiavi minori dell'unione.
+    """
+    keys = np.asarray(keys, dtype=np.float64)
+    keep = np.argpartition(keys, k)[:k] if len(df) > k else np.arange(len(df))
+    return {"k": k, "keys": keys[keep], "rows": df.iloc[keep], "population": len(df)}
+
+def reservoir_sample(df: pd.DataFrame, k: int = 1000, seed: int | None = None) -> dict:
+    """
+    Campione uniforme senza reinserimento di k righe: bottom-k su una chiave
+    casuale per riga.
+    """
+    return bottom_k(df, np.random.default_rng(seed).random(len(df)), k)
+
+def reservoir_merge(*samples: dict) -> dict:
+    """Unione di campioni bottom-k (le chiavi devono venire da generatori indipendenti)."""
+    k = min(s["k"] for s in samples)
+    keys = np.concatenate([s["keys"] for s in samples])
+    rows = pd.concat([s["rows"] for s in samples])
+    keep = np.argsort(keys, kind="stable")[:k]
+    return {"k": k, "keys": keys[keep], "rows": rows.iloc[keep], "population": sum(s["population"] for s in samples)}
+
+def sample_mean(sample: dict, column: str) -> dict:
+    """
+    Media di una colonna stimata dal campione, con errore standard
+    (correzione per popolazione finita inclusa).
+    """
+    values = sample["rows"][column].astype(float)
+    n, population = len(values), sample["population"]
+    if n < 2:
+        return {"value": float(values.mean()) if n else np.nan, "standard_error": np.nan}
+    fpc = np.sqrt((population - n) / (population - 1)) if population > 1 else 0.0
+    return {"value": float(values.mean()), "standard_error": float(values.std(ddof=1) / np.sqrt(n) * fpc)}
@@ -0,0 +1,277 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+from src.partitioned import VISIT_AGG, finalize, map_partitions, resolve_paths
+from src.perf import instrument
+from src.utils import load_log_file
+
+# Snapshot versionati dei risultati precalcolati, letti dalla dashboard invece
+# di ricalcolare i KPI a ogni rerun. Struttura su disco:
+#
+#   <snapshot_dir>/CURRENT                 nome della versione attiva
+#   <snapshot_dir>/<versione>/manifest.json
+#   <snapshot_dir>/<versione>/*.parquet    KPI completi, cubi e previsioni
+#
+# La versione è "<timestamp>-<hash dei dati>", con un suffisso casuale se esiste
+# già. Una nuova versione viene scritta in una cartella temporanea, rinominata e
+# poi attivata sostituendo CURRENT con os.replace: le sessioni aperte vedono la
+# vecchia o la nuova versione, mai una a metà, e passano alla nuova al rerun
+# successivo.
+#
+# I cubi sono a grana (reparto, clinico): visite (con i minuti della visita in
+# quella cella), minuti per attività e correzioni AI. Da essi si ricalcolano i
+# KPI esatti per qualsiasi combinazione di filtri reparto/clinico, anche per le
+# visite che attraversano più celle.
+
+CELL_KEYS = ["department", "clinician_id"]
+REQUIRED_COLUMNS = ["visit_id", "department", "clinician_id", "activity", "minutes"]
+KEEP_VERSIONS = 5
+PREDICTION_TABLES = ["predictions", "prediction_cube"]
+
+def file_digest(path: str) -> str:
+    """Hash BLAKE2 del contenuto di un file, letto a blocchi."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_signature(paths: list) -> list:
+    """(percorso assoluto, dimensione, mtime) dei file: confronto rapido senza rileggerli."""
+    return [[os.path.abspath(p), os.path.getsize(p), os.path.getmtime(p)] for p in sorted(paths)]
+
+def cell_aggregates(df: pd.DataFrame) -> dict:
+    """
+    Cubi (reparto, clinico) di una partizione del log normalizzato.
+    """
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Colonne mancanti per lo snapshot: {', '.join(missing)}")
+    has_ai = "is_ai_note" in df.columns
+    ai = df["is_ai_note"].astype(bool) if has_ai else pd.Series(False, index=df.index)
+    work = pd.DataFrame({
+        "department": df["department"].astype(object),
+        "clinician_id": df["clinician_id"].astype(object),
+        "visit_id": df["visit_id"].astype(object),
+        "activity": df["activity"].astype(object),
+        "minutes": df["minutes"],
+        "after_hours_minutes": df["after_hours_minutes"].fillna(0) if "after_hours_minutes" in df.columns else 0,
+        "is_ai_note": ai,
+    })
+    visits = work[work["visit_id"].notna()].groupby(CELL_KEYS + ["visit_id"], dropna=False).agg(VISIT_AGG)
+    # attività mancanti incluse: servono per il totale dei minuti
+    activity = work.groupby(CELL_KEYS + ["activity"], dropna=False).agg(minutes=("minutes", "sum"), rows=("minutes", "size"))
+    edits = pd.DataFrame(columns=["ai_edit_sum", "ai_edit_count"])
+    if has_ai and "ai_edit_minutes" in df.columns:
+        docs = work.assign(ai_edit=df["ai_edit_minutes"])[(work["activity"] == "documentation") & ai]
+        edits = docs.groupby(CELL_KEYS, dropna=False)["ai_edit"].agg(ai_edit_sum="sum", ai_edit_count="count")
+    return {"visits": visits, "activity": activity, "edits": edits, "has_ai": has_ai}
+
+def cell_partial(path: str) -> dict:
+    """Cubi di una partizione su disco (eseguita nei worker)."""
+    return cell_aggregates(load_log_file(path))
+
+def merge_cells(partials: list) -> dict:
+    """Unisce i cubi di più partizioni; le visite divise tra file vengono ricomposte."""
+    def merge(name, agg):
+        frames = [p[name] for p in partials if not p[name].empty]
+        if not frames:
+            return partials[0][name].reset_index()
+        return pd.concat(frames).groupby(level=list(range(frames[0].index.nlevels)), dropna=False).agg(agg).reset_index()
+
+    return {
+        "visits": merge("visits", VISIT_AGG),
+        "activity": merge("activity", {"minutes": "sum", "rows": "sum"}),
+        "edits": merge("edits", {"ai_edit_sum": "sum", "ai_edit_count": "sum"}),
+        "has_ai": any(p["has_ai"] for p in partials),
+    }
+
+def snapshot_cells(source, workers: int | None = None) -> dict:
+    """Cubi uniti di tutti i file di source, una lettura per file in parallelo."""
+    return merge_cells(map_partitions(cell_partial, resolve_paths(source), workers))
+
+def _mask(frame: pd.DataFrame, departments=None, clinicians=None) -> pd.Series:
+    mask = pd.Series(True, index=frame.index)
+    if departments is not None:
+        mask &= frame["department"].isin(departments)
+    if clinicians is not None:
+        mask &= frame["clinician_id"].isin(clinicians)
+    return mask
+
+def kpis_from_cells(cells: dict, departments=None, clinicians=None) -> dict:
+    """
+    KPI (formato di compute_partitioned) per i reparti/clinici selezionati,
+    ricalcolati dai cubi senza rileggere il log.
+    """
+    visits = cells["visits"][_mask(cells["visits"], departments, clinicians)]
+    activity = cells["activity"][_mask(cells["activity"], departments, clinicians)]
+    edits = cells["edits"][_mask(cells["edits"], departments, clinicians)]
+    partial = {
+        "rows": int(activity["rows"].sum()),
+        "minutes": float(activity["minutes"].sum()),
+        "visits": visits.groupby("visit_id")[list(VISIT_AGG)].agg(VISIT_AGG),
+        "has_after": True,
+        "has_ai": cells["has_ai"],
+        "activity": activity.dropna(subset=["activity"]).groupby("activity")["minutes"].sum(),
+        "clinicians": activity.groupby("clinician_id")["minutes"].sum(),
+        "ai_edit": (float(edits["ai_edit_sum"].sum()), int(edits["ai_edit_count"].sum())) if len(edits) else None,
+    }
+    return finalize(partial)
+
+# --- Scrittura ---
+
+def current_version(snapshot_dir: str) -> str | None:
+    """Versione attiva (contenuto di CURRENT), None se non ci sono snapshot."""
+    try:
+        with open(os.path.join(snapshot_dir, "CURRENT"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _activate(snapshot_dir: str, version: str) -> None:
+    # scrittura su file temporaneo e os.replace: sostituzione atomica di CURRENT
+    tmp = os.path.join(snapshot_dir, f".CURRENT-{uuid.uuid4().hex}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(snapshot_dir, "CURRENT"))
+
+def prune_versions(snapshot_dir: str, keep: int = KEEP_VERSIONS) -> None:
+    """Rimuove le versioni più vecchie oltre le ultime keep (mai quella attiva)."""
+    active = current_version(snapshot_dir)
+    versions = sorted(d for d in os.listdir(snapshot_dir) if not d.startswith(".") and os.path.isdir(os.path.join(snapshot_dir, d)))
+    for version in versions[:-keep] if keep else versions:
+        if version != active:
+            shutil.rmtree(os.path.join(snapshot_dir, version), ignore_errors=True)
+
+@instrument("snapshots.build_snapshot")
+def build_snapshot(source, snapshot_dir: str = "snapshots", workers: int | None = None,
+                   predictions: pd.DataFrame | None = None, force: bool = False, cells: dict | None = None) -> dict:
+    """
+    Materializza KPI, cubi reparto/clinico ed eventuali previsioni batch dei log
+    di source in una nuova versione e la attiva. Se la versione attiva ha già
+    lo stesso hash dei dati e gli stessi file non ricalcola nulla. Senza
+    predictions la nuova versione mantiene le previsioni di quella attiva.
+    cells accetta i cubi già calcolati sugli stessi file (es. dalla pipeline),
+    che così non vengono riletti. Restituisce il manifest.
+    """
+    paths = resolve_paths(source)
+    signature = file_signature(paths)
+    source_hash = hashlib.blake2b(
+        "".join(sorted(map_partitions(file_digest, paths, workers))).encode(), digest_size=20
+    ).hexdigest()
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    active = current_version(snapshot_dir)
+    if active and not force and predictions is None:
+        manifest = read_manifest(snapshot_dir, active)
+        if manifest["source_hash"] == source_hash and manifest["signature"] == signature:
+            return manifest
+
+    if cells is None:
+        cells = snapshot_cells(paths, workers)
+    result = kpis_from_cells(cells)
+    tables = {
+        "visit_cells": cells["visits"],
+        "activity_cells": cells["activity"],
+        "edit_cells": cells["edits"],
+        "share_time_by_activity": result["share_time_by_activity"].rename_axis("activity").reset_index(),
+        "clinicians_workload": result["clinicians_workload"],
+        "outlier_visits": result["outlier_visits"],
+    }
+    # previsioni della versione attiva riportate così come sono (copia dei file)
+    # quando il rebuild non ne fornisce di nuove, per non perdere il cubo
+    carried, predictions_version = [], None
+    if predictions is None and active:
+        previous = read_manifest(snapshot_dir, active)
+        carried = [name for name in PREDICTION_TABLES if name in previous["tables"]]
+        if carried:
+            predictions_version = previous.get("predictions_version", active)
+    elif predictions is not None:
+        tables["predictions"] = predictions
+        tables["prediction_cube"] = predictions.groupby(["reparto", "diagnosi_principale"], as_index=False)["giorni_previsti"].agg(
+            giorni_previsti="mean", ricoveri="count"
+        )
+
+    version = f"{datetime.now():%Y%m%dT%H%M%S}-{source_hash[:12]}"
+    if os.path.exists(os.path.join(snapshot_dir, version)):
+        # stessi dati già pubblicati nello stesso secondo (es. due rebuild forzati)
+        version = f"{version}-{uuid.uuid4().hex[:8]}"
+    manifest = {
+        "version": version,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "source_hash": source_hash,
+        "signature": signature,
+        "rows": result["rows"],
+        "files": len(paths),
+        "has_ai": cells["has_ai"],
+        "kpi_overview": result["kpi_overview"],
+        "departments": sorted(cells["activity"]["department"].dropna().astype(str).unique()),
+        "clinicians": sorted(cells["activity"]["clinician_id"].dropna().astype(str).unique()),
+        "tables": sorted([*tables, *carried]),
+        # versione in cui le previsioni sono state calcolate (None se assenti)
+        "predictions_version": version if predictions is not None else predictions_version,
+    }
+    tmp = os.path.join(snapshot_dir, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp)
+    for name, table in tables.items():
+        table.to_parquet(os.path.join(tmp, f"{name}.parquet"), index=False)
+    for name in carried:
+        shutil.copyfile(os.path.join(snapshot_dir, active, f"{name}.parquet"), os.path.join(tmp, f"{name}.parquet"))
+    with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.rename(tmp, os.path.join(snapshot_dir, version))
+    _activate(snapshot_dir, version)
+    prune_versions(snapshot_dir)
+    return manifest
+
+# --- Lettura ---
+
+def read_manifest(snapshot_dir: str, version: str) -> dict:
+    with open(os.path.join(snapshot_dir, version, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+@instrument("snapshots.load_snapshot")
+def load_snapshot(snapshot_dir: str, version: str) -> dict:
+    """Manifest e tabelle di una versione, da trattare in sola lettura."""
+    manifest = read_manifest(snapshot_dir, version)
+    tables = {name: pd.read_parquet(os.path.join(snapshot_dir, version, f"{name}.parquet")) for name in manifest["tables"]}
+    return {"manifest": manifest, "tables": tables}
+
+def snapshot_matches(snapshot: dict, signature: list) -> bool:
+    """True se lo snapshot è stato calcolato esattamente su questi file."""
+    return snapshot["manifest"]["signature"] == signature
+
+def snapshot_kpis(snapshot: dict, departments=None, clinicians=None) -> dict:
+    """
+    KPI dallo snapshot: senza filtri i risultati precalcolati, altrimenti
+    ricalcolati dai cubi reparto/clinico.
+    """
+    manifest, tables = snapshot["manifest"], snapshot["tables"]
+    if departments is None and clinicians is None:
+        return {
+            "rows": manifest["rows"],
+            "files": manifest["files"],
+            "kpi_overview": manifest["kpi_overview"],
+            "share_time_by_activity": tables["share_time_by_activity"].set_index("activity"),
+            "clinicians_workload": tables["clinicians_workload"],
+            "outlier_visits": tables["outlier_visits"],
+        }
+    cells = {"visits": tables["visit_cells"], "activity": tables["activity_cells"], "edits": tables["edit_cells"], "has_ai": manifest["has_ai"]}
+    result = kpis_from_cells(cells, departments, clinicians)
+    result["files"] = manifest["files"]
+    return result
+
+def snapshot_prediction(snapshot: dict, reparto: str, diagnosi: str) -> float | None:
+    """Durata media prevista nel batch per reparto e diagnosi, se presente nello snapshot."""
+    cube = snapshot["tables"].get("prediction_cube")
+    if cube is None:
+        return None
+    match = cube[(cube["reparto"] == reparto) & (cube["diagnosi_principale"] == diagnosi)]
+    return float(match["giorni_previsti"].iloc[0]) if len(match) else None
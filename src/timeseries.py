@@ -0,0 +1,180 @@
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+from src.perf import instrument
+
+# bucket -> frequenza pandas (le settimane iniziano il lunedì)
+FREQS = {"hour": "h", "day": "D", "week": "W-MON"}
+SUM_COLUMNS = ["minutes", "after_hours_minutes", "visits", "ai_visits"]
+TREND_COLUMNS = SUM_COLUMNS + ["after_hours_share", "ai_note_share"]
+
+# cache LRU dei trend per sorgente append-only: (key, freq, by, window) -> stato.
+# È condivisa tra le sessioni (thread) del processo, quindi limitata e protetta da lock
+TREND_CACHE_SIZE = 32
+_TREND_CACHE: OrderedDict = OrderedDict()
+_TREND_LOCK = threading.Lock()
+
+def bucket_start(ts: pd.Series, freq: str = "day") -> pd.Series:
+    """
+    Inizio del bucket orario, giornaliero o settimanale di ogni timestamp.
+    """
+    if freq == "week":
+        day = ts.dt.floor("D")
+        return day - pd.to_timedelta(day.dt.weekday, unit="D")
+    return ts.dt.floor(FREQS[freq])
+
+def _after_hours(df: pd.DataFrame, minutes: np.ndarray):
+    # minuti esatti da src/afterhours.py se presenti, altrimenti il flag per riga
+    if "after_hours_minutes" in df.columns:
+        return df["after_hours_minutes"].fillna(0).to_numpy()
+    if "is_after_hours" in df.columns:
+        return np.where(df["is_after_hours"].to_numpy(dtype=bool), minutes, 0)
+    return 0
+
+def _add_shares(frame: pd.DataFrame) -> pd.DataFrame:
+    minutes = frame["minutes"].replace(0, np.nan)
+    visits = frame["visits"].replace(0, np.nan)
+    frame["after_hours_share"] = (frame["after_hours_minutes"] / minutes * 100).fillna(0.0).round(1)
+    frame["ai_note_share"] = (frame["ai_visits"] / visits * 100).fillna(0.0).round(1)
+    return frame
+
+@instrument("timeseries.bucket_aggregates")
+def bucket_aggregates(df: pd.DataFrame, freq: str = "day", by: str | None = "clinician_id") -> pd.DataFrame:
+    """
+    Minuti, minuti after-hours, visite e visite con nota AI per bucket temporale
+    (e per clinico/reparto se by è indicato), calcolati in un solo passaggio.
+    Una visita che attraversa due bucket viene contata in entrambi.
+    """
+    keys = ["bucket"] + ([by] if by else [])
+    if df.empty or "start_time" not in df.columns or "minutes" not in df.columns or (by and by not in df.columns):
+        return pd.DataFrame(columns=keys + TREND_COLUMNS)
+
+    minutes = df["minutes"].to_numpy()
+    work = pd.DataFrame({
+        "bucket": bucket_start(df["start_time"], freq).to_numpy(),
+        "minutes": minutes,
+        "after_hours_minutes": _after_hours(df, minutes),
+        "visit_id": df["visit_id"].to_numpy() if "visit_id" in df.columns else np.arange(len(df)),
+        "ai": df["is_ai_note"].to_numpy(dtype=bool) if "is_ai_note" in df.columns else False,
+    })
+    if by:
+        work[by] = df[by].to_numpy()
+
+    agg = work.groupby(keys, observed=True)[["minutes", "after_hours_minutes"]].sum()
+    visits = work.drop_duplicates(keys + ["visit_id"])
+    agg["visits"] = visits.groupby(keys, observed=True).size()
+    # una visita con nota AI può averla su una riga diversa dalla prima del bucket
+    ai_visits = work[work["ai"]].drop_duplicates(keys + ["visit_id"]).groupby(keys, observed=True).size()
+    agg["ai_visits"] = ai_visits.reindex(agg.index, fill_value=0)
+    return _add_shares(agg.reset_index())
+
+def _to_wide(agg: pd.DataFrame, by: str | None, index: pd.DatetimeIndex) -> dict:
+    # una tabella bucket x gruppo per ogni colonna sommabile, con i bucket vuoti a zero
+    if by is None:
+        grouped = agg.set_index("bucket")[SUM_COLUMNS]
+        return {col: grouped[[col]].reindex(index, fill_value=0) for col in SUM_COLUMNS}
+    return {
+        col: agg.pivot_table(index="bucket", columns=by, values=col, aggfunc="sum", fill_value=0, observed=True)
+        .reindex(index, fill_value=0)
+        for col in SUM_COLUMNS
+    }
+
+def _to_long(wide: dict, by: str | None) -> pd.DataFrame:
+    if by is None:
+        long = pd.concat({col: wide[col].iloc[:, 0] for col in SUM_COLUMNS}, axis=1)
+        long.index.name = "bucket"
+    else:
+        long = pd.concat({col: wide[col].stack() for col in SUM_COLUMNS}, axis=1)
+        long.index.names = ["bucket", by]
+    long = long[(long["minutes"] > 0) | (long["visits"] > 0)].reset_index()
+    return _add_shares(long)
+
+@instrument("timeseries.rolling_trend")
+def rolling_trend(agg: pd.DataFrame, freq: str = "day", by: str | None = "clinician_id", window: int = 7) -> pd.DataFrame:
+    """
+    Somme mobili su window bucket dell'output di bucket_aggregates; le quote sono
+    ricalcolate dalle somme della finestra (non mediate). I bucket senza attività
+    contano come zero.
+    """
+    if agg.empty:
+        return agg
+    index = pd.date_range(agg["bucket"].min(), agg["bucket"].max(), freq=FREQS[freq])
+    wide = _to_wide(agg, by, index)
+    rolled = {col: frame.rolling(window, min_periods=1).sum() for col, frame in wide.items()}
+    return _to_long(rolled, by)
+
+@instrument("timeseries.workload_trend")
+def workload_trend(df: pd.DataFrame, key: str, freq: str = "day", by: str | None = "clinician_id", window: int = 7) -> pd.DataFrame:
+    """
+    Come rolling_trend(bucket_aggregates(df)), ma con cache per sorgente: key
+    identifica un log a cui vengono solo aggiunte righe. Alla chiamata successiva
+    si ricalcolano i bucket dall'ultimo (possibilmente parziale) in poi, e le
+    finestre mobili ripartono dalle ultime window - 1 righe già calcolate.
+    """
+    if df.empty or "start_time" not in df.columns:
+        return bucket_aggregates(df, freq, by)
+
+    cache_key = (key, freq, by, window)
+    with _TREND_LOCK:
+        entry = _TREND_CACHE.get(cache_key)
+        if entry is not None:
+            _TREND_CACHE.move_to_end(cache_key)
+    if entry is not None:
+        cutoff = entry["last_bucket"]
+        if df["start_time"].is_monotonic_increasing:
+            # log in ordine di tempo: le righe da ricalcolare si trovano per bisezione
+            start = np.searchsorted(df["start_time"].to_numpy(), np.datetime64(cutoff), side="left")
+            new_rows = df.iloc[start:]
+        else:
+            # altro ordinamento (es. per reparto/clinico): un confronto vettoriale costa meno di un sort
+            new_rows = df[df["start_time"] >= cutoff]
+    else:
+        entry, cutoff, new_rows = None, None, df
+
+    new_agg = bucket_aggregates(new_rows, freq, by)
+    if new_agg.empty:
+        return _to_long(entry["rolled"], by) if entry else new_agg
+
+    first = cutoff if cutoff is not None else new_agg["bucket"].min()
+    index = pd.date_range(first, new_agg["bucket"].max(), freq=FREQS[freq])
+    new_wide = _to_wide(new_agg, by, index)
+
+    sums, rolled = {}, {}
+    for col in SUM_COLUMNS:
+        if entry is None:
+            sums[col] = new_wide[col]
+            rolled[col] = new_wide[col].rolling(window, min_periods=1).sum()
+            continue
+        old = entry["sums"][col]
+        old = old[old.index < cutoff]
+        columns = old.columns.union(new_wide[col].columns)
+        old = old.reindex(columns=columns, fill_value=0)
+        new = new_wide[col].reindex(columns=columns, fill_value=0)
+        # finestra mobile solo sui nuovi bucket, innescata dalla coda già nota
+        seed = old.tail(window - 1)
+        tail = pd.concat([seed, new]).rolling(window, min_periods=1).sum().iloc[len(seed):]
+        old_rolled = entry["rolled"][col]
+        old_rolled = old_rolled[old_rolled.index < cutoff].reindex(columns=columns, fill_value=0)
+        sums[col] = pd.concat([old, new])
+        rolled[col] = pd.concat([old_rolled, tail])
+
+    with _TREND_LOCK:
+        _TREND_CACHE[cache_key] = {
+            "sums": sums,
+            "rolled": rolled,
+            "last_bucket": index[-1],
+        }
+        _TREND_CACHE.move_to_end(cache_key)
+        while len(_TREND_CACHE) > TREND_CACHE_SIZE:
+            _TREND_CACHE.popitem(last=False)
+    return _to_long(rolled, by)
+
+def clear_trend_cache(key: str | None = None) -> None:
+    """Svuota la cache dei trend (tutta o solo quella della sorgente indicata)."""
+    with _TREND_LOCK:
+        for cache_key in [k for k in _TREND_CACHE if key is None or k[0] == key]:
+            del _TREND_CACHE[cache_key]
@@ -5,8 +5,13 @@ from datetime import datetime, timedelta
 from dateutil import tz
 import fitz  # PyMuPDF
 
+from src.afterhours import after_hours_minutes
+from src.schema import ERROR_COLUMNS, align_tables, coerce_types
+from src.perf import instrument
+
 ACTIVITIES = ["documentation", "chart_review", "orders", "inbox"]
 
+@instrument("load.create_synthetic_logs")
 def create_synthetic_logs(n_visits: int = 300, n_clinicians: int = 10, seed: int = 42) -> pd.DataFrame:
     rng = np.random.default_rng(seed)
     clinicians = [f"C{idx:02d}" for idx in range(1, n_clinicians + 1)]
@@ -19,7 +24,7 @@ def create_synthetic_logs(n_visits: int = 300, n_clinicians: int = 10, seed: int
 
     for dept in departments:
         for _ in range(visits_per_department):
-            visit_id = f"V{{visit_id_counter:05d}}"
+            visit_id = f"V{visit_id_counter:05d}"
             clinician = rng.choice(clinicians)
             # distribuzione dei minuti per attività (sommatoria ≈ 12–20 min/visita)
             doc = max(4, int(rng.normal(6, 2)))
@@ -37,7 +42,6 @@ def create_synthetic_logs(n_visits: int = 300, n_clinicians: int = 10, seed: int
 
             for act, mins in zip(ACTIVITIES, buckets):
                 end = t + timedelta(minutes=mins)
-                is_after = end.hour >= 18
                 rows.append({
                     "visit_id": visit_id,
                     "clinician_id": clinician,
@@ -46,7 +50,6 @@ def create_synthetic_logs(n_visits: int = 300, n_clinicians: int = 10, seed: int
                     "start_time": t,
                     "end_time": end,
                     "minutes": mins,
-                    "is_after_hours": bool(is_after),
                     "is_ai_note": bool(ai_flag if act == "documentation" else False),
                     "ai_edit_minutes": ai_edit if act == "documentation" and ai_flag else 0,
                 })
@@ -55,38 +58,80 @@ def create_synthetic_logs(n_visits: int = 300, n_clinicians: int = 10, seed: int
             # ~10% di lavoro extra-orario (pajama time)
             if rng.random() < 0.1:
                 extra = int(max(5, rng.normal(12, 5)))
+                pajama_start = t.replace(hour=19, minute=int(rng.integers(0, 59)))
                 rows.append({
                     "visit_id": visit_id,
                     "clinician_id": clinician,
                     "department": dept,
                     "activity": "documentation",
-                    "start_time": t.replace(hour=19, minute=int(rng.integers(0, 59))),
-                    "end_time": t.replace(hour=19, minute=int(rng.integers(0, 59))) + timedelta(minutes=extra),
+                    "start_time": pajama_start,
+                    "end_time": pajama_start + timedelta(minutes=extra),
                     "minutes": extra,
-                    "is_after_hours": True,
                     "is_ai_note": False,
                     "ai_edit_minutes": 0,
                 })
             visit_id_counter += 1
 
     df = pd.DataFrame(rows)
+    # after-hours dai minuti effettivamente fuori orario (sera, mattina presto, weekend)
+    df["after_hours_minutes"] = after_hours_minutes(df)
+    df["is_after_hours"] = df["after_hours_minutes"] > 0
     return df
 
+@instrument("load.load_csv")
 def load_csv(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path, parse_dates=["start_time", "end_time"])
-    # se manca la colonna minutes, calcolala
-    if "minutes" not in df.columns:
-        df["minutes"] = (df["end_time"] - df["start_time"]).dt.total_seconds() // 60
+    return normalize_logs(pd.read_csv(path, parse_dates=["start_time", "end_time"]))
+
+@instrument("load.load_parquet")
+def load_parquet(path: str) -> pd.DataFrame:
+    return normalize_logs(pd.read_parquet(path))
+
+def load_log_file(path: str) -> pd.DataFrame:
+    """Carica un file di log CSV (anche compresso) o Parquet in base all'estensione."""
+    return load_parquet(path) if str(path).endswith(".parquet") else load_csv(path)
+
+def normalize_logs(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Colonne derivate comuni a tutti i loader: minutes, booleani e minuti after-hours.
+    """
+    # se manca la colonna minutes, calcolala (orari non interpretabili -> NaN)
+    if "minutes" not in df.columns and {"start_time", "end_time"} <= set(df.columns):
+        start = pd.to_datetime(df["start_time"], errors="coerce")
+        end = pd.to_datetime(df["end_time"], errors="coerce")
+        df["minutes"] = (end - start).dt.total_seconds() // 60
     # cast booleani se arrivano come 0/1
     for col in ["is_after_hours", "is_ai_note"]:
         if col in df.columns:
             df[col] = df[col].astype(bool)
+    # minuti after-hours ricalcolati dagli intervalli quando il file non li ha:
+    # in quel caso il flag segue i minuti calcolati e quello del file resta solo
+    # per le righe senza orari validi
+    if "after_hours_minutes" not in df.columns:
+        df["after_hours_minutes"] = after_hours_minutes(df)
+        computed = df["after_hours_minutes"]
+        if "is_after_hours" in df.columns:
+            df["is_after_hours"] = (computed > 0).where(computed.notna(), df["is_after_hours"]).astype(bool)
+        else:
+            df["is_after_hours"] = computed > 0
+    elif "is_after_hours" not in df.columns:
+        df["is_after_hours"] = df["after_hours_minutes"] > 0
     return df
 
+@instrument("load.load_pdf")
 def load_pdf(file) -> pd.DataFrame:
     """
     Estrae tabelle da un file PDF e le converte in un DataFrame pandas.
     """
+    return load_pdf_with_report(file)[0]
+
+@instrument("load.load_pdf_with_report")
+def load_pdf_with_report(file) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Come load_pdf, ma restituisce anche le celle non interpretabili (riga,
+    pagina, colonna, valore, motivo). Le tabelle delle pagine vengono allineate
+    allo schema canonico del log (src/schema.py) e convertite ai tipi attesi;
+    le righe con errori sono escluse dal log.
+    """
     pdf_document = fitz.open(stream=file.read(), filetype="pdf")
     all_tables = []
 
@@ -95,32 +140,15 @@ def load_pdf(file) -> pd.DataFrame:
         tables = page.find_tables()
         if tables:
             for table in tables:
-                all_tables.append(table.to_pandas())
+                all_tables.append((table.to_pandas(), page_num + 1))
 
-    if not all_tables:
-        return pd.DataFrame() # Ritorna un DF vuoto se non ci sono tabelle
+    df, _ = align_tables(all_tables)
+    if df.empty:
+        return pd.DataFrame(), pd.DataFrame(columns=ERROR_COLUMNS) # Ritorna un DF vuoto se non ci sono tabelle
 
-    # Concatena tutti i DataFrame delle tabelle trovate
-    df = pd.concat(all_tables, ignore_index=True)
-
-    # --- Post-processing simile a load_csv ---
-    # Converte le colonne di data/ora se presenti
-    for col in ["start_time", "end_time"]:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-
-    # Calcola i minuti se necessario
-    if "minutes" not in df.columns and "start_time" in df.columns and "end_time" in df.columns:
-        df["minutes"] = (df["end_time"] - df["start_time"]).dt.total_seconds() // 60
-
-    # Converte colonne booleane
-    for col in ["is_after_hours", "is_ai_note"]:
-        if col in df.columns:
-            # Converte 0/1, "True"/"False" in booleani
-            if df[col].dtype != bool:
-                df[col] = df[col].apply(lambda x: str(x).lower() in ['true', '1', 'yes', 'y'])
-
-    return df
+    df, errors = coerce_types(df)
+    # stesse colonne derivate di load_csv (minutes, minuti after-hours)
+    return normalize_logs(df), errors
 
 def extract_text_from_pdf(file) -> str:
     """